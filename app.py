@@ -9,37 +9,62 @@ from flask import (
     send_from_directory,
     jsonify,
     g,
+    has_app_context,
+    has_request_context,
+    Response,
+    stream_with_context,
 )
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from urllib.parse import urlparse
 from email.message import EmailMessage
-from functools import wraps
+from functools import partial, wraps
+from collections import OrderedDict
 
+import atexit
 import base64
+import concurrent.futures
 import hashlib
+import http.server
 import io
 import json
 import logging
+import multiprocessing
 import os
+import queue
 import requests
+import requests.adapters
+import re
 import secrets
+import select
+import shutil
 import smtplib
+import socketserver
+import threading
 import time
 import uuid
+import weakref
+import zipfile
 
+import h2.config
+import h2.connection
+import h2.events
 import httpx
 import jwt
 
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
 import stripe
+import click
 from openai import OpenAI
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
+from invoice_pdf import INVOICE_PDF_STYLES, render_invoice_pdf
+
 # -------------------------
 # APP / BRAND
 # -------------------------
@@ -49,6 +74,11 @@ DEFAULT_BRAND_COLOR = "#020617"
 DEFAULT_ACCENT_COLOR = "#3A8BFF"
 ALLOWED_STATUSES = {"Sent", "Paid", "Overdue"}
 
+INVOICE_LIST_DEFAULT_PAGE_SIZE = int(os.environ.get("INVOICE_LIST_DEFAULT_PAGE_SIZE", "50"))
+INVOICE_LIST_MAX_PAGE_SIZE = 200
+# Filtered counts stop at this many rows and are shown as "1000+".
+INVOICE_LIST_COUNT_CAP = 1000
+
 PUBLIC_VIEW_DEDUPE_MINUTES = int(os.environ.get("PUBLIC_VIEW_DEDUPE_MINUTES", "30"))
 DEFAULT_TAX_RESERVE_PERCENT = 25.0
 
@@ -67,41 +97,6 @@ PAYMENT_METHOD_LABELS = {
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 
-@app.context_processor
-def inject_unread_message_count():
-    try:
-        user = get_current_user()
-        if not user:
-            return {"unread_message_count": 0}
-
-        user_id = user["id"]
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            SELECT COUNT(*)
-            FROM messages m
-            JOIN conversations c ON m.conversation_id = c.id
-            WHERE (c.business_user_id = %s OR c.client_user_id = %s)
-              AND m.sender_user_id != %s
-              AND COALESCE(m.is_read, FALSE) = FALSE
-            """,
-            (user_id, user_id, user_id),
-        )
-
-        count = cur.fetchone()[0] or 0
-
-        cur.close()
-        conn.close()
-
-        return {"unread_message_count": count}
-
-    except Exception as e:
-        logger.warning("Unread message count failed: %s", e)
-        return {"unread_message_count": 0}
-
 # -------------------------
 # LOGGING
 # -------------------------
@@ -152,16 +147,88 @@ APNS_TEAM_ID = os.environ.get("APNS_TEAM_ID")
 APNS_BUNDLE_ID = os.environ.get("APNS_BUNDLE_ID", "com.billbeam.app")
 APNS_AUTH_KEY = os.environ.get("APNS_AUTH_KEY")
 APNS_USE_SANDBOX = os.environ.get("APNS_USE_SANDBOX", "false").lower() in ("1", "true", "yes", "on")
+# Override the APNs origin (e.g. http://127.0.0.1:8443 for `flask fake-apns-server`).
+APNS_BASE_URL = (os.environ.get("APNS_BASE_URL") or "").rstrip("/")
+APNS_MAX_CONCURRENT_PUSHES = int(os.environ.get("APNS_MAX_CONCURRENT_PUSHES", "16"))
 
 _APNS_JWT_CACHE = {
     "token": None,
     "created_at": 0,
 }
 
+# Filled in by init_db(): whether the pg_trgm extension could be enabled and
+# whether `flask migrate-search-columns` has added the search_vector columns.
+_SEARCH_FEATURES = {
+    "trigram": False,
+    "fulltext": False,
+}
+
 APP_TIMEZONE = ZoneInfo(os.environ.get("APP_TIMEZONE", "America/Los_Angeles"))
 IS_PRODUCTION = os.environ.get("FLASK_ENV", "").lower() == "production" or os.environ.get("APP_ENV", "").lower() == "production"
 IS_DEBUG_MODE = os.environ.get("FLASK_DEBUG", "").lower() in ("1", "true", "yes", "on") or not IS_PRODUCTION
 
+# Cadence for `flask reconcile-invoice-statuses --loop`.
+INVOICE_STATUS_RECONCILE_INTERVAL_SECONDS = int(os.environ.get("INVOICE_STATUS_RECONCILE_INTERVAL_SECONDS", "300"))
+
+# Email outbox delivery (`flask email-outbox-worker`). RESEND_API_BASE_URL can
+# point at `flask fake-resend-server` for local testing.
+RESEND_API_BASE_URL = os.environ.get("RESEND_API_BASE_URL", "https://api.resend.com").rstrip("/")
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get("EMAIL_OUTBOX_RETRY_BASE_SECONDS", "30"))
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = int(os.environ.get("EMAIL_OUTBOX_RETRY_MAX_SECONDS", "3600"))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.environ.get("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS = int(os.environ.get("EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS", "600"))
+
+# Live message delivery (SSE / long-poll), per worker process. Every open
+# stream or long-poll holds a request thread, so the subscriber cap comes
+# from WEB_THREADS (keep it equal to gunicorn's --threads), less
+# MESSAGE_STREAM_RESERVED_THREADS left free for ordinary requests. At the
+# cap, clients fall back to short polls.
+WEB_THREADS = max(1, int(os.environ.get("WEB_THREADS", "32")))
+MESSAGE_STREAM_RESERVED_THREADS = int(os.environ.get("MESSAGE_STREAM_RESERVED_THREADS", "8"))
+MESSAGE_STREAM_CHANNEL = "conversation_messages"
+MESSAGE_STREAM_MAX_SUBSCRIBERS = int(
+    os.environ.get("MESSAGE_STREAM_MAX_SUBSCRIBERS", max(WEB_THREADS - MESSAGE_STREAM_RESERVED_THREADS, 0))
+)
+MESSAGE_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("MESSAGE_STREAM_HEARTBEAT_SECONDS", "20"))
+MESSAGE_STREAM_MAX_SECONDS = float(os.environ.get("MESSAGE_STREAM_MAX_SECONDS", "300"))
+MESSAGE_STREAM_IDLE_SECONDS = float(os.environ.get("MESSAGE_STREAM_IDLE_SECONDS", "30"))
+MESSAGE_STREAM_RETRY_MS = int(os.environ.get("MESSAGE_STREAM_RETRY_MS", "3000"))
+MESSAGE_LONG_POLL_SECONDS = float(os.environ.get("MESSAGE_LONG_POLL_SECONDS", "25"))
+MESSAGE_PAGE_SIZE = int(os.environ.get("MESSAGE_PAGE_SIZE", "50"))
+MESSAGE_PAGE_MAX_SIZE = 200
+MESSAGE_INBOX_PAGE_SIZE = int(os.environ.get("MESSAGE_INBOX_PAGE_SIZE", "30"))
+MESSAGE_PREVIEW_CHARS = 140
+
+# How often CLI/worker processes write buffered invoice_events rows.
+INVOICE_EVENT_FLUSH_SECONDS = float(os.environ.get("INVOICE_EVENT_FLUSH_SECONDS", "1"))
+
+# Push fan-out (`flask notification-push-worker`). Notifications for the same
+# user that land within the coalesce window go out as a single push.
+NOTIFICATION_PUSH_CHANNEL = "notification_push"
+NOTIFICATION_PUSH_COALESCE_SECONDS = float(os.environ.get("NOTIFICATION_PUSH_COALESCE_SECONDS", "2"))
+NOTIFICATION_PUSH_BATCH_USERS = int(os.environ.get("NOTIFICATION_PUSH_BATCH_USERS", "100"))
+NOTIFICATION_PUSH_POLL_SECONDS = float(os.environ.get("NOTIFICATION_PUSH_POLL_SECONDS", "30"))
+
+# Stripe webhook queue (`flask stripe-events-worker`).
+STRIPE_EVENTS_CHANNEL = "stripe_events"
+STRIPE_EVENTS_WORKERS = int(os.environ.get("STRIPE_EVENTS_WORKERS", "4"))
+STRIPE_EVENTS_BATCH_SIZE = int(os.environ.get("STRIPE_EVENTS_BATCH_SIZE", "20"))
+STRIPE_EVENTS_MAX_ATTEMPTS = int(os.environ.get("STRIPE_EVENTS_MAX_ATTEMPTS", "10"))
+STRIPE_EVENTS_RETRY_BASE_SECONDS = int(os.environ.get("STRIPE_EVENTS_RETRY_BASE_SECONDS", "30"))
+STRIPE_EVENTS_RETRY_MAX_SECONDS = int(os.environ.get("STRIPE_EVENTS_RETRY_MAX_SECONDS", "3600"))
+STRIPE_EVENTS_POLL_SECONDS = float(os.environ.get("STRIPE_EVENTS_POLL_SECONDS", "10"))
+STRIPE_EVENTS_LOCK_TIMEOUT_SECONDS = int(os.environ.get("STRIPE_EVENTS_LOCK_TIMEOUT_SECONDS", "600"))
+
+# In-process cache for /business-search and its autocomplete endpoint.
+BUSINESS_SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("BUSINESS_SEARCH_CACHE_TTL_SECONDS", "30"))
+BUSINESS_SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("BUSINESS_SEARCH_CACHE_MAX_ENTRIES", "512"))
+
+# In-process cache for /api/notifications/summary, keyed by notification version.
+NOTIFICATION_SUMMARY_CACHE_TTL_SECONDS = float(os.environ.get("NOTIFICATION_SUMMARY_CACHE_TTL_SECONDS", "30"))
+NOTIFICATION_SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("NOTIFICATION_SUMMARY_CACHE_MAX_ENTRIES", "2048"))
+
 # -------------------------
 # APP SECURITY / SESSION
 # -------------------------
@@ -210,6 +277,17 @@ app.config["MAX_INVOICE_IMAGE_UPLOAD_BYTES"] = int(
     os.environ.get("MAX_INVOICE_IMAGE_UPLOAD_BYTES", str(5 * 1024 * 1024))
 )
 
+# Rendered invoice PDFs, content-addressed by their inputs. Bump
+# INVOICE_PDF_RENDER_VERSION whenever the PDF layout changes.
+INVOICE_PDF_CACHE_ROOT = os.path.join(PERSISTENT_STORAGE_ROOT, "cache", "invoice_pdfs")
+INVOICE_PDF_CACHE_MEMORY_MAX_BYTES = int(os.environ.get("INVOICE_PDF_CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+INVOICE_PDF_RENDER_VERSION = "3"
+# Worker processes for PDF rendering (0 renders inline in the web worker),
+# and how long a download waits on a queued render before drawing it itself.
+INVOICE_PDF_RENDER_WORKERS = int(os.environ.get("INVOICE_PDF_RENDER_WORKERS", "2"))
+INVOICE_PDF_RENDER_WAIT_SECONDS = float(os.environ.get("INVOICE_PDF_RENDER_WAIT_SECONDS", "15"))
+os.makedirs(INVOICE_PDF_CACHE_ROOT, exist_ok=True)
+
 
 # -------------------------
 # TIME / PARSING HELPERS
@@ -702,20 +780,416 @@ def get_invoice_image_urls(invoice_id: int):
 
 
 # -------------------------
-# DB CONNECTION
+# DB CONNECTION POOL
 # -------------------------
-def get_db_connection():
+# One pool per process. Gunicorn forks workers after import, so each worker
+# gets its own pool and DB_POOL_MAX_SIZE caps the connections *per worker*
+# (workers x DB_POOL_MAX_SIZE must stay under Postgres max_connections).
+DB_POOL_MAX_SIZE = max(1, int(os.environ.get("DB_POOL_MAX_SIZE", "10")))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_MAX_LIFETIME_SECONDS = int(os.environ.get("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))
+DB_POOL_HEALTHCHECK_IDLE_SECONDS = int(os.environ.get("DB_POOL_HEALTHCHECK_IDLE_SECONDS", "30"))
+DB_POOL_SLOW_WAIT_MS = int(os.environ.get("DB_POOL_SLOW_WAIT_MS", "250"))
+
+
+def build_db_connect_kwargs():
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL environment variable is not set.")
 
     result = urlparse(DATABASE_URL)
-    return psycopg2.connect(
-        dbname=result.path[1:],
-        user=result.username,
-        password=result.password,
-        host=result.hostname,
-        port=result.port,
-    )
+    return {
+        "dbname": result.path[1:],
+        "user": result.username,
+        "password": result.password,
+        "host": result.hostname,
+        "port": result.port,
+    }
+
+
+class _PoolSlot:
+    __slots__ = ("raw", "created_at", "last_used_at")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class DatabasePool:
+    """
+    Small blocking connection pool for psycopg2.
+
+    psycopg2's built-in pools raise immediately when exhausted, so this one
+    waits (up to DB_POOL_TIMEOUT_SECONDS), health-checks connections that sat
+    idle, recycles connections older than DB_POOL_MAX_LIFETIME_SECONDS and
+    keeps wait-time counters for /health.
+    """
+
+    def __init__(self, connect_kwargs, max_size, timeout, max_lifetime, healthcheck_idle):
+        self._connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._pid = os.getpid()
+        self._stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats():
+        return {
+            "checkouts": 0,
+            "waited_checkouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "recycled_max_lifetime": 0,
+            "healthcheck_failures": 0,
+        }
+
+    def _reset_after_fork(self):
+        # Connections inherited from the parent share its sockets; closing them
+        # here would terminate the parent's sessions, so just forget them.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
+            self._stats = self._empty_stats()
+
+    def _open(self):
+        raw = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        return _PoolSlot(raw)
+
+    def _discard(self, slot):
+        try:
+            if not slot.raw.closed:
+                slot.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["connections_closed"] += 1
+            self._cond.notify()
+
+    def _is_expired(self, slot, now_ts):
+        return self.max_lifetime > 0 and (now_ts - slot.created_at) >= self.max_lifetime
+
+    def _is_healthy(self, slot, now_ts):
+        if slot.raw.closed:
+            return False
+
+        if self.healthcheck_idle <= 0 or (now_ts - slot.last_used_at) < self.healthcheck_idle:
+            return True
+
+        try:
+            cur = slot.raw.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            slot.raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+        slot = None
+
+        with self._cond:
+            self._reset_after_fork()
+            while True:
+                if self._idle:
+                    slot = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise psycopg2.pool.PoolError(
+                        f"Timed out after {self.timeout:.1f}s waiting for a database connection "
+                        f"(pool size {self.max_size})."
+                    )
+
+                waited = True
+                self._cond.wait(remaining)
+
+        if slot is None:
+            try:
+                slot = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        else:
+            now_ts = time.monotonic()
+            if self._is_expired(slot, now_ts):
+                with self._cond:
+                    self._stats["recycled_max_lifetime"] += 1
+                slot = self._replace(slot)
+            elif not self._is_healthy(slot, now_ts):
+                with self._cond:
+                    self._stats["healthcheck_failures"] += 1
+                slot = self._replace(slot)
+
+        wait_ms = (time.monotonic() - started) * 1000.0
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+            if waited:
+                self._stats["waited_checkouts"] += 1
+
+        if waited and wait_ms >= DB_POOL_SLOW_WAIT_MS:
+            logger.warning("[DBPool] waited %.0fms for a connection (pool size %s)", wait_ms, self.max_size)
+
+        return slot
+
+    def _replace(self, slot):
+        # Keep the reserved size slot; only the underlying connection changes.
+        try:
+            if not slot.raw.closed:
+                slot.raw.close()
+        except Exception:
+            pass
+
+        with self._cond:
+            self._stats["connections_closed"] += 1
+
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, slot):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+
+        if slot.raw.closed:
+            self._discard(slot)
+            return
+
+        try:
+            if slot.raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                slot.raw.rollback()
+        except Exception:
+            self._discard(slot)
+            return
+
+        now_ts = time.monotonic()
+        if self._is_expired(slot, now_ts):
+            with self._cond:
+                self._stats["recycled_max_lifetime"] += 1
+            self._discard(slot)
+            return
+
+        slot.last_used_at = now_ts
+        with self._cond:
+            self._idle.append(slot)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data["size"] = self._size
+            data["idle"] = len(self._idle)
+            data["in_use"] = self._size - len(self._idle)
+            data["max_size"] = self.max_size
+
+        data["wait_ms_avg"] = round(data["wait_ms_total"] / data["checkouts"], 3) if data["checkouts"] else 0.0
+        data["wait_ms_total"] = round(data["wait_ms_total"], 3)
+        data["wait_ms_max"] = round(data["wait_ms_max"], 3)
+        return data
+
+
+_DB_POOL = None
+_DB_POOL_LOCK = threading.Lock()
+
+
+def get_db_pool():
+    global _DB_POOL
+
+    if _DB_POOL is None:
+        with _DB_POOL_LOCK:
+            if _DB_POOL is None:
+                _DB_POOL = DatabasePool(
+                    build_db_connect_kwargs(),
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT_SECONDS,
+                    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+                    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE_SECONDS,
+                )
+    return _DB_POOL
+
+
+def get_db_pool_stats():
+    if _DB_POOL is None:
+        return {"size": 0, "idle": 0, "in_use": 0, "max_size": DB_POOL_MAX_SIZE}
+    return _DB_POOL.stats()
+
+
+class _RequestLease:
+    __slots__ = ("slot", "in_use")
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.in_use = False
+
+
+def _release_request_lease(lease):
+    # The connection stays checked out until teardown; only throw away
+    # whatever the caller left uncommitted, matching the old close() semantics.
+    try:
+        raw = lease.slot.raw
+        if not raw.closed and raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raw.rollback()
+    except Exception:
+        logger.warning("[DBPool] rollback on release failed; connection will be replaced")
+        try:
+            lease.slot.raw.close()
+        except Exception:
+            pass
+    lease.in_use = False
+
+
+class PooledConnection:
+    """
+    What get_db_connection() hands out.
+
+    Behaves like a psycopg2 connection: attribute reads and writes
+    (autocommit, isolation_level, ...) go to the raw connection, and
+    ``with conn:`` commits or rolls back without closing. close() gives the
+    connection back instead of tearing down the socket; anything left
+    uncommitted is rolled back.
+    """
+
+    def __init__(self, slot, release, release_arg):
+        self._slot = slot
+        self._finalizer = weakref.finalize(self, release, release_arg)
+
+    def cursor(self, *args, **kwargs):
+        return self._slot.raw.cursor(*args, **kwargs)
+
+    def commit(self):
+        self._slot.raw.commit()
+
+    def rollback(self):
+        self._slot.raw.rollback()
+
+    def close(self):
+        self._finalizer()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive or bool(self._slot.raw.closed)
+
+    @property
+    def raw(self):
+        return self._slot.raw
+
+    def __getattr__(self, name):
+        return getattr(self._slot.raw, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._slot.raw, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same as psycopg2: end the transaction, keep the connection open.
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def get_db_connection():
+    """
+    Hand out a pooled connection.
+
+    Inside a request, one connection is checked out lazily and reused by every
+    helper that runs sequentially; it goes back to the pool in teardown. A
+    helper that opens a connection while another one is still open in the same
+    request (nested helpers) gets a second checkout, so transactions never
+    bleed into each other. Outside a request (startup, CLI, workers) each
+    close() returns the connection to the pool directly.
+    """
+    pool = get_db_pool()
+
+    if not has_request_context():
+        slot = pool.getconn()
+        return PooledConnection(slot, pool.putconn, slot)
+
+    leases = g.setdefault("_db_leases", [])
+
+    lease = None
+    for candidate in list(leases):
+        if candidate.in_use:
+            continue
+        if candidate.slot.raw.closed:
+            leases.remove(candidate)
+            pool.putconn(candidate.slot)
+            continue
+        lease = candidate
+        break
+
+    if lease is None:
+        lease = _RequestLease(pool.getconn())
+        leases.append(lease)
+
+    lease.in_use = True
+    return PooledConnection(lease.slot, _release_request_lease, lease)
+
+
+@app.teardown_appcontext
+def release_request_db_connections(_exc=None):
+    # Buffered invoice events go out on this request's connection before it is returned.
+    if g.get("_invoice_event_buffer"):
+        flush_invoice_events()
+
+    leases = g.pop("_db_leases", None)
+    if not leases:
+        return
+
+    pool = get_db_pool()
+    for lease in leases:
+        pool.putconn(lease.slot)
+
+
+def release_idle_request_db_connections():
+    """
+    Give back this request's pooled connections that no helper has open, for
+    handlers that are about to block (long-poll) and would otherwise hold
+    them until teardown. A later get_db_connection() checks out a fresh one.
+    """
+    leases = g.get("_db_leases")
+    if not leases:
+        return
+
+    pool = get_db_pool()
+    for lease in [lease for lease in leases if not lease.in_use]:
+        leases.remove(lease)
+        pool.putconn(lease.slot)
 
 
 # -------------------------
@@ -819,6 +1293,64 @@ PLAN_LEVELS = {
 # -------------------------
 # DATABASE INITIALIZATION
 # -------------------------
+# Source of truth for the invoices.total_paid / payment_count /
+# last_payment_at / balance rollup columns, recomputed from payments.
+INVOICE_PAYMENT_AGGREGATE_SQL = """
+    SELECT
+        inv.id AS invoice_id,
+        COALESCE(SUM(p.amount), 0) AS total_paid,
+        COUNT(p.id) AS payment_count,
+        MAX(COALESCE(p.occurred_at, p.created_at)) AS last_payment_at
+    FROM invoices inv
+    LEFT JOIN payments p
+      ON p.invoice_id = inv.id
+     AND COALESCE(p.payment_status, 'succeeded') != 'failed'
+    GROUP BY inv.id
+"""
+
+INVOICE_PAYMENT_ROLLUP_DRIFT_SQL = """
+    (
+        i.total_paid IS DISTINCT FROM agg.total_paid
+        OR i.payment_count IS DISTINCT FROM agg.payment_count
+        OR i.last_payment_at IS DISTINCT FROM agg.last_payment_at
+        OR i.balance IS DISTINCT FROM GREATEST(COALESCE(i.amount, 0) - agg.total_paid, 0)
+    )
+"""
+
+# Callers append extra "AND ..." conditions on i (the invoices row).
+INVOICE_PAYMENT_ROLLUP_REPAIR_SQL = f"""
+    UPDATE invoices i
+    SET total_paid = agg.total_paid,
+        payment_count = agg.payment_count,
+        last_payment_at = agg.last_payment_at,
+        balance = GREATEST(COALESCE(i.amount, 0) - agg.total_paid, 0)
+    FROM ({INVOICE_PAYMENT_AGGREGATE_SQL}) agg
+    WHERE i.id = agg.invoice_id
+"""
+
+# Source of truth for conversation_participants.unread_count: one row per
+# (conversation, participant) with the other side's messages still unread.
+# Callers append extra "AND ..." conditions on c / p.
+CONVERSATION_UNREAD_AGGREGATE_SQL = """
+    SELECT DISTINCT ON (c.id, p.user_id)
+        c.id AS conversation_id,
+        p.user_id,
+        p.role,
+        (
+            SELECT COUNT(*)
+            FROM messages m
+            WHERE m.conversation_id = c.id
+              AND m.sender_user_id != p.user_id
+              AND COALESCE(m.is_read, FALSE) = FALSE
+        ) AS unread_count
+    FROM conversations c
+    CROSS JOIN LATERAL (
+        VALUES (c.business_user_id, 'business'), (c.client_user_id, 'client')
+    ) AS p(user_id, role)
+    WHERE p.user_id IS NOT NULL
+"""
+
+
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -1187,6 +1719,32 @@ def init_db():
         """
     )
 
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_device_tokens (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+            device_token TEXT NOT NULL,
+            device_name TEXT,
+            app_version TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, platform, device_token)
+        );
+        """
+    )
+    cursor.execute("ALTER TABLE user_device_tokens ADD COLUMN IF NOT EXISTS deactivated_at TIMESTAMP;")
+    cursor.execute("ALTER TABLE user_device_tokens ADD COLUMN IF NOT EXISTS deactivated_reason TEXT;")
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS user_device_tokens_token_idx
+        ON user_device_tokens(platform, device_token);
+        """
+    )
+
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS business_followers (
@@ -1220,6 +1778,29 @@ def init_db():
         """
     )
 
+    # push_status: NULL (no push), 'pending' (queued for the push worker), 'sent'.
+    cursor.execute("ALTER TABLE notifications ADD COLUMN IF NOT EXISTS push_status TEXT;")
+    cursor.execute("ALTER TABLE notifications ADD COLUMN IF NOT EXISTS push_sent_at TIMESTAMP;")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS notifications_push_pending_idx
+        ON notifications(created_at, user_id)
+        WHERE push_status = 'pending';
+        """
+    )
+
+    # Bumped whenever a user's notifications or unread messages change; the
+    # ETag for /api/notifications/summary.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS notification_versions (
+            user_id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+
     cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS stripe_customer_id TEXT;")
     cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS stripe_subscription_id TEXT;")
     cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS stripe_connect_account_id TEXT;")
@@ -1255,6 +1836,10 @@ def init_db():
     cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS tax_reserve_percent NUMERIC;")
     cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS payment_terms_label TEXT;")
     cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS collect_in_person_enabled BOOLEAN DEFAULT FALSE;")
+    cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS total_paid NUMERIC DEFAULT 0;")
+    cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS payment_count INTEGER DEFAULT 0;")
+    cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS last_payment_at TIMESTAMP;")
+    cursor.execute("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS balance NUMERIC;")
 
     cursor.execute("ALTER TABLE clients ADD COLUMN IF NOT EXISTS user_id INTEGER;")
     cursor.execute("ALTER TABLE business_profile ADD COLUMN IF NOT EXISTS user_id INTEGER;")
@@ -1369,12 +1954,16 @@ def init_db():
         """
     )
 
+    # Keyset pagination for message history walks (created_at, id) within a
+    # conversation; this also serves the "latest message" lookups backwards,
+    # so the older (conversation_id, created_at DESC) index is dropped.
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS messages_conversation_idx
-        ON messages(conversation_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS messages_conversation_created_id_idx
+        ON messages(conversation_id, created_at, id);
         """
     )
+    cursor.execute("DROP INDEX IF EXISTS messages_conversation_idx;")
 
     cursor.execute(
         """
@@ -1416,105 +2005,661 @@ def init_db():
 
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS messages_conversation_idx
-        ON messages(conversation_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS conversation_participants_conv_idx
+        ON conversation_participants(conversation_id);
         """
     )
 
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS conversation_participants_conv_idx
-        ON conversation_participants(conversation_id);
+        ALTER TABLE conversation_participants
+        ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
         """
     )
 
-    cursor.execute("SELECT id FROM users ORDER BY id ASC LIMIT 1;")
-    row = cursor.fetchone()
-    if not row:
-        cursor.execute(
-            """
-            INSERT INTO users (email, password_hash, plan, is_active)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id;
-            """,
-            ("owner@example.com", None, "pro", True),
-        )
-        default_user_id = cursor.fetchone()[0]
-
-        cursor.execute("UPDATE invoices SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
-        cursor.execute("UPDATE clients SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
-        cursor.execute("UPDATE business_profile SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
+    cursor.execute(
+        """
+        DELETE FROM conversation_participants a
+        USING conversation_participants b
+        WHERE a.conversation_id = b.conversation_id
+          AND a.user_id = b.user_id
+          AND a.id > b.id;
+        """
+    )
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS conversation_participants_conv_user_idx
+        ON conversation_participants(conversation_id, user_id);
+        """
+    )
 
+    # Badge totals are SUM(unread_count) over a user's rows.
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS conversation_participants_user_unread_idx
+        ON conversation_participants(user_id, unread_count);
+        """
+    )
 
-def update_overdue_statuses():
-    conn = get_db_connection()
-    cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT
-            i.id,
-            i.amount,
-            i.status,
-            i.due_date,
-            COALESCE(SUM(CASE WHEN COALESCE(p.payment_status, 'succeeded') != 'failed' THEN p.amount ELSE 0 END), 0) AS total_paid
-        FROM invoices i
-        LEFT JOIN payments p ON p.invoice_id = i.id
-        GROUP BY i.id, i.amount, i.status, i.due_date
+        ALTER TABLE messages
+        ADD COLUMN IF NOT EXISTS is_read BOOLEAN DEFAULT FALSE;
         """
     )
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
 
-    for invoice_id, amount, status, due_date, total_paid in rows:
-        amount = float(amount or 0)
-        total_paid = float(total_paid or 0)
-        balance = max(amount - total_paid, 0.0)
+    # Backfill participant rows (with their unread counts) for conversations
+    # created before the counters existed.
+    cursor.execute(
+        f"""
+        INSERT INTO conversation_participants (conversation_id, user_id, role, unread_count)
+        SELECT conversation_id, user_id, role, unread_count
+        FROM ({CONVERSATION_UNREAD_AGGREGATE_SQL}
+          AND NOT EXISTS (
+              SELECT 1
+              FROM conversation_participants cp
+              WHERE cp.conversation_id = c.id
+                AND cp.user_id = p.user_id
+          )
+        ) agg
+        ON CONFLICT (conversation_id, user_id) DO NOTHING;
+        """
+    )
+
+    # Latest-message pointer for the inbox, written with each new message.
+    cursor.execute(
+        """
+        ALTER TABLE conversations
+        ADD COLUMN IF NOT EXISTS last_message_id INTEGER,
+        ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS last_message_preview TEXT;
+        """
+    )
 
-        if balance <= 0.0001:
-            new_status = "Paid"
-        elif due_date and due_date < now_local():
-            new_status = "Overdue"
-        else:
-            new_status = "Sent"
+    cursor.execute(
+        """
+        UPDATE conversations c
+        SET last_message_id = m.id,
+            last_message_at = m.created_at,
+            last_message_preview = LEFT(COALESCE(m.message_text, ''), %s)
+        FROM conversations c2
+        CROSS JOIN LATERAL (
+            SELECT id, created_at, message_text
+            FROM messages
+            WHERE conversation_id = c2.id
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) m
+        WHERE c.id = c2.id
+          AND c2.last_message_id IS NULL;
+        """,
+        (MESSAGE_PREVIEW_CHARS,),
+    )
 
-        if status != new_status:
-            conn2 = get_db_connection()
-            cur2 = conn2.cursor()
-            cur2.execute("UPDATE invoices SET status = %s WHERE id = %s", (new_status, invoice_id))
-            conn2.commit()
-            cur2.close()
-            conn2.close()
+    # Inbox sort key per participant: last message time, or the conversation's
+    # created_at until the first message arrives.
+    cursor.execute(
+        """
+        ALTER TABLE conversation_participants
+        ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP;
+        """
+    )
 
+    cursor.execute(
+        """
+        UPDATE conversation_participants cp
+        SET last_activity_at = COALESCE(c.last_message_at, c.created_at)
+        FROM conversations c
+        WHERE c.id = cp.conversation_id
+          AND cp.last_activity_at IS DISTINCT FROM COALESCE(c.last_message_at, c.created_at);
+        """
+    )
 
-def log_invoice_event(invoice_id: int, event_type: str, title: str, details: str = "", visibility: str = "private"):
-    if visibility not in ("private", "public", "both"):
-        visibility = "private"
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS conversation_participants_inbox_idx
+        ON conversation_participants(user_id, last_activity_at DESC, conversation_id DESC);
+        """
+    )
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS payments_invoice_idx
+        ON payments(invoice_id);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invoice_items_invoice_idx
+        ON invoice_items(invoice_id);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS recurring_invoices_invoice_idx
+        ON recurring_invoices(invoice_id);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invoices_user_created_idx
+        ON invoices(user_id, created_at DESC, id DESC);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invoices_user_status_idx
+        ON invoices(user_id, status);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_revenue (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            billed_total NUMERIC NOT NULL DEFAULT 0,
+            collected_total NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        );
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_client_totals (
+            user_id INTEGER NOT NULL,
+            client TEXT NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            billed_total NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, client)
+        );
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_item_totals (
+            user_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            billed_total NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, description)
+        );
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS user_client_totals_rank_idx
+        ON user_client_totals(user_id, billed_total DESC);
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS user_item_totals_rank_idx
+        ON user_item_totals(user_id, billed_total DESC);
+        """
+    )
+
+    # -------------------------
+    # EMAIL OUTBOX
+    # -------------------------
+    # Web requests insert rows; `flask email-outbox-worker` delivers them.
+    # status: pending -> sending -> sent, or dead after the last attempt.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            email_type TEXT NOT NULL DEFAULT 'basic',
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body_text TEXT NOT NULL,
+            invoice_id INTEGER,
+            user_id INTEGER,
+            attach_invoice_pdf BOOLEAN NOT NULL DEFAULT FALSE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            provider_message_id TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        );
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS email_outbox_due_idx
+        ON email_outbox(next_attempt_at, id)
+        WHERE status IN ('pending', 'sending');
+        """
+    )
+
+    # -------------------------
+    # STRIPE EVENTS
+    # -------------------------
+    # /stripe/webhook stores verified events; `flask stripe-events-worker`
+    # applies them in order per ordering_key (invoice or customer).
+    # status: pending -> processing -> processed, or dead after the last attempt.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stripe_events (
+            event_id TEXT PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            ordering_key TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            stripe_created_at TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP
+        );
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS stripe_events_due_idx
+        ON stripe_events(next_attempt_at, stripe_created_at)
+        WHERE status IN ('pending', 'processing');
+        """
+    )
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS stripe_events_open_key_idx
+        ON stripe_events(ordering_key, stripe_created_at, received_at)
+        WHERE status IN ('pending', 'processing');
+        """
+    )
+
+    # -------------------------
+    # SEARCH INDEXES
+    # -------------------------
+    # The search_vector columns and the GIN/trigram indexes on invoices and
+    # clients are added by `flask migrate-search-columns`, not here: adding a
+    # stored generated column rewrites the table under an exclusive lock.
+    cursor.execute(
+        """
+        SELECT COUNT(*)
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name IN ('invoices', 'clients')
+          AND column_name = 'search_vector'
+        """
+    )
+    _SEARCH_FEATURES["fulltext"] = cursor.fetchone()[0] == 2
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invoices_user_number_prefix_idx
+        ON invoices(user_id, LOWER(invoice_number) text_pattern_ops);
+        """
+    )
+
+    # Business directory: a normalized name for prefix/substring lookups and
+    # a follower_count kept current by the follow/unfollow routes, so
+    # discovery can rank without aggregating business_followers per search.
+    # Followers are counted on the user's primary (lowest id) profile row.
+    cursor.execute(
+        r"""
+        ALTER TABLE business_profile ADD COLUMN IF NOT EXISTS name_normalized TEXT
+        GENERATED ALWAYS AS (
+            LOWER(BTRIM(regexp_replace(COALESCE(business_name, ''), '\s+', ' ', 'g')))
+        ) STORED;
+        """
+    )
+    cursor.execute(
+        """
+        ALTER TABLE business_profile
+        ADD COLUMN IF NOT EXISTS follower_count INTEGER NOT NULL DEFAULT 0;
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE business_profile bp
+        SET follower_count = counts.follower_count
+        FROM (
+            SELECT
+                p.id,
+                CASE
+                    WHEN p.id = MIN(p.id) OVER (PARTITION BY p.user_id)
+                    THEN (SELECT COUNT(*) FROM business_followers bf WHERE bf.business_user_id = p.user_id)
+                    ELSE 0
+                END AS follower_count
+            FROM business_profile p
+        ) counts
+        WHERE counts.id = bp.id
+          AND bp.follower_count IS DISTINCT FROM counts.follower_count;
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS business_profile_name_prefix_idx
+        ON business_profile(name_normalized text_pattern_ops);
+        """
+    )
+
+    # pg_trgm indexes substring matching. Managed Postgres without the
+    # extension (or without permission to create it) still matches substrings,
+    # by scanning the user's rows as the original LIKE '%q%' search did.
+    cursor.execute("SAVEPOINT enable_pg_trgm;")
     try:
-        cur.execute(
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS business_profile_name_trgm_idx
+            ON business_profile USING GIN (name_normalized gin_trgm_ops);
             """
+        )
+        cursor.execute("RELEASE SAVEPOINT enable_pg_trgm;")
+        _SEARCH_FEATURES["trigram"] = True
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT enable_pg_trgm;")
+        _SEARCH_FEATURES["trigram"] = False
+        logger.info("pg_trgm unavailable, substring search will not be indexed: %s", e)
+
+    # First boot with the rollup tables: fill them from existing invoices.
+    # The lock keeps concurrently starting workers from filling them twice.
+    cursor.execute("LOCK TABLE user_daily_revenue IN EXCLUSIVE MODE;")
+    cursor.execute(
+        """
+        SELECT
+            EXISTS (SELECT 1 FROM user_daily_revenue),
+            EXISTS (SELECT 1 FROM invoices WHERE user_id IS NOT NULL)
+        """
+    )
+    rollups_filled, has_invoices = cursor.fetchone()
+    if has_invoices and not rollups_filled:
+        rebuild_dashboard_rollups_with_cursor(cursor)
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invoices_open_due_date_idx
+        ON invoices(due_date)
+        WHERE status = 'Sent';
+        """
+    )
+
+    # Invoices created before the payment rollup columns existed have no
+    # balance yet; fill them once from the payments table.
+    cursor.execute(
+        f"""
+        {INVOICE_PAYMENT_ROLLUP_REPAIR_SQL}
+          AND i.balance IS NULL
+        """
+    )
+
+    cursor.execute("SELECT id FROM users ORDER BY id ASC LIMIT 1;")
+    row = cursor.fetchone()
+    if not row:
+        cursor.execute(
+            """
+            INSERT INTO users (email, password_hash, plan, is_active)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id;
+            """,
+            ("owner@example.com", None, "pro", True),
+        )
+        default_user_id = cursor.fetchone()[0]
+
+        cursor.execute("UPDATE invoices SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
+        cursor.execute("UPDATE clients SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
+        cursor.execute("UPDATE business_profile SET user_id = %s WHERE user_id IS NULL;", (default_user_id,))
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def update_overdue_statuses(user_id: int = None):
+    """
+    Reconcile stored invoice statuses (Paid / Overdue / Sent) against the
+    payment rollup columns and due dates in a single set-based UPDATE. Only rows whose status actually
+    changes are written. Returns the number of invoices updated.
+    """
+    params = {"now": now_local(), "user_id": user_id}
+    user_filter = "WHERE inv.user_id = %(user_id)s" if user_id else ""
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            UPDATE invoices i
+            SET status = reconciled.new_status
+            FROM (
+                SELECT
+                    inv.id,
+                    CASE
+                        WHEN GREATEST(COALESCE(inv.amount, 0) - COALESCE(inv.total_paid, 0), 0) <= 0.0001 THEN 'Paid'
+                        WHEN inv.due_date IS NOT NULL AND inv.due_date < %(now)s THEN 'Overdue'
+                        ELSE 'Sent'
+                    END AS new_status
+                FROM invoices inv
+                {user_filter}
+            ) reconciled
+            WHERE i.id = reconciled.id
+              AND i.status IS DISTINCT FROM reconciled.new_status
+            """,
+            params,
+        )
+        updated = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    return updated
+
+
+def get_next_invoice_due_boundary():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT MIN(due_date)
+            FROM invoices
+            WHERE due_date > %s
+              AND status = 'Sent'
+            """,
+            (now_local(),),
+        )
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return row[0] if row else None
+
+
+@app.cli.command("reconcile-invoice-statuses")
+@click.option("--loop", "run_forever", is_flag=True, help="Keep running on a cadence instead of exiting after one pass.")
+@click.option(
+    "--interval",
+    default=INVOICE_STATUS_RECONCILE_INTERVAL_SECONDS,
+    show_default=True,
+    type=int,
+    help="Seconds between passes when --loop is set.",
+)
+def reconcile_invoice_statuses_command(run_forever, interval):
+    """Recompute Paid/Overdue/Sent for every invoice (cron or --loop worker)."""
+    while True:
+        started = time.monotonic()
+        try:
+            updated = update_overdue_statuses()
+            logger.info(
+                "[InvoiceStatusReconcile] updated=%s elapsed_ms=%.0f",
+                updated,
+                (time.monotonic() - started) * 1000.0,
+            )
+        except Exception:
+            logger.exception("[InvoiceStatusReconcile] pass failed")
+
+        if not run_forever:
+            return
+
+        sleep_seconds = max(1, interval)
+        try:
+            next_boundary = get_next_invoice_due_boundary()
+        except Exception:
+            logger.exception("[InvoiceStatusReconcile] could not read next due date")
+            next_boundary = None
+
+        if next_boundary:
+            # Wake up right after the next invoice crosses its due date.
+            until_boundary = (next_boundary - now_local()).total_seconds() + 1
+            sleep_seconds = max(1, min(sleep_seconds, until_boundary))
+
+        time.sleep(sleep_seconds)
+
+
+# -------------------------
+# INVOICE EVENT LOG
+# -------------------------
+# log_invoice_event() only queues the row. Inside a request the queue lives on
+# `g` and is written in one INSERT at teardown (or earlier, when
+# get_invoice_events() reads the log). Outside a request (CLI, workers) rows
+# go to a process-wide buffer flushed every INVOICE_EVENT_FLUSH_SECONDS and at
+# exit. Writes that must commit together with other rows, like payments, use
+# insert_invoice_events() on their own cursor instead.
+
+# Rows per INSERT statement when flushing a large buffer.
+INVOICE_EVENT_INSERT_CHUNK = 500
+
+_INVOICE_EVENT_BUFFER = []
+_INVOICE_EVENT_BUFFER_LOCK = threading.Lock()
+_INVOICE_EVENT_FLUSHER = {"thread": None, "pid": None}
+
+
+def _invoice_event_row(invoice_id: int, event: dict, created_at):
+    visibility = event.get("visibility") or "private"
+    if visibility not in ("private", "public", "both"):
+        visibility = "private"
+    return (invoice_id, event["event_type"], event["title"], event.get("details") or "", visibility, created_at)
+
+
+def _insert_invoice_event_rows(cursor, rows):
+    for start in range(0, len(rows), INVOICE_EVENT_INSERT_CHUNK):
+        chunk = rows[start:start + INVOICE_EVENT_INSERT_CHUNK]
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(chunk))
+        cursor.execute(
+            f"""
             INSERT INTO invoice_events (invoice_id, event_type, title, details, visibility, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s)
+            VALUES {values}
             """,
-            (invoice_id, event_type, title, details or "", visibility, now_local()),
+            [value for row in chunk for value in row],
         )
+
+
+def insert_invoice_events(cursor, invoice_id: int, events):
+    """
+    Write several invoice_events rows in one INSERT on the caller's cursor
+    (synchronous; commits with the caller). Each event is a dict with
+    event_type, title and optional details/visibility.
+    """
+    created_at = now_local()
+    rows = [_invoice_event_row(invoice_id, event, created_at) for event in events or []]
+    if rows:
+        _insert_invoice_event_rows(cursor, rows)
+
+
+def write_invoice_event_rows(rows) -> bool:
+    if not rows:
+        return True
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        _insert_invoice_event_rows(cur, rows)
         conn.commit()
+        return True
     except Exception as e:
         conn.rollback()
-        logger.warning("Failed to log invoice event for invoice_id=%s: %s", invoice_id, e)
+        logger.warning("Failed to write %s invoice event(s): %s", len(rows), e)
+        return False
     finally:
         cur.close()
         conn.close()
 
 
+def flush_invoice_events():
+    """Write whatever log_invoice_event() has queued for this request and this process."""
+    # App (not request) context: this also runs from the appcontext teardown.
+    if has_app_context():
+        rows = g.pop("_invoice_event_buffer", None)
+        if rows:
+            write_invoice_event_rows(rows)
+
+    with _INVOICE_EVENT_BUFFER_LOCK:
+        rows = list(_INVOICE_EVENT_BUFFER)
+        _INVOICE_EVENT_BUFFER.clear()
+    if rows:
+        write_invoice_event_rows(rows)
+
+
+def _run_invoice_event_flusher():
+    while True:
+        time.sleep(max(INVOICE_EVENT_FLUSH_SECONDS, 0.05))
+        try:
+            with _INVOICE_EVENT_BUFFER_LOCK:
+                rows = list(_INVOICE_EVENT_BUFFER)
+                _INVOICE_EVENT_BUFFER.clear()
+            write_invoice_event_rows(rows)
+        except Exception:
+            logger.exception("[InvoiceEvents] Background flush failed")
+
+
+def _ensure_invoice_event_flusher():
+    # Caller holds _INVOICE_EVENT_BUFFER_LOCK. Restarted after fork.
+    pid = os.getpid()
+    if _INVOICE_EVENT_FLUSHER["pid"] == pid:
+        return
+
+    thread = threading.Thread(target=_run_invoice_event_flusher, name="invoice-event-flusher", daemon=True)
+    thread.start()
+    _INVOICE_EVENT_FLUSHER.update(thread=thread, pid=pid)
+
+
+atexit.register(flush_invoice_events)
+
+
+def log_invoice_event(invoice_id: int, event_type: str, title: str, details: str = "", visibility: str = "private"):
+    row = _invoice_event_row(
+        invoice_id,
+        {"event_type": event_type, "title": title, "details": details, "visibility": visibility},
+        now_local(),
+    )
+
+    if has_request_context():
+        g.setdefault("_invoice_event_buffer", []).append(row)
+        return
+
+    with _INVOICE_EVENT_BUFFER_LOCK:
+        _INVOICE_EVENT_BUFFER.append(row)
+        _ensure_invoice_event_flusher()
+
+
 def get_invoice_events(invoice_id: int, public_only: bool = False):
+    flush_invoice_events()
+
     conn = get_db_connection()
     cur = conn.cursor()
 
@@ -1584,71 +2729,526 @@ def get_or_create_public_token(invoice_id: int) -> str:
             token = candidate
             break
 
-    cursor.execute("UPDATE invoices SET public_token = %s WHERE id = %s", (token, invoice_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return token
+    cursor.execute("UPDATE invoices SET public_token = %s WHERE id = %s", (token, invoice_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return token
+
+
+# -------------------------
+# INVOICE PAYMENT / STATUS HELPERS
+# -------------------------
+def record_invoice_payment(
+    cursor,
+    invoice_id: int,
+    amount,
+    *,
+    occurred_at,
+    source: str = "manual",
+    method: str = None,
+    note: str = None,
+    recorded_by_user_id: int = None,
+    is_deposit: bool = False,
+    is_final_payment: bool = False,
+    stripe_payment_intent_id: str = None,
+    stripe_checkout_session_id: str = None,
+):
+    """
+    Record one successful payment on the caller's cursor: the payments row,
+    the invoice rollup columns (total_paid, payment_count, last_payment_at,
+    balance), the status transition and user_daily_revenue, in a single
+    statement. Nothing is committed; callers add their invoice_events rows
+    (insert_invoice_events) and notification (insert_notification) on the
+    same cursor and commit once, so a payment never half-applies.
+
+    The invoice row lock serializes concurrent payments on one invoice.
+    Returns a summary dict, or None if the invoice does not exist. The
+    summary's "events" list holds the status_changed event, if any, for the
+    caller to write along with its own.
+    """
+    now_dt = now_local()
+
+    # The status CASE mirrors derive_invoice_display_status().
+    cursor.execute(
+        """
+        WITH prev AS (
+            SELECT id, status, user_id
+            FROM invoices
+            WHERE id = %(invoice_id)s
+            FOR UPDATE
+        ),
+        payment AS (
+            -- Selecting from prev means a missing invoice inserts nothing
+            -- (and the UPDATE returns no row) instead of failing the FK.
+            INSERT INTO payments (
+                invoice_id,
+                amount,
+                method,
+                note,
+                stripe_payment_intent_id,
+                stripe_checkout_session_id,
+                payment_source,
+                payment_status,
+                occurred_at,
+                recorded_by_user_id,
+                is_deposit,
+                is_final_payment
+            )
+            SELECT
+                prev.id, %(amount)s, %(method)s, %(note)s,
+                %(payment_intent_id)s, %(checkout_session_id)s,
+                %(source)s, 'succeeded', %(occurred_at)s,
+                %(recorded_by_user_id)s, %(is_deposit)s, %(is_final_payment)s
+            FROM prev
+            RETURNING id
+        ),
+        revenue AS (
+            INSERT INTO user_daily_revenue (user_id, day, collected_total)
+            SELECT user_id, DATE(%(occurred_at)s), %(amount)s
+            FROM prev
+            WHERE user_id IS NOT NULL
+            ON CONFLICT (user_id, day) DO UPDATE
+            SET collected_total = user_daily_revenue.collected_total + EXCLUDED.collected_total
+        )
+        UPDATE invoices i
+        SET total_paid = COALESCE(i.total_paid, 0) + %(amount)s,
+            payment_count = COALESCE(i.payment_count, 0) + 1,
+            last_payment_at = GREATEST(i.last_payment_at, %(occurred_at)s),
+            balance = GREATEST(COALESCE(i.amount, 0) - (COALESCE(i.total_paid, 0) + %(amount)s), 0),
+            last_payment_recorded_at = %(occurred_at)s,
+            last_collection_action_at = %(now)s,
+            stripe_last_payment_intent_id = COALESCE(%(payment_intent_id)s, i.stripe_last_payment_intent_id),
+            status = CASE
+                WHEN COALESCE(i.amount, 0) - (COALESCE(i.total_paid, 0) + %(amount)s) <= 0.0001 THEN 'Paid'
+                WHEN i.due_date IS NOT NULL AND i.due_date < %(now)s THEN 'Overdue'
+                ELSE 'Sent'
+            END
+        FROM prev
+        WHERE i.id = prev.id
+        RETURNING
+            (SELECT id FROM payment),
+            prev.status,
+            i.status,
+            i.user_id,
+            i.invoice_number,
+            i.amount,
+            i.total_paid,
+            i.payment_count,
+            i.last_payment_at,
+            i.due_date
+        """,
+        {
+            "invoice_id": invoice_id,
+            "amount": amount,
+            "method": method,
+            "note": note,
+            "payment_intent_id": stripe_payment_intent_id,
+            "checkout_session_id": stripe_checkout_session_id,
+            "source": source,
+            "occurred_at": occurred_at,
+            "recorded_by_user_id": recorded_by_user_id,
+            "is_deposit": bool(is_deposit),
+            "is_final_payment": bool(is_final_payment),
+            "now": now_dt,
+        },
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    (
+        payment_id,
+        old_status,
+        new_status,
+        user_id,
+        invoice_number,
+        amount_total,
+        total_paid,
+        payment_count,
+        last_payment_at,
+        due_date,
+    ) = row
+
+    amount_total = float(amount_total or 0)
+    total_paid = float(total_paid or 0)
+    balance = max(amount_total - total_paid, 0.0)
+    invoice_number = invoice_number or f"#{invoice_id}"
+
+    events = []
+    if old_status != new_status:
+        events.append(
+            {
+                "event_type": "status_changed",
+                "title": "Status updated",
+                "details": f"Invoice {invoice_number} status changed from {old_status or 'Sent'} to {new_status}.",
+                "visibility": "both",
+            }
+        )
+
+    return {
+        "invoice_id": invoice_id,
+        "payment_id": payment_id,
+        "user_id": user_id,
+        "invoice_number": invoice_number,
+        "status": new_status,
+        "previous_status": old_status,
+        "amount_total": amount_total,
+        "total_paid": total_paid,
+        "balance": balance,
+        "payment_count": int(payment_count or 0),
+        "last_payment_at": last_payment_at,
+        "due_date": due_date,
+        "is_paid_in_full": balance <= 0.0001,
+        "events": events,
+    }
+
+
+@app.cli.command("verify-payment-rollups")
+@click.option("--fix", is_flag=True, help="Rewrite drifted rows from the payments table.")
+@click.option("--limit", default=20, show_default=True, type=int, help="How many drifted invoices to print.")
+def verify_payment_rollups_command(fix, limit):
+    """Compare invoices.total_paid/payment_count/last_payment_at/balance with payments."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT
+                i.id,
+                i.total_paid,
+                agg.total_paid,
+                i.payment_count,
+                agg.payment_count,
+                i.balance
+            FROM invoices i
+            JOIN ({INVOICE_PAYMENT_AGGREGATE_SQL}) agg ON agg.invoice_id = i.id
+            WHERE {INVOICE_PAYMENT_ROLLUP_DRIFT_SQL}
+            ORDER BY i.id
+            """
+        )
+        drifted = cur.fetchall()
+
+        for row in drifted[: max(limit, 0)]:
+            click.echo(
+                f"invoice {row[0]}: total_paid {row[1]} (expected {row[2]}), "
+                f"payment_count {row[3]} (expected {row[4]}), balance {row[5]}"
+            )
+        click.echo(f"{len(drifted)} invoice(s) with drifted payment rollups.")
+
+        if fix and drifted:
+            cur.execute(
+                f"""
+                {INVOICE_PAYMENT_ROLLUP_REPAIR_SQL}
+                  AND {INVOICE_PAYMENT_ROLLUP_DRIFT_SQL}
+                """
+            )
+            conn.commit()
+            click.echo(f"Repaired {cur.rowcount} invoice(s).")
+        else:
+            conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# -------------------------
+# DASHBOARD ROLLUPS
+# -------------------------
+# user_daily_revenue / user_client_totals / user_item_totals hold per-user
+# totals for the /invoices charts. Writers call adjust_invoice_rollups() on
+# their own cursor: with sign=-1 before changing or deleting an invoice and
+# sign=+1 after creating or changing it, so the rollups commit atomically
+# with the invoice. Payments add to user_daily_revenue.collected_total via
+# record_invoice_payment().
+def adjust_invoice_rollups(cursor, invoice_id: int, sign: int):
+    cursor.execute(
+        """
+        INSERT INTO user_daily_revenue (user_id, day, invoice_count, billed_total)
+        SELECT user_id, DATE(created_at), %(sign)s, %(sign)s * COALESCE(amount, 0)
+        FROM invoices
+        WHERE id = %(invoice_id)s AND user_id IS NOT NULL AND created_at IS NOT NULL
+        ON CONFLICT (user_id, day) DO UPDATE
+        SET invoice_count = user_daily_revenue.invoice_count + EXCLUDED.invoice_count,
+            billed_total = user_daily_revenue.billed_total + EXCLUDED.billed_total
+        """,
+        {"invoice_id": invoice_id, "sign": sign},
+    )
+    cursor.execute(
+        """
+        INSERT INTO user_client_totals (user_id, client, invoice_count, billed_total)
+        SELECT user_id, COALESCE(client, ''), %(sign)s, %(sign)s * COALESCE(amount, 0)
+        FROM invoices
+        WHERE id = %(invoice_id)s AND user_id IS NOT NULL
+        ON CONFLICT (user_id, client) DO UPDATE
+        SET invoice_count = user_client_totals.invoice_count + EXCLUDED.invoice_count,
+            billed_total = user_client_totals.billed_total + EXCLUDED.billed_total
+        """,
+        {"invoice_id": invoice_id, "sign": sign},
+    )
+    cursor.execute(
+        """
+        INSERT INTO user_item_totals (user_id, description, line_count, billed_total)
+        SELECT i.user_id, COALESCE(ii.description, ''), %(sign)s * COUNT(*), %(sign)s * COALESCE(SUM(ii.amount), 0)
+        FROM invoice_items ii
+        JOIN invoices i ON i.id = ii.invoice_id
+        WHERE i.id = %(invoice_id)s AND i.user_id IS NOT NULL
+        GROUP BY i.user_id, COALESCE(ii.description, '')
+        ON CONFLICT (user_id, description) DO UPDATE
+        SET line_count = user_item_totals.line_count + EXCLUDED.line_count,
+            billed_total = user_item_totals.billed_total + EXCLUDED.billed_total
+        """,
+        {"invoice_id": invoice_id, "sign": sign},
+    )
+
+
+def rebuild_dashboard_rollups_with_cursor(cur, user_id: int = None):
+    user_filter = "AND i.user_id = %(user_id)s" if user_id else ""
+    delete_filter = "WHERE user_id = %(user_id)s" if user_id else ""
+    params = {"user_id": user_id}
+
+    cur.execute(f"DELETE FROM user_daily_revenue {delete_filter}", params)
+    cur.execute(f"DELETE FROM user_client_totals {delete_filter}", params)
+    cur.execute(f"DELETE FROM user_item_totals {delete_filter}", params)
+
+    cur.execute(
+        f"""
+        INSERT INTO user_daily_revenue (user_id, day, invoice_count, billed_total, collected_total)
+        SELECT user_id, day, SUM(invoice_count), SUM(billed_total), SUM(collected_total)
+        FROM (
+            SELECT i.user_id, DATE(i.created_at) AS day, COUNT(*) AS invoice_count,
+                   COALESCE(SUM(i.amount), 0) AS billed_total, 0 AS collected_total
+            FROM invoices i
+            WHERE i.user_id IS NOT NULL AND i.created_at IS NOT NULL {user_filter}
+            GROUP BY i.user_id, DATE(i.created_at)
+
+            UNION ALL
+
+            SELECT i.user_id, DATE(COALESCE(p.occurred_at, p.created_at)), 0, 0, COALESCE(SUM(p.amount), 0)
+            FROM payments p
+            JOIN invoices i ON i.id = p.invoice_id
+            WHERE i.user_id IS NOT NULL
+              AND COALESCE(p.payment_status, 'succeeded') != 'failed'
+              AND COALESCE(p.occurred_at, p.created_at) IS NOT NULL
+              {user_filter}
+            GROUP BY i.user_id, DATE(COALESCE(p.occurred_at, p.created_at))
+        ) per_day
+        GROUP BY user_id, day
+        """,
+        params,
+    )
+    cur.execute(
+        f"""
+        INSERT INTO user_client_totals (user_id, client, invoice_count, billed_total)
+        SELECT i.user_id, COALESCE(i.client, ''), COUNT(*), COALESCE(SUM(i.amount), 0)
+        FROM invoices i
+        WHERE i.user_id IS NOT NULL {user_filter}
+        GROUP BY i.user_id, COALESCE(i.client, '')
+        """,
+        params,
+    )
+    cur.execute(
+        f"""
+        INSERT INTO user_item_totals (user_id, description, line_count, billed_total)
+        SELECT i.user_id, COALESCE(ii.description, ''), COUNT(*), COALESCE(SUM(ii.amount), 0)
+        FROM invoice_items ii
+        JOIN invoices i ON i.id = ii.invoice_id
+        WHERE i.user_id IS NOT NULL {user_filter}
+        GROUP BY i.user_id, COALESCE(ii.description, '')
+        """,
+        params,
+    )
+
+
+def rebuild_dashboard_rollups(user_id: int = None):
+    """Recompute the rollup tables from invoices/items/payments (one user or everyone)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        rebuild_dashboard_rollups_with_cursor(cur, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+@app.cli.command("rebuild-dashboard-rollups")
+@click.option("--user-id", type=int, default=None, help="Only rebuild this user's rollups.")
+def rebuild_dashboard_rollups_command(user_id):
+    """Recompute user_daily_revenue, user_client_totals and user_item_totals."""
+    started = time.monotonic()
+    rebuild_dashboard_rollups(user_id)
+    click.echo(f"Rebuilt dashboard rollups in {(time.monotonic() - started) * 1000.0:.0f}ms.")
+
+
+def get_dashboard_chart_data(user_id: int):
+    now = now_local()
+    month_start = datetime(now.year, now.month, 1).date()
+    next_month = (datetime(now.year, now.month, 1) + timedelta(days=32)).replace(day=1).date()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT
+                COALESCE(SUM(invoice_count), 0),
+                COALESCE(SUM(billed_total), 0),
+                COALESCE(SUM(billed_total) FILTER (WHERE day >= %s AND day < %s), 0)
+            FROM user_daily_revenue
+            WHERE user_id = %s
+            """,
+            (month_start, next_month, user_id),
+        )
+        total_invoices, total_revenue, monthly_revenue = cur.fetchone()
+
+        cur.execute(
+            """
+            SELECT status, COUNT(*)
+            FROM invoices
+            WHERE user_id = %s
+            GROUP BY status
+            """,
+            (user_id,),
+        )
+        status_rows = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT date_trunc('month', day) AS month, SUM(billed_total) AS total
+            FROM user_daily_revenue
+            WHERE user_id = %s AND invoice_count > 0
+            GROUP BY month
+            ORDER BY month DESC
+            LIMIT 6
+            """,
+            (user_id,),
+        )
+        monthly_rows = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT day, billed_total
+            FROM user_daily_revenue
+            WHERE user_id = %s AND invoice_count > 0
+            ORDER BY day DESC
+            LIMIT 30
+            """,
+            (user_id,),
+        )
+        daily_rows = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT client, billed_total, invoice_count
+            FROM user_client_totals
+            WHERE user_id = %s AND billed_total > 0
+            ORDER BY billed_total DESC
+            LIMIT 5
+            """,
+            (user_id,),
+        )
+        tc_rows = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT description, billed_total, line_count
+            FROM user_item_totals
+            WHERE user_id = %s AND billed_total > 0
+            ORDER BY billed_total DESC
+            LIMIT 7
+            """,
+            (user_id,),
+        )
+        item_rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
 
+    status_counts = {status: int(count or 0) for status, count in status_rows}
 
-# -------------------------
-# INVOICE PAYMENT / STATUS HELPERS
-# -------------------------
-def mark_invoice_paid(invoice_id: int, user_id: int, note: str = "Marked as paid manually."):
-    payment_summary = get_invoice_payment_summary(invoice_id)
-    if not payment_summary:
-        return False, "Invoice not found."
+    top_clients = []
+    if tc_rows:
+        top_total = float(tc_rows[0][1] or 0)
+        for name, total_amt, inv_count in tc_rows:
+            total_float = float(total_amt or 0)
+            pct = round((total_float / top_total) * 100, 1) if top_total > 0 else 0.0
+            top_clients.append([name, total_float, inv_count, pct])
 
-    balance = float(payment_summary.get("balance") or 0)
+    return {
+        "total_invoices": int(total_invoices or 0),
+        "total_revenue": float(total_revenue or 0),
+        "monthly_revenue": float(monthly_revenue or 0),
+        "status_counts": status_counts,
+        "monthly_chart_labels": [month_dt.strftime("%b %Y") for month_dt, _ in reversed(monthly_rows)],
+        "monthly_chart_totals": [float(total or 0) for _, total in reversed(monthly_rows)],
+        "daily_chart_labels": [day_dt.strftime("%b %d") for day_dt, _ in reversed(daily_rows)],
+        "daily_chart_totals": [float(total or 0) for _, total in reversed(daily_rows)],
+        "top_clients": top_clients,
+        "item_labels": [desc or "Untitled item" for desc, _, _ in item_rows],
+        "item_totals": [float(total or 0) for _, total, _ in item_rows],
+        "item_counts": [count or 0 for _, _, count in item_rows],
+    }
 
-    if balance <= 0.0001:
-        sync_invoice_status(invoice_id)
-        return True, None
 
+def mark_invoice_paid(invoice_id: int, user_id: int, note: str = "Marked as paid manually."):
     conn = get_db_connection()
     cur = conn.cursor()
 
     try:
-        occurred_at = now_local()
-
         cur.execute(
             """
-            INSERT INTO payments (
-                invoice_id,
-                amount,
-                method,
-                note,
-                payment_source,
-                payment_status,
-                occurred_at,
-                recorded_by_user_id,
-                is_deposit,
-                is_final_payment
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            SELECT GREATEST(COALESCE(amount, 0) - COALESCE(total_paid, 0), 0)
+            FROM invoices
+            WHERE id = %s
+            FOR UPDATE
             """,
-            (
-                invoice_id,
-                balance,
-                "manual",
-                note,
-                "manual",
-                "succeeded",
-                occurred_at,
-                user_id,
-                False,
-                True,
-            ),
+            (invoice_id,),
         )
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            return False, "Invoice not found."
 
-        cur.execute(
-            """
-            UPDATE invoices
-            SET last_payment_recorded_at = %s,
-                last_collection_action_at = %s
-            WHERE id = %s
-            """,
-            (occurred_at, occurred_at, invoice_id),
+        balance = float(row[0] or 0)
+        if balance <= 0.0001:
+            conn.rollback()
+            sync_invoice_status(invoice_id)
+            return True, None
+
+        result = record_invoice_payment(
+            cur,
+            invoice_id,
+            balance,
+            occurred_at=now_local(),
+            source="manual",
+            method="manual",
+            note=note,
+            recorded_by_user_id=user_id,
+            is_final_payment=True,
+        )
+
+        insert_invoice_events(
+            cur,
+            invoice_id,
+            result["events"]
+            + [
+                {
+                    "event_type": "manual_payment_added",
+                    "title": "Payment recorded",
+                    "details": f"Invoice was marked as paid manually. Total paid is now {format_currency(result['total_paid'])}.",
+                    "visibility": "both",
+                },
+                {
+                    "event_type": "final_payment_received",
+                    "title": "Final payment received",
+                    "details": "Invoice is now paid in full.",
+                    "visibility": "both",
+                },
+            ],
         )
 
         conn.commit()
@@ -1661,25 +3261,7 @@ def mark_invoice_paid(invoice_id: int, user_id: int, note: str = "Marked as paid
         cur.close()
         conn.close()
 
-    summary = sync_invoice_status(invoice_id) or get_invoice_payment_summary(invoice_id) or {}
-    total_paid_now = float(summary.get("total_paid") or 0)
-
-    log_invoice_event(
-        invoice_id=invoice_id,
-        event_type="manual_payment_added",
-        title="Payment recorded",
-        details=f"Invoice was marked as paid manually. Total paid is now {format_currency(total_paid_now)}.",
-        visibility="both",
-    )
-
-    log_invoice_event(
-        invoice_id=invoice_id,
-        event_type="final_payment_received",
-        title="Final payment received",
-        details="Invoice is now paid in full.",
-        visibility="both",
-    )
-
+    invalidate_invoice_pdf_cache(invoice_id)
     return True, None
 
 
@@ -1716,41 +3298,108 @@ def get_default_user():
     }
 
 
-def get_current_user():
-    user_id = session.get("user_id")
-    if user_id:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, email, plan, is_active, language, created_at FROM users WHERE id = %s",
-            (user_id,),
-        )
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
+_ANONYMOUS_USER = {
+    "id": None,
+    "email": "",
+    "plan": "free",
+    "is_active": False,
+    "language": "en",
+    "created_at": None,
+}
 
-        if row:
-            uid, email, plan, is_active, language, created_at = row
-            if is_active:
-                return {
-                    "id": uid,
-                    "email": email,
-                    "plan": normalize_plan_key(plan or "free"),
-                    "is_active": is_active,
-                    "language": normalize_lang(language or "en"),
-                    "created_at": created_at,
-                }
 
+def _load_user_identity(user_id: int):
+    """
+    Load everything a page needs to know about the signed-in user in one
+    round-trip: the users row, the Stripe Connect payment setup columns and
+    the normalized plan.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT
+            id,
+            email,
+            plan,
+            is_active,
+            language,
+            created_at,
+            stripe_connect_account_id,
+            stripe_connect_charges_enabled,
+            stripe_connect_payouts_enabled,
+            stripe_connect_details_submitted,
+            stripe_connect_last_status_sync,
+            stripe_connect_onboarded_at
+        FROM users
+        WHERE id = %s
+        """,
+        (user_id,),
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    if not row:
+        return None
+
+    uid, email, plan, is_active, language, created_at = row[:6]
     return {
-        "id": None,
-        "email": "",
-        "plan": "free",
-        "is_active": False,
-        "language": "en",
-        "created_at": None,
+        "user": {
+            "id": uid,
+            "email": email,
+            "plan": normalize_plan_key(plan or "free"),
+            "is_active": is_active,
+            "language": normalize_lang(language or "en"),
+            "created_at": created_at,
+        },
+        "payment_setup": build_user_payment_setup_state(row[6:]),
     }
 
 
+def get_request_identity(user_id: int):
+    """
+    Request-scoped cache of _load_user_identity().
+
+    Keyed by user id so a login/logout mid-request never serves the wrong
+    row. Call invalidate_request_identity() after writing to users.
+    """
+    if not user_id:
+        return None
+
+    if not has_request_context():
+        return _load_user_identity(user_id)
+
+    cache = g.setdefault("_identity_cache", {})
+    if user_id not in cache:
+        cache[user_id] = _load_user_identity(user_id)
+    return cache[user_id]
+
+
+def invalidate_request_identity(user_id: int = None):
+    if not has_request_context():
+        return
+
+    cache = g.get("_identity_cache")
+    if not cache:
+        return
+
+    if user_id is None:
+        cache.clear()
+    else:
+        cache.pop(user_id, None)
+
+
+def get_current_user():
+    user_id = session.get("user_id")
+    if user_id:
+        identity = get_request_identity(user_id)
+        if identity and identity["user"]["is_active"]:
+            return dict(identity["user"])
+
+    return dict(_ANONYMOUS_USER)
+
+
 def login_required(view_func):
     @wraps(view_func)
     def wrapped_view(*args, **kwargs):
@@ -1816,6 +3465,7 @@ def get_or_create_conversation(business_user_id, client_user_id, service_request
         )
 
         new_id = cur.fetchone()[0]
+        ensure_conversation_participants(cur, new_id)
         conn.commit()
 
         return new_id
@@ -1830,6 +3480,184 @@ def get_or_create_conversation(business_user_id, client_user_id, service_request
         conn.close()
 
 
+# conversation_participants.unread_count is the per-user unread badge for a
+# conversation. It is kept in step with messages.is_read on the writer's
+# cursor: +1 for the recipient when a message is inserted, -N when N messages
+# are marked read. `flask reconcile-unread-counts` recomputes it from messages.
+def ensure_conversation_participants(cursor, conversation_id):
+    cursor.execute(
+        """
+        INSERT INTO conversation_participants (conversation_id, user_id, role, last_activity_at)
+        SELECT c.id, p.user_id, p.role, COALESCE(c.last_message_at, c.created_at)
+        FROM conversations c
+        CROSS JOIN LATERAL (
+            VALUES (c.business_user_id, 'business'), (c.client_user_id, 'client')
+        ) AS p(user_id, role)
+        WHERE c.id = %s
+          AND p.user_id IS NOT NULL
+        ON CONFLICT (conversation_id, user_id) DO NOTHING
+        """,
+        (conversation_id,),
+    )
+
+
+def record_conversation_last_message(cursor, conversation_id, message_id, created_at, message_text):
+    """Point the conversation (and each participant's inbox sort key) at a new message."""
+    cursor.execute(
+        """
+        WITH convo AS (
+            UPDATE conversations
+            SET last_message_id = %(message_id)s,
+                last_message_at = %(created_at)s,
+                last_message_preview = LEFT(%(message_text)s, %(preview_chars)s)
+            WHERE id = %(conversation_id)s
+              AND (last_message_at IS NULL OR last_message_at <= %(created_at)s)
+            RETURNING id
+        )
+        UPDATE conversation_participants
+        SET last_activity_at = %(created_at)s
+        WHERE conversation_id IN (SELECT id FROM convo)
+        """,
+        {
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "created_at": created_at,
+            "message_text": message_text or "",
+            "preview_chars": MESSAGE_PREVIEW_CHARS,
+        },
+    )
+
+
+def increment_unread_count(cursor, conversation_id, user_id):
+    # A row created here needs its inbox sort key too: a NULL last_activity_at
+    # sorts first under DESC and breaks the inbox cursor.
+    cursor.execute(
+        """
+        INSERT INTO conversation_participants (conversation_id, user_id, unread_count, last_activity_at)
+        SELECT id, %s, 1, COALESCE(last_message_at, created_at)
+        FROM conversations
+        WHERE id = %s
+        ON CONFLICT (conversation_id, user_id)
+        DO UPDATE SET unread_count = conversation_participants.unread_count + 1
+        """,
+        (user_id, conversation_id),
+    )
+    bump_notification_version(cursor, user_id)
+
+
+def mark_conversation_messages_read(
+    cursor,
+    conversation_id,
+    user_id,
+    *,
+    up_to_id=None,
+    message_ids=None,
+) -> int:
+    """Mark the other side's unread messages read and return how many flipped.
+
+    Only rows this statement actually flips are subtracted from the counter,
+    so concurrent readers of the same conversation never double-count.
+    """
+    cursor.execute(
+        """
+        WITH marked AS (
+            UPDATE messages
+            SET is_read = TRUE
+            WHERE conversation_id = %(conversation_id)s
+              AND sender_user_id != %(user_id)s
+              AND COALESCE(is_read, FALSE) = FALSE
+              AND (%(up_to_id)s::integer IS NULL OR id <= %(up_to_id)s)
+              AND (%(message_ids)s::integer[] IS NULL OR id = ANY(%(message_ids)s::integer[]))
+            RETURNING id
+        ),
+        participant AS (
+            UPDATE conversation_participants
+            SET unread_count = GREATEST(unread_count - (SELECT COUNT(*) FROM marked), 0)
+            WHERE conversation_id = %(conversation_id)s
+              AND user_id = %(user_id)s
+              AND EXISTS (SELECT 1 FROM marked)
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM marked
+        """,
+        {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "up_to_id": up_to_id,
+            "message_ids": list(message_ids) if message_ids is not None else None,
+        },
+    )
+    marked = int(cursor.fetchone()[0] or 0)
+    if marked:
+        bump_notification_version(cursor, user_id)
+    return marked
+
+
+@app.cli.command("reconcile-unread-counts")
+@click.option("--fix", is_flag=True, help="Rewrite drifted counters from the messages table.")
+@click.option("--limit", default=20, show_default=True, type=int, help="How many drifted rows to print.")
+def reconcile_unread_counts_command(fix, limit):
+    """Compare conversation_participants.unread_count with unread messages."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT agg.conversation_id, agg.user_id, cp.unread_count, agg.unread_count
+            FROM ({CONVERSATION_UNREAD_AGGREGATE_SQL}) agg
+            LEFT JOIN conversation_participants cp
+              ON cp.conversation_id = agg.conversation_id
+             AND cp.user_id = agg.user_id
+            WHERE cp.unread_count IS DISTINCT FROM agg.unread_count
+            ORDER BY agg.conversation_id, agg.user_id
+            """
+        )
+        drifted = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT COUNT(*)
+            FROM conversation_participants cp
+            WHERE NOT EXISTS (SELECT 1 FROM conversations c WHERE c.id = cp.conversation_id)
+            """
+        )
+        orphaned = cur.fetchone()[0] or 0
+
+        for row in drifted[: max(limit, 0)]:
+            stored = "missing" if row[2] is None else row[2]
+            click.echo(f"conversation {row[0]} user {row[1]}: unread_count {stored} (expected {row[3]})")
+        click.echo(f"{len(drifted)} participant counter(s) drifted, {orphaned} orphaned row(s).")
+
+        if fix and (drifted or orphaned):
+            cur.execute(
+                f"""
+                INSERT INTO conversation_participants (conversation_id, user_id, role, unread_count, last_activity_at)
+                SELECT agg.conversation_id, agg.user_id, agg.role, agg.unread_count,
+                       COALESCE(convo.last_message_at, convo.created_at)
+                FROM ({CONVERSATION_UNREAD_AGGREGATE_SQL}) agg
+                JOIN conversations convo ON convo.id = agg.conversation_id
+                ON CONFLICT (conversation_id, user_id)
+                DO UPDATE SET unread_count = EXCLUDED.unread_count
+                WHERE conversation_participants.unread_count IS DISTINCT FROM EXCLUDED.unread_count
+                """
+            )
+            repaired = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM conversation_participants cp
+                WHERE NOT EXISTS (SELECT 1 FROM conversations c WHERE c.id = cp.conversation_id)
+                """
+            )
+            removed = cur.rowcount
+            conn.commit()
+            click.echo(f"Repaired {repaired} counter(s), removed {removed} orphaned row(s).")
+        else:
+            conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
 def send_message(conversation_id: int, sender_user_id: int, message_text: str):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -1867,22 +3695,6 @@ def send_message(conversation_id: int, sender_user_id: int, message_text: str):
         if not result:
             return False
 
-        # -------------------------
-        # KEEP CONVERSATION FRESH (ORDERING FIX)
-        # -------------------------
-        try:
-            cur.execute(
-                """
-                UPDATE conversations
-                SET created_at = %s
-                WHERE id = %s
-                """,
-                (now_local(), conversation_id),
-            )
-            conn.commit()
-        except Exception as e:
-            logger.warning("Conversation timestamp update failed: %s", e)
-
         # -------------------------
         # TRIGGER PUSH NOTIFICATION
         # -------------------------
@@ -1918,26 +3730,65 @@ def send_message(conversation_id: int, sender_user_id: int, message_text: str):
         conn.close()
 
 
-def get_conversation_messages(conversation_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def fetch_conversation_messages_page(cursor, conversation_id: int, limit: int, before_id: int = None, after_id: int = None):
+    """
+    One page of a conversation in display order (created_at, id), oldest
+    first. With after_id the page holds the rows right after that message;
+    otherwise the rows right before before_id, or the latest rows when no
+    cursor is given. Returns (rows, has_more), where has_more says whether
+    further rows exist in the direction being paged.
+    """
+    limit = max(1, min(int(limit or MESSAGE_PAGE_SIZE), MESSAGE_PAGE_MAX_SIZE))
 
-    cur.execute(
-        """
-        SELECT sender_user_id, message_text, created_at
-        FROM messages
-        WHERE conversation_id = %s
-        ORDER BY created_at ASC
+    conditions = ["m.conversation_id = %s"]
+    params = [conversation_id]
+
+    if after_id is not None:
+        if after_id:
+            conditions.append("(m.created_at, m.id) > (SELECT c.created_at, c.id FROM messages c WHERE c.id = %s)")
+            params.append(after_id)
+        order = "ASC"
+    else:
+        if before_id:
+            conditions.append("(m.created_at, m.id) < (SELECT c.created_at, c.id FROM messages c WHERE c.id = %s)")
+            params.append(before_id)
+        order = "DESC"
+
+    cursor.execute(
+        f"""
+        SELECT m.id, m.conversation_id, m.sender_user_id, m.message_text, m.created_at
+        FROM messages m
+        WHERE {" AND ".join(conditions)}
+        ORDER BY m.created_at {order}, m.id {order}
+        LIMIT %s
         """,
-        (conversation_id,),
+        params + [limit + 1],
     )
+    rows = cursor.fetchall()
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+    return rows, has_more
+
+
+def get_conversation_messages(conversation_id: int, limit: int = None, before_id: int = None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        rows, _has_more = fetch_conversation_messages_page(
+            cur,
+            conversation_id,
+            limit or MESSAGE_PAGE_SIZE,
+            before_id=before_id,
+        )
+    finally:
+        cur.close()
+        conn.close()
 
     messages = []
-    for sender_user_id, message_text, created_at in rows:
+    for _id, _conversation_id, sender_user_id, message_text, created_at in rows:
         messages.append({
             "sender_user_id": sender_user_id,
             "message_text": message_text,
@@ -1957,18 +3808,11 @@ def get_unread_message_count(user_id: int) -> int:
 
     cur.execute(
         """
-        SELECT COUNT(*)
-        FROM messages m
-        JOIN conversations c ON m.conversation_id = c.id
-        WHERE
-            (
-                (c.business_user_id = %s AND m.sender_user_id = c.client_user_id)
-                OR
-                (c.client_user_id = %s AND m.sender_user_id = c.business_user_id)
-            )
-            AND COALESCE(m.is_read, FALSE) = FALSE
+        SELECT COALESCE(SUM(unread_count), 0)
+        FROM conversation_participants
+        WHERE user_id = %s
         """,
-        (user_id, user_id, user_id),
+        (user_id,),
     )
 
     count = cur.fetchone()[0] or 0
@@ -2386,17 +4230,33 @@ def api_send_message():
     })
 
 
-@app.route("/messages")
-@login_required
-def messages_page():
-    user = get_current_user()
-    user_id = user["id"]
+def encode_inbox_cursor(last_activity_at, conversation_id) -> str:
+    # Same (timestamp, id) token format as the invoice list.
+    return encode_invoice_cursor(last_activity_at, conversation_id)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    cur.execute(
-        """
+def decode_inbox_cursor(token: str):
+    return decode_invoice_cursor(token)
+
+
+def get_inbox_page(cursor, user_id: int, cursor_token: str = "", page_size: int = None):
+    """
+    One keyset page of the user's conversations, most recent activity first.
+    Walks conversation_participants_inbox_idx and reads the latest message
+    from the conversations.last_message_* pointer, so the cost does not grow
+    with message history.
+    """
+    page_size = page_size or MESSAGE_INBOX_PAGE_SIZE
+    where_sql = "part.user_id = %s"
+    params = [user_id]
+
+    after = decode_inbox_cursor(cursor_token)
+    if after:
+        where_sql += " AND (part.last_activity_at, part.conversation_id) < (%s, %s)"
+        params.extend(after)
+
+    cursor.execute(
+        f"""
         SELECT
             c.id,
             c.business_user_id,
@@ -2407,10 +4267,12 @@ def messages_page():
             bp.business_name,
             cp.display_name,
             sr.client_name,
-            m.message_text,
-            m.created_at,
-            COALESCE(um.unread_count, 0) AS unread_count
-        FROM conversations c
+            c.last_message_preview,
+            c.last_message_at,
+            part.unread_count,
+            part.last_activity_at
+        FROM conversation_participants part
+        JOIN conversations c ON c.id = part.conversation_id
 
         LEFT JOIN users bu ON bu.id = c.business_user_id
         LEFT JOIN users cu ON cu.id = c.client_user_id
@@ -2423,46 +4285,46 @@ def messages_page():
         LEFT JOIN service_requests sr
             ON sr.id = c.service_request_id
 
-        LEFT JOIN LATERAL (
-            SELECT message_text, created_at
-            FROM messages
-            WHERE conversation_id = c.id
-            ORDER BY created_at DESC
-            LIMIT 1
-        ) m ON TRUE
+        WHERE {where_sql}
+        ORDER BY part.last_activity_at DESC, part.conversation_id DESC
+        LIMIT %s
+        """,
+        tuple(params) + (page_size + 1,),
+    )
+    rows = cursor.fetchall()
 
-        LEFT JOIN LATERAL (
-            SELECT COUNT(*) AS unread_count
-            FROM messages m2
-            WHERE m2.conversation_id = c.id
-              AND m2.sender_user_id != %s
-              AND COALESCE(m2.is_read, FALSE) = FALSE
-        ) um ON TRUE
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
 
-        WHERE c.business_user_id = %s
-           OR c.client_user_id = %s
+    next_cursor = None
+    if has_more and rows and rows[-1][12]:
+        next_cursor = encode_inbox_cursor(rows[-1][12], rows[-1][0])
 
-        ORDER BY COALESCE(m.created_at, c.created_at) DESC
-        """,
-        (user_id, user_id, user_id),
-    )
+    return {
+        "rows": rows,
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+    }
 
-    rows = cur.fetchall()
+
+@app.route("/messages")
+@login_required
+def messages_page():
+    user = get_current_user()
+    user_id = user["id"]
+    cursor_token = (request.args.get("cursor") or "").strip()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    page = get_inbox_page(cur, user_id, cursor_token)
+    rows = page["rows"]
 
     # --- MARK CURRENT CONVERSATION AS READ (SAFE) ---
     conversation_id = request.args.get("conversation_id")
 
     if conversation_id:
-        cur.execute(
-            """
-            UPDATE messages
-            SET is_read = TRUE
-            WHERE conversation_id = %s
-              AND sender_user_id != %s
-              AND COALESCE(is_read, FALSE) = FALSE
-            """,
-            (conversation_id, user_id),
-        )
+        mark_conversation_messages_read(cur, conversation_id, user_id)
         conn.commit()
 
     conversations = []
@@ -2534,26 +4396,20 @@ def messages_page():
             valid = cur.fetchone()
 
             if valid:
-                cur.execute(
-                    """
-                    SELECT id, sender_user_id, message_text, created_at
-                    FROM messages
-                    WHERE conversation_id = %s
-                    ORDER BY created_at ASC
-                    """,
-                    (open_conversation_id,),
+                rows, _has_more = fetch_conversation_messages_page(
+                    cur,
+                    open_conversation_id,
+                    MESSAGE_PAGE_SIZE,
                 )
 
-                rows = cur.fetchall()
-
                 active_messages = [
                     {
                         "id": r[0],
-                        "sender_user_id": r[1],
-                        "message_text": r[2],
+                        "sender_user_id": r[2],
+                        "message_text": r[3],
                         "created_at": (
-                            r[3].strftime("%I:%M %p").lstrip("0")
-                            if r[3]
+                            r[4].strftime("%I:%M %p").lstrip("0")
+                            if r[4]
                             else ""
                          ),
                     }
@@ -2570,7 +4426,10 @@ def messages_page():
         "messages.html",
         conversations=conversations,
         active_messages=active_messages,
-        open_conversation_id=open_conversation_id
+        open_conversation_id=open_conversation_id,
+        cursor=cursor_token,
+        has_more_conversations=page["has_more"],
+        next_cursor=page["next_cursor"],
     )
 
 @app.route("/api/conversation/delete/<int:conversation_id>", methods=["POST"])
@@ -2586,6 +4445,18 @@ def delete_conversation(conversation_id):
             (conversation_id,)
         )
 
+        cur.execute(
+            """
+            DELETE FROM conversation_participants
+            WHERE conversation_id = %s
+            RETURNING user_id, unread_count
+            """,
+            (conversation_id,)
+        )
+        for participant_user_id, participant_unread in cur.fetchall():
+            if participant_unread:
+                bump_notification_version(cur, participant_user_id)
+
         # delete conversation
         cur.execute(
             "DELETE FROM conversations WHERE id = %s",
@@ -2611,20 +4482,14 @@ def mark_conversation_read(conversation_id):
     user = get_current_user()
     user_id = user["id"]
 
+    # Optional ?up_to_id: only mark what the client has actually shown.
+    up_to_id = parse_message_cursor(request.args.get("up_to_id"))
+
     conn = get_db_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute(
-            """
-            UPDATE messages
-            SET is_read = TRUE
-            WHERE conversation_id = %s
-              AND sender_user_id != %s
-              AND COALESCE(is_read, FALSE) = FALSE
-            """,
-            (conversation_id, user_id),
-        )
+        mark_conversation_messages_read(cur, conversation_id, user_id, up_to_id=up_to_id)
 
         conn.commit()
 
@@ -2668,34 +4533,35 @@ def get_messages(conversation_id):
         return jsonify({"error": "Unauthorized"}), 403
 
     # -------------------------
-    # MARK MESSAGES AS READ (DO THIS FIRST)
+    # FETCH ONE PAGE
     # -------------------------
-    cursor.execute(
-        """
-        UPDATE messages
-        SET is_read = TRUE
-        WHERE conversation_id = %s
-          AND sender_user_id != %s
-        """,
-        (conversation_id, user_id),
-    )
+    # ?before_id pages back through history (latest page by default);
+    # ?after_id pages forward.
+    before_id = parse_message_cursor(request.args.get("before_id"))
+    after_id = parse_message_cursor(request.args.get("after_id"))
+    limit = parse_message_cursor(request.args.get("limit")) or MESSAGE_PAGE_SIZE
 
-    conn.commit()
+    rows, has_more = fetch_conversation_messages_page(
+        cursor,
+        conversation_id,
+        limit,
+        before_id=before_id,
+        after_id=after_id,
+    )
 
     # -------------------------
-    # FETCH MESSAGES
+    # MARK DELIVERED MESSAGES AS READ
     # -------------------------
-    cursor.execute(
-        """
-        SELECT id, conversation_id, sender_user_id, message_text, created_at
-        FROM messages
-        WHERE conversation_id = %s
-        ORDER BY created_at ASC
-        """,
-        (conversation_id,)
-    )
+    delivered_ids = [r[0] for r in rows if r[2] != user_id]
+    if delivered_ids:
+        mark_conversation_messages_read(
+            cursor,
+            conversation_id,
+            user_id,
+            message_ids=delivered_ids,
+        )
 
-    rows = cursor.fetchall()
+    conn.commit()
 
     messages = [
         {
@@ -2711,7 +4577,318 @@ def get_messages(conversation_id):
     cursor.close()
     conn.close()
 
-    return jsonify({"messages": messages})
+    return jsonify({
+        "messages": messages,
+        "has_more": has_more,
+        "direction": "after" if after_id is not None else "before",
+    })
+
+
+# -------------------------
+# MESSAGE STREAM
+# -------------------------
+# send_message_in_conversation() NOTIFYs conversation_messages when its
+# transaction commits. Open chats receive new rows over SSE
+# (/api/messages/<id>/stream) or, where EventSource is unavailable or the
+# process is at capacity, long-poll /api/messages/<id>/poll.
+
+
+class MessageStreamHub:
+    """
+    One LISTEN connection per process fans conversation_messages NOTIFYs out
+    to that process's stream subscribers. The listener thread starts with the
+    first subscriber and closes MESSAGE_STREAM_IDLE_SECONDS after the last one
+    leaves; subscribers are capped at MESSAGE_STREAM_MAX_SUBSCRIBERS. A
+    subscriber's queue only carries wake-ups; it reads the new rows itself,
+    so a dropped wake-up never loses a message.
+    """
+
+    def __init__(self, max_subscribers: int):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._count = 0
+        self._thread = None
+        self._pid = os.getpid()
+        self._stats = {"wakeups": 0, "rejected": 0, "listener_starts": 0}
+
+    def subscribe(self, conversation_id: int):
+        """Returns a wake-up queue, or None when this process is at capacity."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._subscribers, self._count, self._thread = {}, 0, None
+                self._pid = os.getpid()
+
+            if self._count >= self.max_subscribers:
+                self._stats["rejected"] += 1
+                return None
+
+            wakeups = queue.Queue(maxsize=1)
+            self._subscribers.setdefault(conversation_id, set()).add(wakeups)
+            self._count += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="message-stream", daemon=True)
+                self._thread.start()
+                self._stats["listener_starts"] += 1
+            return wakeups
+
+    def unsubscribe(self, conversation_id: int, wakeups):
+        with self._lock:
+            subscribers = self._subscribers.get(conversation_id)
+            if subscribers and wakeups in subscribers:
+                subscribers.discard(wakeups)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[conversation_id]
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["subscribers"] = self._count
+            data["conversations"] = len(self._subscribers)
+            data["max_subscribers"] = self.max_subscribers
+            data["listening"] = self._thread is not None
+        return data
+
+    def _dispatch(self, payload: str):
+        try:
+            conversation_id = int(json.loads(payload)["conversation_id"])
+        except (ValueError, KeyError, TypeError):
+            return
+
+        with self._lock:
+            targets = list(self._subscribers.get(conversation_id, ()))
+            self._stats["wakeups"] += len(targets)
+
+        for wakeups in targets:
+            try:
+                wakeups.put_nowait(True)
+            except queue.Full:
+                pass  # a wake-up is already pending
+
+    def _should_stop(self, idle_since):
+        # Returns (stop, idle_since); clears _thread under the lock so the
+        # next subscribe() starts a fresh listener.
+        with self._lock:
+            if self._count:
+                return False, None
+            if idle_since is None:
+                return False, time.monotonic()
+            if time.monotonic() - idle_since < MESSAGE_STREAM_IDLE_SECONDS:
+                return False, idle_since
+            self._thread = None
+            return True, idle_since
+
+    def _run(self):
+        listener = None
+        idle_since = None
+        try:
+            while True:
+                stop, idle_since = self._should_stop(idle_since)
+                if stop:
+                    return
+
+                try:
+                    if listener is None or listener.closed:
+                        listener = open_notification_listener(MESSAGE_STREAM_CHANNEL)
+
+                    if select.select([listener], [], [], 1.0) == ([], [], []):
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        self._dispatch(listener.notifies.pop(0).payload)
+                except Exception:
+                    logger.exception("[MessageStream] Listener failed; reconnecting")
+                    if listener is not None:
+                        try:
+                            listener.close()
+                        except Exception:
+                            pass
+                    listener = None
+                    time.sleep(1)
+        finally:
+            if listener is not None and not listener.closed:
+                listener.close()
+
+
+_MESSAGE_STREAM_HUB = MessageStreamHub(MESSAGE_STREAM_MAX_SUBSCRIBERS)
+
+
+def get_message_stream_stats():
+    return _MESSAGE_STREAM_HUB.stats()
+
+
+def publish_conversation_message(cursor, conversation_id: int, message_id: int, sender_user_id: int):
+    # Sent by Postgres only if the caller's transaction commits.
+    cursor.execute(
+        "SELECT pg_notify(%s, %s)",
+        (
+            MESSAGE_STREAM_CHANNEL,
+            json.dumps(
+                {
+                    "conversation_id": conversation_id,
+                    "message_id": message_id,
+                    "sender_user_id": sender_user_id,
+                }
+            ),
+        ),
+    )
+
+
+def is_conversation_participant(conversation_id: int, user_id: int) -> bool:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT 1
+            FROM conversations
+            WHERE id = %s
+              AND (business_user_id = %s OR client_user_id = %s)
+            """,
+            (conversation_id, user_id, user_id),
+        )
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_conversation_messages_after(conversation_id: int, after_id: int = None, limit: int = 200):
+    """Messages newer than after_id, oldest first. With no after_id, only the latest id is returned as a cursor."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if after_id is None:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages WHERE conversation_id = %s", (conversation_id,))
+            return [], int(cur.fetchone()[0])
+
+        cur.execute(
+            """
+            SELECT id, conversation_id, sender_user_id, message_text, created_at
+            FROM messages
+            WHERE conversation_id = %s
+              AND id > %s
+            ORDER BY id ASC
+            LIMIT %s
+            """,
+            (conversation_id, after_id, limit),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    messages = [
+        {
+            "id": r[0],
+            "conversation_id": r[1],
+            "sender_user_id": r[2],
+            "message_text": r[3],
+            "created_at": r[4].isoformat() if r[4] else None,
+        }
+        for r in rows
+    ]
+    return messages, (messages[-1]["id"] if messages else after_id)
+
+
+def parse_message_cursor(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+@app.route("/api/messages/<int:conversation_id>/stream", methods=["GET"])
+@login_required
+def stream_messages(conversation_id):
+    user_id = get_current_user()["id"]
+    if not is_conversation_participant(conversation_id, user_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Flask answers HEAD on GET routes, but a HEAD response never iterates
+    # the body, so it must not take a stream slot.
+    if request.method == "HEAD":
+        return Response(mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    after_id = parse_message_cursor(request.headers.get("Last-Event-ID") or request.args.get("after_id"))
+
+    wakeups = _MESSAGE_STREAM_HUB.subscribe(conversation_id)
+    if wakeups is None:
+        return jsonify({"error": "Too many open streams", "fallback": "poll"}), 503, {"Retry-After": "5"}
+
+    # The request context (and its pooled connection) is torn down before the
+    # body is iterated, so the generator checks connections out per query.
+    def generate(after_id):
+        try:
+            messages, after_id = get_conversation_messages_after(conversation_id, after_id)
+            yield f"retry: {MESSAGE_STREAM_RETRY_MS}\n\n"
+
+            deadline = time.monotonic() + MESSAGE_STREAM_MAX_SECONDS
+            while True:
+                for message in messages:
+                    yield f"id: {message['id']}\ndata: {json.dumps(message)}\n\n"
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # EventSource reconnects with Last-Event-ID.
+                    return
+
+                try:
+                    wakeups.get(timeout=min(MESSAGE_STREAM_HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    messages = []
+                    yield ": keep-alive\n\n"
+                    continue
+
+                messages, after_id = get_conversation_messages_after(conversation_id, after_id)
+        finally:
+            _MESSAGE_STREAM_HUB.unsubscribe(conversation_id, wakeups)
+
+    response = Response(
+        generate(after_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Closing a generator that never started skips its finally, so the slot
+    # is also freed when the response itself is closed (unsubscribe is
+    # idempotent).
+    response.call_on_close(partial(_MESSAGE_STREAM_HUB.unsubscribe, conversation_id, wakeups))
+    return response
+
+
+@app.route("/api/messages/<int:conversation_id>/poll", methods=["GET"])
+@login_required
+def poll_messages(conversation_id):
+    user_id = get_current_user()["id"]
+    if not is_conversation_participant(conversation_id, user_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    after_id = parse_message_cursor(request.args.get("after_id"))
+    messages, after_id = get_conversation_messages_after(conversation_id, after_id)
+    if messages or request.args.get("after_id") is None:
+        return jsonify({"messages": messages, "after_id": after_id})
+
+    wakeups = _MESSAGE_STREAM_HUB.subscribe(conversation_id)
+    if wakeups is None:
+        return jsonify({"messages": [], "after_id": after_id, "retry_after": 5})
+
+    try:
+        # Subscribed before re-checking, so a message sent in between still wakes us.
+        messages, after_id = get_conversation_messages_after(conversation_id, after_id)
+        if not messages:
+            # Don't sit on a pooled connection for the whole wait.
+            release_idle_request_db_connections()
+            try:
+                wakeups.get(timeout=MESSAGE_LONG_POLL_SECONDS)
+                messages, after_id = get_conversation_messages_after(conversation_id, after_id)
+            except queue.Empty:
+                pass
+    finally:
+        _MESSAGE_STREAM_HUB.unsubscribe(conversation_id, wakeups)
+
+    return jsonify({"messages": messages, "after_id": after_id})
 
 
 @app.route("/api/create-test-convo")
@@ -2734,15 +4911,21 @@ def create_test_convo():
     )
 
     convo_id = cur.fetchone()[0]
+    ensure_conversation_participants(cur, convo_id)
 
     # add first message
     cur.execute(
         """
         INSERT INTO messages (conversation_id, sender_user_id, message_text)
         VALUES (%s, %s, %s)
+        RETURNING id, created_at
         """,
         (convo_id, user_id, "Test message working 🚀")
     )
+    message_id, message_created_at = cur.fetchone()
+    record_conversation_last_message(
+        cur, convo_id, message_id, message_created_at, "Test message working 🚀"
+    )
 
     conn.commit()
     cur.close()
@@ -3059,6 +5242,19 @@ def business_search():
     return render_template("business_search.html", results=results, query=query)
 
 
+@app.route("/api/business-search/suggest")
+def business_search_suggest():
+    query = (request.args.get("q") or "").strip()
+    try:
+        limit = int(request.args.get("limit") or BUSINESS_SUGGEST_DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        limit = BUSINESS_SUGGEST_DEFAULT_LIMIT
+    limit = max(1, min(limit, BUSINESS_SUGGEST_MAX_LIMIT))
+
+    results = search_businesses_by_name(query, limit=limit, prefix_only=True) if query else []
+    return jsonify({"query": query, "results": results}), 200
+
+
 @app.route("/business/<int:user_id>")
 def business_profile(user_id):
     profile = get_business_profile_by_user_id(user_id)
@@ -3097,6 +5293,20 @@ def follow_business(user_id):
         )
 
         followed_now = cur.rowcount > 0
+        if followed_now:
+            cur.execute(
+                """
+                UPDATE business_profile
+                SET follower_count = follower_count + 1
+                WHERE id = (
+                    SELECT id FROM business_profile
+                    WHERE user_id = %s
+                    ORDER BY id ASC
+                    LIMIT 1
+                )
+                """,
+                (user_id,),
+            )
         conn.commit()
 
     except Exception:
@@ -3137,6 +5347,21 @@ def unfollow_business(user_id):
         (client_id, user_id),
     )
 
+    if cur.rowcount > 0:
+        cur.execute(
+            """
+            UPDATE business_profile
+            SET follower_count = GREATEST(follower_count - 1, 0)
+            WHERE id = (
+                SELECT id FROM business_profile
+                WHERE user_id = %s
+                ORDER BY id ASC
+                LIMIT 1
+            )
+            """,
+            (user_id,),
+        )
+
     conn.commit()
     cur.close()
     conn.close()
@@ -3275,6 +5500,10 @@ def get_plan_for_current_user():
 
 
 def get_user_plan_by_user_id(user_id: int) -> str:
+    if has_request_context() and user_id in g.get("_identity_cache", {}):
+        identity = g._identity_cache[user_id]
+        return identity["user"]["plan"] if identity else "free"
+
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT plan FROM users WHERE id = %s", (user_id,))
@@ -3295,11 +5524,9 @@ def get_invoice_by_public_token(token: str):
             i.status,
             i.amount,
             i.invoice_number,
-            COALESCE(SUM(p.amount), 0) AS total_paid
+            COALESCE(i.total_paid, 0) AS total_paid
         FROM invoices i
-        LEFT JOIN payments p ON p.invoice_id = i.id
         WHERE i.public_token = %s
-        GROUP BY i.id, i.user_id, i.status, i.amount, i.invoice_number
         """,
         (token,),
     )
@@ -3336,13 +5563,11 @@ def get_invoice_payment_summary(invoice_id: int):
             i.status,
             i.due_date,
             i.invoice_number,
-            COALESCE(SUM(CASE WHEN COALESCE(p.payment_status, 'succeeded') != 'failed' THEN p.amount ELSE 0 END), 0) AS total_paid,
-            COUNT(p.id) FILTER (WHERE COALESCE(p.payment_status, 'succeeded') != 'failed') AS payment_count,
-            MAX(COALESCE(p.occurred_at, p.created_at)) FILTER (WHERE COALESCE(p.payment_status, 'succeeded') != 'failed') AS last_payment_at
+            COALESCE(i.total_paid, 0),
+            COALESCE(i.payment_count, 0),
+            i.last_payment_at
         FROM invoices i
-        LEFT JOIN payments p ON p.invoice_id = i.id
         WHERE i.id = %s
-        GROUP BY i.id, i.amount, i.status, i.due_date, i.invoice_number
         """,
         (invoice_id,),
     )
@@ -3563,103 +5788,88 @@ def get_invoice_collection_recommendation(status: str, payment_summary: dict, vi
         return "Viewed and overdue. Best next step: send a professional overdue reminder."
 
     if view_summary.get("view_count", 0) >= 1 and payment_summary.get("balance", 0) > 0:
-        return "Viewed but unpaid. Best next step: send a reminder."
-
-    if not view_summary.get("has_been_viewed"):
-        return "Sent but not yet viewed. Best next step: follow up gently."
-
-    if last_reminder_sent_at:
-        return "Reminder already sent. Monitor before sending another one."
-
-    return "Open invoice. Monitor and follow up if needed."
-
-
-def get_dashboard_receivables_metrics(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            i.id,
-            i.amount,
-            i.created_at,
-            i.due_date,
-            COALESCE(i.view_count, 0),
-            COALESCE(SUM(CASE WHEN COALESCE(p.payment_status, 'succeeded') != 'failed' THEN p.amount ELSE 0 END), 0) AS total_paid
-        FROM invoices i
-        LEFT JOIN payments p ON p.invoice_id = i.id
-        WHERE i.user_id = %s
-        GROUP BY i.id, i.amount, i.created_at, i.due_date, i.view_count
-        """,
-        (user_id,),
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    now = now_local()
-    month_start = datetime(now.year, now.month, 1)
-    next_month = (month_start + timedelta(days=32)).replace(day=1)
-
-    outstanding_receivables = 0.0
-    overdue_receivables = 0.0
-    amount_outstanding_this_month = 0.0
-    viewed_but_unpaid_count = 0
-    sent_not_viewed_count = 0
-    paid_invoice_count = 0
-    unpaid_invoice_count = 0
-    payment_day_samples = []
-
-    for invoice_id, amount, created_at, due_date, view_count, total_paid in rows:
-        amount = float(amount or 0)
-        total_paid = float(total_paid or 0)
-        balance = max(amount - total_paid, 0.0)
-
-        if balance > 0:
-            outstanding_receivables += balance
-            unpaid_invoice_count += 1
+        return "Viewed but unpaid. Best next step: send a reminder."
 
-        if due_date and due_date < now and balance > 0:
-            overdue_receivables += balance
+    if not view_summary.get("has_been_viewed"):
+        return "Sent but not yet viewed. Best next step: follow up gently."
 
-        if created_at and month_start <= created_at < next_month and balance > 0:
-            amount_outstanding_this_month += balance
+    if last_reminder_sent_at:
+        return "Reminder already sent. Monitor before sending another one."
 
-        if view_count and balance > 0:
-            viewed_but_unpaid_count += 1
+    return "Open invoice. Monitor and follow up if needed."
 
-        if not view_count and balance > 0:
-            sent_not_viewed_count += 1
 
-        if balance <= 0.0001:
-            paid_invoice_count += 1
-            summary = get_invoice_payment_summary(invoice_id)
-            if created_at and summary and summary.get("last_payment_at"):
-                delta = (summary["last_payment_at"] - created_at).days
-                if delta >= 0:
-                    payment_day_samples.append(delta)
+def get_dashboard_receivables_metrics(user_id: int):
+    now = now_local()
+    month_start = datetime(now.year, now.month, 1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
 
+    # One pass over the user's invoices using the payment rollup columns,
+    # plus the month's collected amount from user_daily_revenue. Still O(n) in
+    # the user's invoice count (an index scan on user_id feeding the
+    # aggregate); it replaces one query per paid invoice, not the scan itself.
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT COALESCE(SUM(p.amount), 0)
-        FROM payments p
-        JOIN invoices i ON i.id = p.invoice_id
-        WHERE i.user_id = %s
-          AND COALESCE(p.payment_status, 'succeeded') != 'failed'
-          AND COALESCE(p.occurred_at, p.created_at) >= %s
-          AND COALESCE(p.occurred_at, p.created_at) < %s
+        WITH inv AS (
+            SELECT
+                i.created_at,
+                i.due_date,
+                COALESCE(i.view_count, 0) AS view_count,
+                i.last_payment_at,
+                GREATEST(COALESCE(i.amount, 0) - COALESCE(i.total_paid, 0), 0) AS balance
+            FROM invoices i
+            WHERE i.user_id = %(user_id)s
+        )
+        SELECT
+            COALESCE(SUM(balance) FILTER (WHERE balance > 0), 0),
+            COALESCE(SUM(balance) FILTER (WHERE balance > 0 AND due_date < %(now)s), 0),
+            COALESCE(SUM(balance) FILTER (
+                WHERE balance > 0 AND created_at >= %(month_start)s AND created_at < %(next_month)s
+            ), 0),
+            COUNT(*) FILTER (WHERE balance > 0 AND view_count <> 0),
+            COUNT(*) FILTER (WHERE balance > 0 AND view_count = 0),
+            COUNT(*) FILTER (WHERE balance <= 0.0001),
+            COUNT(*) FILTER (WHERE balance > 0),
+            AVG(FLOOR(EXTRACT(EPOCH FROM (last_payment_at - created_at)) / 86400)) FILTER (
+                WHERE balance <= 0.0001 AND last_payment_at >= created_at
+            ),
+            (
+                SELECT COALESCE(SUM(r.collected_total), 0)
+                FROM user_daily_revenue r
+                WHERE r.user_id = %(user_id)s
+                  AND r.day >= %(month_start)s
+                  AND r.day < %(next_month)s
+            )
+        FROM inv
         """,
-        (user_id, month_start, next_month),
+        {"user_id": user_id, "now": now, "month_start": month_start, "next_month": next_month},
     )
-    amount_collected_this_month = float(cur.fetchone()[0] or 0)
+    (
+        outstanding_receivables,
+        overdue_receivables,
+        amount_outstanding_this_month,
+        viewed_but_unpaid_count,
+        sent_not_viewed_count,
+        paid_invoice_count,
+        unpaid_invoice_count,
+        avg_days_to_payment,
+        amount_collected_this_month,
+    ) = cur.fetchone()
     cur.close()
     conn.close()
 
+    outstanding_receivables = float(outstanding_receivables or 0)
+    overdue_receivables = float(overdue_receivables or 0)
+    amount_outstanding_this_month = float(amount_outstanding_this_month or 0)
+    amount_collected_this_month = float(amount_collected_this_month or 0)
+    paid_invoice_count = int(paid_invoice_count or 0)
+    unpaid_invoice_count = int(unpaid_invoice_count or 0)
+
     total_closed = paid_invoice_count + unpaid_invoice_count
     collection_rate = round((paid_invoice_count / total_closed) * 100, 1) if total_closed > 0 else 0.0
-    avg_days_to_payment = round(sum(payment_day_samples) / len(payment_day_samples), 1) if payment_day_samples else None
+    avg_days_to_payment = round(float(avg_days_to_payment), 1) if avg_days_to_payment is not None else None
 
     reserve_pct = clean_percent(os.environ.get("DEFAULT_TAX_RESERVE_PERCENT"), DEFAULT_TAX_RESERVE_PERCENT)
     suggested_tax_reserve = round(amount_collected_this_month * (reserve_pct / 100.0), 2)
@@ -3670,8 +5880,8 @@ def get_dashboard_receivables_metrics(user_id: int):
         "overdue_receivables": round(overdue_receivables, 2),
         "amount_collected_this_month": round(amount_collected_this_month, 2),
         "amount_outstanding_this_month": round(amount_outstanding_this_month, 2),
-        "viewed_but_unpaid_count": viewed_but_unpaid_count,
-        "sent_not_viewed_count": sent_not_viewed_count,
+        "viewed_but_unpaid_count": int(viewed_but_unpaid_count or 0),
+        "sent_not_viewed_count": int(sent_not_viewed_count or 0),
         "collection_rate": collection_rate,
         "avg_days_to_payment": avg_days_to_payment,
         "tax_reserve_percent": reserve_pct,
@@ -3753,36 +5963,111 @@ def can_send_full_experience(user_or_plan=None) -> bool:
 # -------------------------
 # BUSINESS DISCOVERY HELPERS
 # -------------------------
-def search_businesses_by_name(query: str, limit: int = 20):
-    query = (query or "").strip().lower()
+_BUSINESS_SEARCH_CACHE = OrderedDict()
+_BUSINESS_SEARCH_CACHE_LOCK = threading.Lock()
+
+# Trigrams need at least three characters; shorter queries are prefix-only.
+BUSINESS_SEARCH_MIN_SUBSTRING_LENGTH = 3
+BUSINESS_SUGGEST_DEFAULT_LIMIT = 8
+BUSINESS_SUGGEST_MAX_LIMIT = 20
+
+
+def normalize_business_name(value: str) -> str:
+    # Mirrors business_profile.name_normalized.
+    return " ".join((value or "").split()).lower()
+
+
+def _get_cached_business_search(key):
+    now_ts = time.monotonic()
+    with _BUSINESS_SEARCH_CACHE_LOCK:
+        entry = _BUSINESS_SEARCH_CACHE.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at <= now_ts:
+            del _BUSINESS_SEARCH_CACHE[key]
+            return None
+        _BUSINESS_SEARCH_CACHE.move_to_end(key)
+        return results
+
+
+def _store_cached_business_search(key, results):
+    if BUSINESS_SEARCH_CACHE_TTL_SECONDS <= 0:
+        return
+    expires_at = time.monotonic() + BUSINESS_SEARCH_CACHE_TTL_SECONDS
+    with _BUSINESS_SEARCH_CACHE_LOCK:
+        _BUSINESS_SEARCH_CACHE[key] = (expires_at, results)
+        _BUSINESS_SEARCH_CACHE.move_to_end(key)
+        while len(_BUSINESS_SEARCH_CACHE) > BUSINESS_SEARCH_CACHE_MAX_ENTRIES:
+            _BUSINESS_SEARCH_CACHE.popitem(last=False)
+
+
+def clear_business_search_cache():
+    with _BUSINESS_SEARCH_CACHE_LOCK:
+        _BUSINESS_SEARCH_CACHE.clear()
+
+
+def search_businesses_by_name(query: str, limit: int = 20, prefix_only: bool = False):
+    """
+    Directory search over business_profile.name_normalized. The indexes only
+    find the matching rows: prefix matches via the text_pattern_ops index,
+    substring matches via the trigram index when pg_trgm is enabled. Ranking
+    (prefix matches first, then follower count) sorts every match before the
+    LIMIT, so cost grows with the number of matches, not the top N; the
+    minimum substring length keeps that set small. Results are cached
+    in-process for BUSINESS_SEARCH_CACHE_TTL_SECONDS.
+    """
+    query = normalize_business_name(query)
     if not query:
         return []
 
+    cache_key = (query, limit, prefix_only)
+    cached = _get_cached_business_search(cache_key)
+    if cached is not None:
+        return [dict(row) for row in cached]
+
+    prefix_pattern = escape_like(query) + "%"
+    match_pattern = prefix_pattern
+
+    # Without pg_trgm the substring match is a sequential scan, the same as
+    # the original LIKE '%q%' search.
+    if not prefix_only and len(query) >= BUSINESS_SEARCH_MIN_SUBSTRING_LENGTH:
+        match_pattern = "%" + prefix_pattern
+
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT bp.user_id, bp.business_name, bp.logo_url
-        FROM business_profile bp
-        WHERE LOWER(bp.business_name) LIKE %s
-        ORDER BY bp.business_name ASC
-        LIMIT %s
-        """,
-        (f"%{query}%", limit),
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    try:
+        cur.execute(
+            """
+            SELECT bp.user_id, bp.business_name, bp.logo_url, bp.follower_count
+            FROM business_profile bp
+            WHERE bp.name_normalized LIKE %s
+              AND bp.user_id IS NOT NULL
+            ORDER BY
+                (bp.name_normalized LIKE %s) DESC,
+                bp.follower_count DESC,
+                bp.name_normalized ASC,
+                bp.user_id ASC
+            LIMIT %s
+            """,
+            (match_pattern, prefix_pattern, limit),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
 
     results = []
-    for user_id, name, logo_url in rows:
+    for user_id, name, logo_url, follower_count in rows:
         results.append({
             "user_id": user_id,
             "business_name": name or "",
             "logo_url": logo_url or "",
+            "follower_count": int(follower_count or 0),
         })
 
-    return results
+    _store_cached_business_search(cache_key, results)
+    return [dict(row) for row in results]
 
 
 # -------------------------
@@ -3870,44 +6155,22 @@ def check_invoice_quota_or_reason():
     return True, None
 
 
-def get_user_payment_setup(user_id: int):
-    default_state = {
-        "stripe_connect_account_id": "",
-        "charges_enabled": False,
-        "payouts_enabled": False,
-        "details_submitted": False,
-        "is_connected": False,
-        "is_ready": False,
-        "last_status_sync": None,
-        "onboarded_at": None,
-        "status_label": "Not connected",
-    }
-
-    if not user_id:
-        return default_state
+_DEFAULT_PAYMENT_SETUP_STATE = {
+    "stripe_connect_account_id": "",
+    "charges_enabled": False,
+    "payouts_enabled": False,
+    "details_submitted": False,
+    "is_connected": False,
+    "is_ready": False,
+    "last_status_sync": None,
+    "onboarded_at": None,
+    "status_label": "Not connected",
+}
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT
-            stripe_connect_account_id,
-            stripe_connect_charges_enabled,
-            stripe_connect_payouts_enabled,
-            stripe_connect_details_submitted,
-            stripe_connect_last_status_sync,
-            stripe_connect_onboarded_at
-        FROM users
-        WHERE id = %s
-        """,
-        (user_id,),
-    )
-    row = cursor.fetchone()
-    cursor.close()
-    conn.close()
 
+def build_user_payment_setup_state(row):
     if not row:
-        return default_state
+        return dict(_DEFAULT_PAYMENT_SETUP_STATE)
 
     (
         stripe_connect_account_id,
@@ -3941,6 +6204,17 @@ def get_user_payment_setup(user_id: int):
     }
 
 
+def get_user_payment_setup(user_id: int):
+    if not user_id:
+        return dict(_DEFAULT_PAYMENT_SETUP_STATE)
+
+    identity = get_request_identity(user_id)
+    if not identity:
+        return dict(_DEFAULT_PAYMENT_SETUP_STATE)
+
+    return dict(identity["payment_setup"])
+
+
 def update_user_payment_setup_from_account(user_id: int, account):
     if not user_id or not account:
         return
@@ -3978,6 +6252,8 @@ def update_user_payment_setup_from_account(user_id: int, account):
     cursor.close()
     conn.close()
 
+    invalidate_request_identity(user_id)
+
 
 def get_or_create_stripe_connect_account(user_id: int, email: str = ""):
     payment_setup = get_user_payment_setup(user_id)
@@ -4892,153 +7168,689 @@ def get_apns_auth_token():
         _APNS_JWT_CACHE["token"] = token
         _APNS_JWT_CACHE["created_at"] = now_ts
 
-        return token
+        return token
+
+    except Exception as e:
+        logger.exception("Failed creating APNs auth token: %s", e)
+        return None
+
+
+# APNs reasons meaning the token will never be deliverable again.
+APNS_DEAD_TOKEN_REASONS = {"BadDeviceToken", "Unregistered", "DeviceTokenNotForTopic"}
+
+_APNS_CLIENTS = {}
+_APNS_CLIENT_LOCK = threading.Lock()
+_APNS_PUSH_POOL = {"executor": None, "pid": None}
+
+
+def get_apns_origin():
+    if APNS_BASE_URL:
+        return APNS_BASE_URL
+    return "https://api.sandbox.push.apple.com" if APNS_USE_SANDBOX else "https://api.push.apple.com"
+
+
+def get_apns_client(origin: str):
+    """
+    One long-lived HTTP/2 client per APNs origin and process. httpx is
+    thread-safe and multiplexes concurrent pushes as streams on the same
+    connection; an http:// origin (the local stand-in) uses h2c prior knowledge.
+    """
+    pid = os.getpid()
+    with _APNS_CLIENT_LOCK:
+        entry = _APNS_CLIENTS.get(origin)
+        if entry and entry[0] == pid:
+            return entry[1]
+
+        client = httpx.Client(
+            http1=False,
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=3600.0),
+        )
+        _APNS_CLIENTS[origin] = (pid, client)
+        return client
+
+
+def _get_apns_push_executor():
+    pid = os.getpid()
+    with _APNS_CLIENT_LOCK:
+        if _APNS_PUSH_POOL["executor"] is None or _APNS_PUSH_POOL["pid"] != pid:
+            _APNS_PUSH_POOL["executor"] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(APNS_MAX_CONCURRENT_PUSHES, 1),
+                thread_name_prefix="apns",
+            )
+            _APNS_PUSH_POOL["pid"] = pid
+        return _APNS_PUSH_POOL["executor"]
+
+
+def post_to_apns(origin: str, path: str, headers: dict, payload: dict):
+    # After a GOAWAY (or a connection APNs already closed) httpx raises for
+    # the streams APNs never processed and drops that connection from its
+    # pool, so the retry goes out on a fresh connection.
+    for attempt in (1, 2, 3):
+        try:
+            return get_apns_client(origin).post(f"{origin}{path}", headers=headers, json=payload)
+        except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.WriteError) as e:
+            if attempt == 3:
+                raise
+            logger.info("[APNs] Reconnecting to %s: %s", origin, e)
+
+
+def deliver_apns_push(device_token, title, body="", link_url="", notification_type=""):
+    """Returns (outcome, reason): outcome is "sent", "failed" or "dead"."""
+    token = get_apns_auth_token()
+    if not token:
+        return "failed", "not_configured"
+
+    clean_device_token = (device_token or "").strip().replace(" ", "")
+    if not clean_device_token:
+        return "failed", "empty_token"
+
+    payload = {
+        "aps": {
+            "alert": {
+                "title": title or APP_NAME,
+                "body": body or "",
+            },
+            "sound": "default",
+        },
+        "link_url": link_url or "/notifications",
+        "notification_type": notification_type or "",
+    }
+
+    headers = {
+        "authorization": f"bearer {token}",
+        "apns-topic": APNS_BUNDLE_ID,
+        "apns-push-type": "alert",
+        "apns-priority": "10",
+    }
+
+    try:
+        response = post_to_apns(get_apns_origin(), f"/3/device/{clean_device_token}", headers, payload)
+    except Exception as e:
+        logger.exception("APNs push request failed: %s", e)
+        return "failed", "request_error"
+
+    if 200 <= response.status_code < 300:
+        logger.info(
+            "[APNsPushSuccess] token_suffix=%s title=%s link_url=%s",
+            clean_device_token[-8:],
+            title,
+            link_url,
+        )
+        return "sent", None
+
+    try:
+        reason = (response.json() or {}).get("reason") or ""
+    except ValueError:
+        reason = ""
+
+    logger.warning(
+        "[APNsPushFailed] status=%s response=%s token_suffix=%s",
+        response.status_code,
+        response.text,
+        clean_device_token[-8:],
+    )
+
+    if response.status_code == 410 or reason in APNS_DEAD_TOKEN_REASONS:
+        return "dead", reason or "Unregistered"
+    return "failed", reason or str(response.status_code)
+
+
+def deactivate_device_tokens(platform: str, dead_tokens: dict):
+    """
+    dead_tokens maps device_token -> APNs reason. Tokens are compared the way
+    deliver_apns_push cleans them, since stored tokens may still carry the
+    spaces or padding they were registered with.
+    """
+    dead_tokens = {
+        (device_token or "").strip().replace(" ", ""): reason
+        for device_token, reason in dead_tokens.items()
+    }
+    dead_tokens.pop("", None)
+    if not dead_tokens:
+        return 0
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE user_device_tokens t
+            SET is_active = FALSE,
+                deactivated_at = %s,
+                deactivated_reason = dead.reason
+            FROM unnest(%s::text[], %s::text[]) AS dead(device_token, reason)
+            WHERE t.platform = %s
+              AND REPLACE(BTRIM(t.device_token, E' \\t\\r\\n'), ' ', '') = dead.device_token
+              AND t.is_active = TRUE
+            """,
+            (now_local(), list(dead_tokens.keys()), list(dead_tokens.values()), platform),
+        )
+        deactivated = cur.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning("Failed to deactivate %s device tokens: %s", platform, e)
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+    logger.info("[APNs] Deactivated %s dead device token(s)", deactivated)
+    return deactivated
+
+
+def send_apns_pushes(device_tokens, title, body="", link_url="", notification_type=""):
+    """
+    Push to several devices concurrently over the shared connection and
+    deactivate tokens APNs reports as gone. Returns {device_token: sent}.
+    """
+    device_tokens = [t for t in dict.fromkeys(device_tokens) if t]
+    if not device_tokens:
+        return {}
+
+    def push(device_token):
+        return deliver_apns_push(device_token, title, body, link_url, notification_type)
+
+    if len(device_tokens) == 1:
+        outcomes = [push(device_tokens[0])]
+    else:
+        outcomes = list(_get_apns_push_executor().map(push, device_tokens))
+
+    dead_tokens = {
+        device_token.strip().replace(" ", ""): reason
+        for device_token, (outcome, reason) in zip(device_tokens, outcomes)
+        if outcome == "dead"
+    }
+    deactivate_device_tokens("ios", dead_tokens)
+
+    return {
+        device_token: outcome == "sent"
+        for device_token, (outcome, _reason) in zip(device_tokens, outcomes)
+    }
+
+
+def send_apns_push_to_token(device_token, title, body="", link_url="", notification_type=""):
+    results = send_apns_pushes([device_token], title, body, link_url, notification_type)
+    return any(results.values())
+
+
+def send_push_notification(user_id, title, body="", link_url="", notification_type=""):
+    tokens = get_active_device_tokens_for_user(user_id)
+
+    if not tokens:
+        logger.info("[PushNotificationSkipped] user_id=%s no active device tokens", user_id)
+        return False
+
+    ios_tokens = []
+
+    for token_row in tokens:
+        platform = (token_row.get("platform") or "").strip().lower()
+        device_token = token_row.get("device_token") or ""
+
+        if platform == "ios":
+            ios_tokens.append(device_token)
+        else:
+            logger.info(
+                "[PushNotificationSkipped] unsupported platform=%s user_id=%s",
+                platform,
+                user_id,
+            )
+
+    results = send_apns_pushes(
+        ios_tokens,
+        title=title,
+        body=body or "",
+        link_url=link_url or "/notifications",
+        notification_type=notification_type or "",
+    )
+    return any(results.values())
+
+
+class FakeApnsHandler(socketserver.BaseRequestHandler):
+    """
+    Speaks cleartext HTTP/2 (prior knowledge) like APNs: tokens containing
+    "bad" get 400 BadDeviceToken, tokens containing "gone" get 410 Unregistered.
+    """
+
+    goaway_every = 0
+
+    def handle(self):
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        conn.initiate_connection()
+        self.request.sendall(conn.data_to_send())
+
+        request_headers = {}
+        served = 0
+        # Once GOAWAY is sent, streams up to this id are still answered and
+        # anything newer is ignored, as APNs does when it drains a connection.
+        last_stream_id = None
+
+        while True:
+            data = self.request.recv(65535)
+            if not data:
+                return
+
+            for event in conn.receive_data(data):
+                stream_id = getattr(event, "stream_id", None)
+                if last_stream_id is not None and stream_id and stream_id > last_stream_id:
+                    continue
+                if isinstance(event, h2.events.RequestReceived):
+                    request_headers[stream_id] = dict(event.headers)
+                elif isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    self._respond(conn, stream_id, request_headers.pop(stream_id, {}))
+                    served += 1
+                    if last_stream_id is None and self.goaway_every and served % self.goaway_every == 0:
+                        last_stream_id = max([stream_id, *request_headers])
+                        conn.close_connection(last_stream_id=last_stream_id)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+
+            outbound = conn.data_to_send()
+            if outbound:
+                self.request.sendall(outbound)
+            if last_stream_id is not None and not request_headers:
+                return
+
+    def _respond(self, conn, stream_id: int, headers: dict):
+        device_token = (headers.get(":path") or "").rsplit("/", 1)[-1]
+
+        if not (headers.get("authorization") or "").startswith("bearer "):
+            status, body = 403, {"reason": "MissingProviderToken"}
+        elif "bad" in device_token:
+            status, body = 400, {"reason": "BadDeviceToken"}
+        elif "gone" in device_token:
+            status, body = 410, {"reason": "Unregistered", "timestamp": int(time.time() * 1000)}
+        else:
+            status, body = 200, None
+
+        apns_id = str(uuid.uuid4())
+        click.echo(f"[fake-apns] {apns_id} status={status} token_suffix={device_token[-8:]}")
+
+        response_headers = [(":status", str(status)), ("apns-id", apns_id)]
+        if body is None:
+            conn.send_headers(stream_id, response_headers, end_stream=True)
+            return
+
+        data = json.dumps(body).encode("utf-8")
+        response_headers += [("content-type", "application/json"), ("content-length", str(len(data)))]
+        conn.send_headers(stream_id, response_headers)
+        conn.send_data(stream_id, data, end_stream=True)
+
+
+@app.cli.command("fake-apns-server")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8443, show_default=True, type=int)
+@click.option("--goaway-every", default=0, show_default=True, type=int, help="Send GOAWAY after every N responses on a connection (0 disables).")
+def fake_apns_server_command(host, port, goaway_every):
+    """Local stand-in for APNs; set APNS_BASE_URL=http://HOST:PORT."""
+    FakeApnsHandler.goaway_every = max(goaway_every, 0)
+    server = socketserver.ThreadingTCPServer((host, port), FakeApnsHandler)
+    server.daemon_threads = True
+    click.echo(f"Fake APNs listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# -------------------------
+# NOTIFICATION VERSION
+# -------------------------
+# notification_versions.version changes in the same transaction as any write
+# that changes what /api/notifications/summary returns for a user: new or
+# read notifications, and unread message counters. Pollers send it back as
+# If-None-Match and get a 304 until it moves.
+_NOTIFICATION_SUMMARY_CACHE = OrderedDict()
+_NOTIFICATION_SUMMARY_CACHE_LOCK = threading.Lock()
+
+
+def bump_notification_version(cursor, user_id):
+    if not user_id:
+        return
+    cursor.execute(
+        """
+        INSERT INTO notification_versions (user_id, version, updated_at)
+        VALUES (%s, 1, %s)
+        ON CONFLICT (user_id)
+        DO UPDATE SET version = notification_versions.version + 1,
+                      updated_at = EXCLUDED.updated_at
+        """,
+        (user_id, now_local()),
+    )
+
+
+def get_notification_version(user_id) -> int:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT version FROM notification_versions WHERE user_id = %s",
+            (user_id,),
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+
+    return int(row[0]) if row else 0
 
-    except Exception as e:
-        logger.exception("Failed creating APNs auth token: %s", e)
-        return None
 
+def _get_cached_notification_summary(user_id, version):
+    now_ts = time.monotonic()
+    with _NOTIFICATION_SUMMARY_CACHE_LOCK:
+        entry = _NOTIFICATION_SUMMARY_CACHE.get(user_id)
+        if entry is None:
+            return None
+        cached_version, expires_at, summary = entry
+        if cached_version != version or expires_at <= now_ts:
+            del _NOTIFICATION_SUMMARY_CACHE[user_id]
+            return None
+        _NOTIFICATION_SUMMARY_CACHE.move_to_end(user_id)
+        return summary
 
-def send_apns_push_to_token(device_token, title, body="", link_url="", notification_type=""):
-    token = get_apns_auth_token()
-    if not token:
-        return False
 
-    clean_device_token = (device_token or "").strip().replace(" ", "")
-    if not clean_device_token:
-        return False
+def _store_cached_notification_summary(user_id, version, summary):
+    if NOTIFICATION_SUMMARY_CACHE_TTL_SECONDS <= 0:
+        return
+    expires_at = time.monotonic() + NOTIFICATION_SUMMARY_CACHE_TTL_SECONDS
+    with _NOTIFICATION_SUMMARY_CACHE_LOCK:
+        _NOTIFICATION_SUMMARY_CACHE[user_id] = (version, expires_at, summary)
+        _NOTIFICATION_SUMMARY_CACHE.move_to_end(user_id)
+        while len(_NOTIFICATION_SUMMARY_CACHE) > NOTIFICATION_SUMMARY_CACHE_MAX_ENTRIES:
+            _NOTIFICATION_SUMMARY_CACHE.popitem(last=False)
+
+
+# Preference columns insert_notification() can check in SQL; mirrors
+# notification_category_enabled().
+NOTIFICATION_CATEGORY_COLUMNS = {
+    "business_request_alerts",
+    "client_request_updates",
+    "invoice_alerts",
+    "payment_alerts",
+}
 
-    apns_host = "api.sandbox.push.apple.com" if APNS_USE_SANDBOX else "api.push.apple.com"
-    apns_url = f"https://{apns_host}/3/device/{clean_device_token}"
 
-    payload = {
-        "aps": {
-            "alert": {
-                "title": title or APP_NAME,
-                "body": body or "",
-            },
-            "sound": "default",
-        },
-        "link_url": link_url or "/notifications",
-        "notification_type": notification_type or "",
-    }
+def insert_notification(cursor, user_id, notification_type, title, body="", link_url="", category=None):
+    """
+    Insert a notification on the caller's cursor and queue its push. With a
+    category, the user's notification_preferences are checked in the same
+    statement. Returns the new id, or None when the preferences suppress it
+    or there is no user (e.g. a payment on an owner-less invoice).
+    """
+    if not user_id:
+        return None
 
-    headers = {
-        "authorization": f"bearer {token}",
-        "apns-topic": APNS_BUNDLE_ID,
-        "apns-push-type": "alert",
-        "apns-priority": "10",
-    }
+    category_column = category if category in NOTIFICATION_CATEGORY_COLUMNS else None
+    category_check = f"OR p.{category_column} = FALSE" if category_column else ""
 
-    try:
-        with httpx.Client(http2=True, timeout=10.0) as client:
-            response = client.post(apns_url, headers=headers, json=payload)
+    cursor.execute(
+        f"""
+        INSERT INTO notifications (
+            user_id,
+            notification_type,
+            title,
+            body,
+            link_url,
+            is_read,
+            created_at,
+            push_status
+        )
+        SELECT %s, %s, %s, %s, %s, FALSE, %s, 'pending'
+        WHERE %s OR NOT EXISTS (
+            SELECT 1
+            FROM notification_preferences p
+            WHERE p.user_id = %s
+              AND (p.notifications_enabled = FALSE OR p.in_app_enabled = FALSE {category_check})
+        )
+        RETURNING id
+        """,
+        (
+            user_id,
+            notification_type,
+            title,
+            body or "",
+            link_url or "",
+            now_local(),
+            category is None,
+            user_id,
+        ),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
 
-        if 200 <= response.status_code < 300:
-            logger.info(
-                "[APNsPushSuccess] token_suffix=%s title=%s link_url=%s",
-                clean_device_token[-8:],
-                title,
-                link_url,
-            )
-            return True
+    bump_notification_version(cursor, user_id)
 
-        logger.warning(
-            "[APNsPushFailed] status=%s response=%s token_suffix=%s",
-            response.status_code,
-            response.text,
-            clean_device_token[-8:],
-        )
-        return False
+    # Delivered to the push worker only if this transaction commits.
+    cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFICATION_PUSH_CHANNEL, str(user_id)))
+    return row[0]
 
-    except Exception as e:
-        logger.exception("APNs push request failed: %s", e)
-        return False
 
+def create_notification(user_id, notification_type, title, body="", link_url=""):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        notification_id = insert_notification(cur, user_id, notification_type, title, body, link_url)
+        conn.commit()
 
-def send_push_notification(user_id, title, body="", link_url="", notification_type=""):
-    tokens = get_active_device_tokens_for_user(user_id)
+    except Exception as e:
+        conn.rollback()
+        logger.exception("Failed creating notification for user %s: %s", user_id, e)
+        return None
+    finally:
+        cur.close()
+        conn.close()
 
-    if not tokens:
-        logger.info("[PushNotificationSkipped] user_id=%s no active device tokens", user_id)
-        return False
+    return notification_id
 
-    sent_any = False
 
-    for token_row in tokens:
-        platform = (token_row.get("platform") or "").strip().lower()
-        device_token = token_row.get("device_token") or ""
+# -------------------------
+# NOTIFICATION PUSH QUEUE
+# -------------------------
+# create_notification only marks the row push_status='pending' and NOTIFYs
+# the worker; APNs I/O happens in `flask notification-push-worker`.
+
+# Plural labels used when several notifications of one type are coalesced.
+NOTIFICATION_PUSH_GROUP_LABELS = {
+    "new_message": "new messages",
+    "request_message": "new messages",
+    "invoice_viewed": "invoice views",
+    "partial_payment_received": "payments received",
+    "final_payment_received": "payments received",
+    "business_followed": "new followers",
+    "service_request_created": "new service requests",
+}
 
-        if platform == "ios":
-            sent = send_apns_push_to_token(
-                device_token=device_token,
-                title=title,
-                body=body or "",
-                link_url=link_url or "/notifications",
-                notification_type=notification_type or "",
-            )
-            sent_any = sent_any or sent
-        else:
-            logger.info(
-                "[PushNotificationSkipped] unsupported platform=%s user_id=%s",
-                platform,
-                user_id,
-            )
 
-    return sent_any
+def claim_pending_notification_pushes(max_users: int, coalesce_seconds: float):
+    """
+    Claim every pending push for up to `max_users` users whose oldest pending
+    notification is past the coalesce window. Returns {user_id: [rows]}.
 
+    Rows are marked sent when claimed, so a push is attempted at most once;
+    that matches the old inline hook, which logged failures and moved on.
+    """
+    now_dt = now_local()
+    due_before = now_dt - timedelta(seconds=max(coalesce_seconds, 0))
 
-def create_notification(user_id, notification_type, title, body="", link_url=""):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute(
             """
-            INSERT INTO notifications (
-                user_id,
-                notification_type,
-                title,
-                body,
-                link_url,
-                is_read,
-                created_at
+            UPDATE notifications n
+            SET push_status = 'sent',
+                push_sent_at = %s
+            WHERE n.id IN (
+                SELECT id
+                FROM notifications
+                WHERE push_status = 'pending'
+                  AND user_id IN (
+                      SELECT user_id
+                      FROM notifications
+                      WHERE push_status = 'pending'
+                      GROUP BY user_id
+                      HAVING MIN(created_at) <= %s
+                      ORDER BY MIN(created_at)
+                      LIMIT %s
+                  )
+                FOR UPDATE SKIP LOCKED
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
+            RETURNING n.id, n.user_id, n.notification_type, n.title, n.body, n.link_url
             """,
-            (
-                user_id,
-                notification_type,
-                title,
-                body or "",
-                link_url or "",
-                False,
-                now_local(),
-            ),
+            (now_dt, due_before, max_users),
         )
-        notification_id = cur.fetchone()[0]
+        rows = cur.fetchall()
         conn.commit()
-
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        logger.exception("Failed creating notification for user %s: %s", user_id, e)
-        return None
+        raise
     finally:
         cur.close()
         conn.close()
 
+    columns = ("id", "user_id", "notification_type", "title", "body", "link_url")
+    by_user = {}
+    for row in sorted(rows, key=lambda r: r[0]):
+        item = dict(zip(columns, row))
+        by_user.setdefault(item["user_id"], []).append(item)
+    return by_user
+
+
+def get_next_notification_push_delay(coalesce_seconds: float):
+    """Seconds until the oldest pending push leaves its coalesce window, or None."""
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        send_push_notification(
-            user_id=user_id,
-            title=title,
-            body=body or "",
-            link_url=link_url or "",
-            notification_type=notification_type,
-        )
-    except Exception as e:
-        logger.exception("Push notification hook failed for user %s: %s", user_id, e)
+        cur.execute("SELECT MIN(created_at) FROM notifications WHERE push_status = 'pending'")
+        oldest_pending = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
 
-    return notification_id
+    if oldest_pending is None:
+        return None
+    due_at = oldest_pending + timedelta(seconds=max(coalesce_seconds, 0))
+    return max((due_at - now_local()).total_seconds(), 0)
+
+
+def build_coalesced_push(rows):
+    """Collapse one user's pending notifications (oldest first) into one push."""
+    latest = rows[-1]
+    if len(rows) == 1:
+        return {
+            "title": latest["title"],
+            "body": latest["body"] or "",
+            "link_url": latest["link_url"] or "/notifications",
+            "notification_type": latest["notification_type"],
+        }
+
+    types = {row["notification_type"] for row in rows}
+    links = {row["link_url"] or "" for row in rows}
+
+    if len(types) == 1:
+        label = NOTIFICATION_PUSH_GROUP_LABELS.get(latest["notification_type"], "new notifications")
+        notification_type = latest["notification_type"]
+    else:
+        label = "new notifications"
+        notification_type = "coalesced"
+
+    return {
+        "title": f"{len(rows)} {label}",
+        "body": latest["title"],
+        "link_url": links.pop() if len(links) == 1 and latest["link_url"] else "/notifications",
+        "notification_type": notification_type,
+    }
+
+
+def process_notification_push_batch(max_users: int = None, coalesce_seconds: float = None):
+    """Deliver one batch of coalesced pushes. Returns (users, notifications)."""
+    if coalesce_seconds is None:
+        coalesce_seconds = NOTIFICATION_PUSH_COALESCE_SECONDS
+
+    by_user = claim_pending_notification_pushes(max_users or NOTIFICATION_PUSH_BATCH_USERS, coalesce_seconds)
+
+    for user_id, rows in by_user.items():
+        push = build_coalesced_push(rows)
+        try:
+            send_push_notification(user_id=user_id, **push)
+        except Exception as e:
+            logger.exception("[NotificationPush] Push failed for user %s: %s", user_id, e)
+
+    return len(by_user), sum(len(rows) for rows in by_user.values())
+
+
+def open_notification_listener(channel: str):
+    """A dedicated autocommit connection LISTENing on `channel` (kept out of the pool)."""
+    conn = psycopg2.connect(**build_db_connect_kwargs())
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {channel};")
+    cur.close()
+    return conn
+
+
+def wait_for_notify(listener, timeout: float):
+    """Block until a NOTIFY arrives on the listener or `timeout` passes. Returns True if woken."""
+    if select.select([listener], [], [], max(timeout, 0)) == ([], [], []):
+        return False
+    listener.poll()
+    woken = bool(listener.notifies)
+    listener.notifies.clear()
+    return woken
+
+
+@app.cli.command("notification-push-worker")
+@click.option("--once", is_flag=True, help="Deliver what is pending now (ignoring the coalesce window), then exit.")
+@click.option("--batch-users", default=NOTIFICATION_PUSH_BATCH_USERS, show_default=True, type=int)
+@click.option("--coalesce-seconds", default=NOTIFICATION_PUSH_COALESCE_SECONDS, show_default=True, type=float)
+@click.option("--poll-interval", default=NOTIFICATION_PUSH_POLL_SECONDS, show_default=True, type=float)
+def notification_push_worker_command(once, batch_users, coalesce_seconds, poll_interval):
+    """Fan queued notifications out to APNs, coalescing bursts per user."""
+    if once:
+        while process_notification_push_batch(batch_users, 0)[0]:
+            pass
+        return
+
+    listener = None
+    while True:
+        try:
+            if listener is None or listener.closed:
+                listener = open_notification_listener(NOTIFICATION_PUSH_CHANNEL)
+
+            users, notifications = process_notification_push_batch(batch_users, coalesce_seconds)
+            if users:
+                logger.info("[NotificationPush] users=%s notifications=%s", users, notifications)
+                continue
+
+            # Sleep until the oldest pending push is due, rather than a fixed
+            # coalesce window after the NOTIFY, so a row just short of the
+            # cutoff is not left for the next poll. A NOTIFY wakes us early
+            # to recompute; polling covers NOTIFYs missed while reconnecting.
+            # The 0.1s floor keeps us from spinning on rows another worker
+            # has locked.
+            delay = get_next_notification_push_delay(coalesce_seconds)
+            if delay is None:
+                delay = poll_interval
+            wait_for_notify(listener, min(max(delay, 0.1), poll_interval))
+        except Exception:
+            logger.exception("[NotificationPush] Worker loop failed")
+            if listener is not None:
+                try:
+                    listener.close()
+                except Exception:
+                    pass
+            listener = None
+            time.sleep(1)
 
 
 def get_notifications_for_user(user_id, unread_only=False, limit=25):
@@ -5120,8 +7932,11 @@ def mark_notification_read(notification_id, user_id):
             """,
             (notification_id, user_id),
         )
+        updated = cur.rowcount > 0
+        if updated:
+            bump_notification_version(cur, user_id)
         conn.commit()
-        return cur.rowcount > 0
+        return updated
     except Exception as e:
         conn.rollback()
         logger.exception("Failed marking notification %s read for user %s: %s", notification_id, user_id, e)
@@ -5143,8 +7958,11 @@ def mark_all_notifications_read(user_id):
             """,
             (user_id,),
         )
+        updated = int(cur.rowcount or 0)
+        if updated:
+            bump_notification_version(cur, user_id)
         conn.commit()
-        return int(cur.rowcount or 0)
+        return updated
     except Exception as e:
         conn.rollback()
         logger.exception("Failed marking all notifications read for user %s: %s", user_id, e)
@@ -5337,7 +8155,9 @@ def register_user_device_token(user_id, platform, device_token, device_name="",
                 device_name = EXCLUDED.device_name,
                 app_version = EXCLUDED.app_version,
                 is_active = TRUE,
-                last_seen_at = EXCLUDED.last_seen_at
+                last_seen_at = EXCLUDED.last_seen_at,
+                deactivated_at = NULL,
+                deactivated_reason = NULL
             """,
             (
                 user_id,
@@ -5916,8 +8736,9 @@ def upsert_business_profile(data: dict):
             INSERT INTO business_profile
                 (business_name, email, phone, website, address,
                  logo_url, brand_color, accent_color, default_terms, default_notes,
-                 updated_at, user_id)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                 updated_at, user_id, follower_count)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,
+                    (SELECT COUNT(*) FROM business_followers WHERE business_user_id = %s))
             """,
             (
                 data.get("business_name"),
@@ -5932,6 +8753,7 @@ def upsert_business_profile(data: dict):
                 data.get("default_notes"),
                 now,
                 user_id,
+                user_id,
             ),
         )
 
@@ -5939,11 +8761,16 @@ def upsert_business_profile(data: dict):
     cursor.close()
     conn.close()
 
+    clear_business_search_cache()
+
 
 # -------------------------
 # INITIALIZE DB ON STARTUP
 # -------------------------
-init_db()
+# Skipped when multiprocessing re-imports `python app.py` as __mp_main__ in
+# a child process (render pool); the parent already ran it.
+if __name__ != "__mp_main__":
+    init_db()
 
 
 # -------------------------
@@ -6003,29 +8830,6 @@ def inject_now():
     return {"now": now_local}
 
 
-@app.context_processor
-def inject_business_profile_ctx():
-    try:
-        profile = get_business_profile()
-
-        if not profile:
-            return {"business_profile": {}}
-
-        # Ensure all keys exist (prevents template crashes / missing logo)
-        safe_profile = {
-            "business_name": profile.get("business_name"),
-            "logo_url": profile.get("logo_url"),
-            "brand_color": profile.get("brand_color"),
-            "accent_color": profile.get("accent_color"),
-        }
-
-        return {"business_profile": safe_profile}
-
-    except Exception as e:
-        logger.warning("Business profile context failed: %s", e)
-        return {"business_profile": {}}
-
-
 def get_business_profile_safe():
     profile = get_business_profile()
     if profile:
@@ -6095,50 +8899,232 @@ def inject_current_user_ctx():
     }
 
 
-@app.context_processor
-def inject_service_request_dashboard_ctx():
-    user = get_current_user()
-    user_id = user.get("id")
+# -------------------------
+# LAYOUT CONTEXT
+# -------------------------
+# Every template extends base.html, which needs the nav badges, the branding
+# and (on the dashboard) the service-request summary. These used to come from
+# four context processors with their own connections; now they come from one
+# round-trip that only runs the first time a template touches one of them.
+_NOTIFICATION_LAYOUT_FIELDS = (
+    "id",
+    "notification_type",
+    "title",
+    "body",
+    "link_url",
+    "is_read",
+    "created_at",
+)
+
+_SERVICE_REQUEST_TIMESTAMP_POSITIONS = range(23, 30)
+
+
+def _parse_json_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _empty_service_request_counts():
+    return {
+        "all": 0,
+        "requested": 0,
+        "approved": 0,
+        "in_progress": 0,
+        "completed": 0,
+        "cancelled": 0,
+    }
+
+
+def _default_layout_context():
+    return {
+        "unread_message_count": 0,
+        "unread_notification_count": 0,
+        "recent_notifications": [],
+        "service_request_counts": _empty_service_request_counts(),
+        "recent_service_requests": [],
+        "has_service_requests": False,
+        "business_profile": {
+            "business_name": DEFAULT_BUSINESS_NAME,
+            "logo_url": "",
+            "brand_color": DEFAULT_BRAND_COLOR,
+            "accent_color": DEFAULT_ACCENT_COLOR,
+        },
+    }
+
+
+def load_layout_context(user_id: int):
+    layout = _default_layout_context()
+    if not user_id:
+        return layout
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            WITH
+            unread_messages AS (
+                SELECT COALESCE(SUM(unread_count), 0) AS total
+                FROM conversation_participants
+                WHERE user_id = %(uid)s
+            ),
+            unread_notifications AS (
+                SELECT COUNT(*) AS total
+                FROM notifications
+                WHERE user_id = %(uid)s AND is_read = FALSE
+            ),
+            recent_notifications AS (
+                SELECT id, notification_type, title, body, link_url, is_read, created_at
+                FROM notifications
+                WHERE user_id = %(uid)s
+                ORDER BY created_at DESC, id DESC
+                LIMIT 5
+            ),
+            request_counts AS (
+                SELECT status, COUNT(*) AS total
+                FROM service_requests
+                WHERE user_id = %(uid)s
+                GROUP BY status
+            ),
+            recent_requests AS (
+                SELECT *
+                FROM service_requests
+                WHERE user_id = %(uid)s
+                ORDER BY created_at DESC, id DESC
+                LIMIT 5
+            ),
+            branding AS (
+                SELECT business_name, logo_url, brand_color, accent_color
+                FROM business_profile
+                WHERE user_id = %(uid)s
+                ORDER BY id ASC
+                LIMIT 1
+            )
+            SELECT
+                (SELECT total FROM unread_messages),
+                (SELECT total FROM unread_notifications),
+                (
+                    SELECT COALESCE(json_agg(json_build_array(
+                        n.id, n.notification_type, n.title, n.body, n.link_url, n.is_read, n.created_at
+                    ) ORDER BY n.created_at DESC, n.id DESC), '[]'::json)
+                    FROM recent_notifications n
+                ),
+                (
+                    SELECT COALESCE(json_agg(json_build_array(rc.status, rc.total)), '[]'::json)
+                    FROM request_counts rc
+                ),
+                (
+                    SELECT COALESCE(json_agg(json_build_array(
+                        r.id, r.user_id, r.client_id, r.service_id, r.invoice_id,
+                        r.status, r.request_type, r.source,
+                        r.service_title_snapshot, r.service_description_snapshot, r.service_price_snapshot,
+                        r.client_name, r.client_email, r.client_phone,
+                        r.request_details, r.preferred_date_text, r.preferred_time_text, r.quantity,
+                        r.intake_answers_json, r.owner_notes, r.client_notes,
+                        r.cancel_requested_by_client, r.cancel_reason,
+                        r.approved_at, r.in_progress_at, r.completed_at, r.cancelled_at,
+                        r.converted_to_invoice_at, r.created_at, r.updated_at
+                    ) ORDER BY r.created_at DESC, r.id DESC), '[]'::json)
+                    FROM recent_requests r
+                ),
+                b.business_name,
+                b.logo_url,
+                b.brand_color,
+                b.accent_color
+            FROM (SELECT 1) AS anchor
+            LEFT JOIN branding b ON TRUE
+            """,
+            {"uid": user_id},
+        )
+        row = cur.fetchone()
+    except Exception as e:
+        logger.warning("Layout context failed: %s", e)
+        return layout
+    finally:
+        cur.close()
+        conn.close()
+
+    (
+        unread_messages,
+        unread_notifications,
+        notification_rows,
+        request_count_rows,
+        request_rows,
+        business_name,
+        logo_url,
+        brand_color,
+        accent_color,
+    ) = row
+
+    notifications = []
+    for values in notification_rows or []:
+        item = dict(zip(_NOTIFICATION_LAYOUT_FIELDS, values))
+        notifications.append(
+            {
+                "id": item["id"],
+                "notification_type": item["notification_type"] or "",
+                "title": item["title"] or "",
+                "body": item["body"] or "",
+                "link_url": item["link_url"] or "",
+                "is_read": bool(item["is_read"]),
+                "created_at": _parse_json_timestamp(item["created_at"]),
+            }
+        )
+
+    counts = _empty_service_request_counts()
+    for status, count in request_count_rows or []:
+        status_key = normalize_request_status(status)
+        counts[status_key] = int(count or 0)
+        counts["all"] += int(count or 0)
 
-    if not user_id:
-        return {
-            "service_request_counts": {
-                "all": 0,
-                "requested": 0,
-                "approved": 0,
-                "in_progress": 0,
-                "completed": 0,
-                "cancelled": 0,
+    recent_requests = []
+    for values in request_rows or []:
+        values = list(values)
+        for position in _SERVICE_REQUEST_TIMESTAMP_POSITIONS:
+            values[position] = _parse_json_timestamp(values[position])
+        recent_requests.append(serialize_service_request_row(values))
+
+    layout.update(
+        {
+            "unread_message_count": int(unread_messages or 0),
+            "unread_notification_count": int(unread_notifications or 0),
+            "recent_notifications": notifications,
+            "service_request_counts": counts,
+            "recent_service_requests": recent_requests,
+            "has_service_requests": counts["all"] > 0,
+            "business_profile": {
+                "business_name": business_name or DEFAULT_BUSINESS_NAME,
+                "logo_url": logo_url or None,
+                "brand_color": brand_color or DEFAULT_BRAND_COLOR,
+                "accent_color": accent_color or DEFAULT_ACCENT_COLOR,
             },
-            "recent_service_requests": [],
-            "has_service_requests": False,
         }
-
-    counts = get_service_request_counts_for_user(user_id)
-    recent_requests = get_recent_service_requests_for_user(user_id, limit=5)
-
-    return {
-        "service_request_counts": counts,
-        "recent_service_requests": recent_requests,
-        "has_service_requests": counts.get("all", 0) > 0,
-    }
+    )
+    return layout
 
 
-@app.context_processor
-def inject_notification_ctx():
+def get_layout_context():
     user = get_current_user()
     user_id = user.get("id")
 
-    if not user_id:
-        return {
-            "unread_notification_count": 0,
-            "recent_notifications": [],
-        }
+    cached = g.get("_layout_context")
+    if cached is None or cached[0] != user_id:
+        cached = (user_id, load_layout_context(user_id))
+        g._layout_context = cached
+    return cached[1]
 
-    return {
-        "unread_notification_count": get_unread_notification_count_for_user(user_id),
-        "recent_notifications": get_notifications_for_user(user_id, unread_only=False, limit=5),
-    }
+
+def _layout_value(key):
+    return get_layout_context()[key]
+
+
+@app.context_processor
+def inject_layout_ctx():
+    return {key: LocalProxy(partial(_layout_value, key)) for key in _default_layout_context()}
 
 
 # -------------------------
@@ -6554,14 +9540,6 @@ def send_request_message(request_id):
                 message_text=message_body,
             )
 
-            # -------------------------
-            # MARK UNREAD FOR CLIENT
-            # -------------------------
-            increment_unread_count(
-                conversation_id,
-                client_user_id
-            )
-
         conn.commit()
 
         # notify client if exists
@@ -6686,17 +9664,28 @@ def api_notifications_summary():
     user = get_current_user()
     user_id = user["id"]
 
-    unread_count = get_unread_notification_count_for_user(user_id)
-    latest_notifications = get_notifications_for_user(user_id, unread_only=False, limit=1)
+    # Idle pollers stop here: one primary-key lookup and a 304. The user id is
+    # part of the tag so a shared browser never revalidates another account.
+    version = get_notification_version(user_id)
+    etag = f"n{user_id}-{version}"
 
-    latest = latest_notifications[0] if latest_notifications else None
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        summary = _get_cached_notification_summary(user_id, version)
+        if summary is None:
+            latest_notifications = get_notifications_for_user(user_id, unread_only=False, limit=1)
+            summary = {
+                "unread_count": get_unread_notification_count_for_user(user_id),
+                "unread_message_count": get_unread_message_count(user_id),
+                "latest": latest_notifications[0] if latest_notifications else None,
+            }
+            _store_cached_notification_summary(user_id, version, summary)
+        response = jsonify(summary)
 
-    return jsonify(
-        {
-            "unread_count": unread_count,
-            "latest": latest,
-        }
-    )
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @app.route("/api/messages/unread-count", methods=["GET"])
@@ -6711,15 +9700,11 @@ def api_unread_messages_count():
     try:
         cur.execute(
             """
-            SELECT COUNT(*)
-            FROM messages m
-            JOIN conversations c ON m.conversation_id = c.id
-            WHERE
-                (c.business_user_id = %s OR c.client_user_id = %s)
-                AND m.sender_user_id != %s
-                AND COALESCE(m.is_read, FALSE) = FALSE
+            SELECT COALESCE(SUM(unread_count), 0)
+            FROM conversation_participants
+            WHERE user_id = %s
             """,
-            (user_id, user_id, user_id),
+            (user_id,),
         )
 
         count = cur.fetchone()[0] or 0
@@ -7005,6 +9990,8 @@ def api_apple_activate_subscription():
         cursor.close()
         conn.close()
 
+        invalidate_request_identity(user_id)
+
         logger.info(
             "[Apple IAP Activate] user_id=%s upgraded to %s product_id=%s transaction_id=%s",
             user_id,
@@ -7215,6 +10202,8 @@ def billing_success():
         cursor.close()
         conn.close()
 
+        invalidate_request_identity(user_id)
+
         logger.info("[BillingSuccess] DB updated rows=%s for user_id=%s", updated, user_id)
 
         if updated == 0:
@@ -8006,9 +10995,10 @@ def save():
             template_style,
             client_id,
             user_id,
-            signature_data
+            signature_data,
+            balance
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         RETURNING id
         """,
         (
@@ -8024,183 +11014,642 @@ def save():
             client_id,
             user_id,
             signature_data,
+            total,
         ),
     )
 
-    invoice_id = cursor.fetchone()[0]
+    invoice_id = cursor.fetchone()[0]
+
+    for desc, amt in cleaned_items:
+        cursor.execute(
+            "INSERT INTO invoice_items (invoice_id, description, amount) VALUES (%s, %s, %s)",
+            (invoice_id, desc, amt),
+        )
+
+    adjust_invoice_rollups(cursor, invoice_id, 1)
+
+    invoice_image_errors = []
+
+    for uploaded_file in uploaded_invoice_files:
+        image_url, image_error = save_uploaded_invoice_image(uploaded_file, user_id, invoice_id)
+        if image_error:
+            invoice_image_errors.append(image_error)
+            continue
+
+        cursor.execute(
+            """
+            INSERT INTO invoice_images (invoice_id, image_url)
+            VALUES (%s, %s)
+            """,
+            (invoice_id, image_url),
+        )
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    prerender_invoice_pdf(invoice_id)
+
+    log_invoice_event(
+        invoice_id=invoice_id,
+        event_type="invoice_created",
+        title="Invoice created",
+        details=f"Invoice {invoice_number} was created for {client_name_for_invoice}.",
+        visibility="both",
+    )
+
+    if service_request_id_raw:
+        try:
+            service_request_id = int(service_request_id_raw)
+            link_service_request_to_invoice(service_request_id, user_id, invoice_id)
+        except ValueError:
+            pass
+
+    return render_template(
+        "saved.html",
+        invoice_id=invoice_id,
+        inv_label=invoice_number,
+        client=client_name_for_invoice,
+        client_name=client_name_for_invoice,
+        amount=total,
+        lang=normalize_lang(request.args.get("lang", "en")),
+    )
+
+
+# -------------------------
+# INVOICES DASHBOARD
+# -------------------------
+@app.route("/uploads/invoice_images/<path:filename>")
+def uploaded_invoice_image(filename):
+    return send_from_directory(INVOICE_IMAGE_UPLOAD_ROOT, filename)
+
+
+# -------------------------
+# SEARCH
+# -------------------------
+# The query text is built in Python and passed as a constant so the planner
+# can use the search_vector statistics to pick between the GIN index (rare
+# terms) and walking the newest invoices (common terms).
+SEARCH_TSQUERY_SQL = "to_tsquery('simple', %s)"
+
+
+SEARCH_RANK_CANDIDATES = 1000
+
+# Lower-cased text that substring search matches against, one line per
+# column. The trigram indexes built by `flask migrate-search-columns` use the
+# same expressions (with an empty alias), so keep them in step.
+INVOICE_SEARCH_TEXT_SQL = (
+    "LOWER(COALESCE({alias}client, '') || E'\\n' || COALESCE({alias}invoice_number, '')"
+    " || E'\\n' || COALESCE({alias}notes, '') || E'\\n' || COALESCE({alias}terms, ''))"
+)
+CLIENT_SEARCH_TEXT_SQL = (
+    "LOWER(COALESCE({alias}name, '') || E'\\n' || COALESCE({alias}email, '')"
+    " || E'\\n' || COALESCE({alias}company, ''))"
+)
+
+
+def build_prefix_tsquery(q: str) -> str:
+    """Free text -> prefix tsquery text: "Acme web" -> 'acme':* & 'web':*"""
+    terms = re.findall(r"\w+", (q or "").lower())
+    return " & ".join(f"'{term}':*" for term in terms[:8])
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_invoice_search_sql(q: str):
+    """
+    Match condition and rank expression (on alias i) for invoice search:
+    substring match over client/number/notes/terms (trigram-indexed when
+    pg_trgm is enabled), invoice-number prefix match, and a full-text prefix
+    match for multi-word queries once the search_vector column exists.
+    """
+    q_lower = q.lower()
+    number_prefix = escape_like(q_lower) + "%"
+
+    conditions = [
+        "LOWER(i.invoice_number) LIKE %s",
+        INVOICE_SEARCH_TEXT_SQL.format(alias="i.") + " LIKE %s",
+    ]
+    params = [number_prefix, "%" + escape_like(q_lower) + "%"]
+
+    rank_sql = """
+        (CASE
+            WHEN LOWER(i.invoice_number) = %s THEN 3
+            WHEN LOWER(i.invoice_number) LIKE %s THEN 2
+            ELSE 0
+        END)
+    """
+    rank_params = [q_lower, number_prefix]
+
+    if _SEARCH_FEATURES["fulltext"]:
+        tsquery = build_prefix_tsquery(q)
+        conditions.append(f"i.search_vector @@ {SEARCH_TSQUERY_SQL}")
+        params.append(tsquery)
+        rank_sql += f" + ts_rank(i.search_vector, {SEARCH_TSQUERY_SQL})"
+        rank_params.append(tsquery)
+
+    return "(" + " OR ".join(conditions) + ")", params, rank_sql, rank_params
+
+
+def build_client_search_sql(q: str):
+    conditions = [CLIENT_SEARCH_TEXT_SQL.format(alias="c.") + " LIKE %s"]
+    params = ["%" + escape_like(q.lower()) + "%"]
+
+    rank_sql = "0::real"
+    rank_params = []
+
+    if _SEARCH_FEATURES["fulltext"]:
+        tsquery = build_prefix_tsquery(q)
+        conditions.append(f"c.search_vector @@ {SEARCH_TSQUERY_SQL}")
+        params.append(tsquery)
+        rank_sql = f"ts_rank(c.search_vector, {SEARCH_TSQUERY_SQL})"
+        rank_params = [tsquery]
+
+    return "(" + " OR ".join(conditions) + ")", params, rank_sql, rank_params
+
+
+def search_invoices_for_user(user_id: int, q: str, limit: int = 50):
+    match_sql, match_params, rank_sql, rank_params = build_invoice_search_sql(q)
+    vector_column = ", search_vector" if _SEARCH_FEATURES["fulltext"] else ""
+
+    # Very common terms can match most of a tenant's invoices; only the newest
+    # SEARCH_RANK_CANDIDATES matches are ranked so the sort stays bounded.
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT id, client, amount, created_at, status, invoice_number
+            FROM (
+                SELECT id, client, amount, created_at, status, invoice_number{vector_column}
+                FROM invoices i
+                WHERE i.user_id = %s
+                  AND {match_sql}
+                ORDER BY i.created_at DESC, i.id DESC
+                LIMIT %s
+            ) i
+            ORDER BY {rank_sql} DESC, i.created_at DESC, i.id DESC
+            LIMIT %s
+            """,
+            tuple([user_id] + match_params + [SEARCH_RANK_CANDIDATES] + rank_params + [limit]),
+        )
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def search_clients_for_user(user_id: int, q: str, limit: int = 50):
+    match_sql, match_params, rank_sql, rank_params = build_client_search_sql(q)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT id, name, email, company, created_at
+            FROM clients c
+            WHERE c.user_id = %s
+              AND {match_sql}
+            ORDER BY {rank_sql} DESC, c.created_at DESC, c.id DESC
+            LIMIT %s
+            """,
+            tuple([user_id] + match_params + rank_params + [limit]),
+        )
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@app.cli.command("migrate-search-columns")
+def migrate_search_columns_command():
+    """
+    One-off migration for indexed search. Adds the generated search_vector
+    columns to invoices and clients (a table rewrite under an ACCESS
+    EXCLUSIVE lock, so run it in a quiet window), then builds the GIN and
+    trigram indexes CONCURRENTLY. Safe to re-run.
+    """
+    conn = psycopg2.connect(**build_db_connect_kwargs())
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    try:
+        statements = [
+            """
+            ALTER TABLE invoices ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', COALESCE(invoice_number, '')), 'A')
+                || setweight(to_tsvector('simple', COALESCE(client, '')), 'A')
+                || setweight(to_tsvector('simple', COALESCE(notes, '')), 'C')
+                || setweight(to_tsvector('simple', COALESCE(terms, '')), 'D')
+            ) STORED
+            """,
+            """
+            ALTER TABLE clients ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', COALESCE(name, '')), 'A')
+                || setweight(to_tsvector('simple', COALESCE(company, '')), 'B')
+                || setweight(to_tsvector('simple', COALESCE(email, '')), 'B')
+            ) STORED
+            """,
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS invoices_search_vector_idx ON invoices USING GIN (search_vector)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS clients_search_vector_idx ON clients USING GIN (search_vector)",
+        ]
+
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cur.fetchone():
+            statements += [
+                f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS invoices_search_text_trgm_idx
+                ON invoices USING GIN (({INVOICE_SEARCH_TEXT_SQL.format(alias="")}) gin_trgm_ops)
+                """,
+                f"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS clients_search_text_trgm_idx
+                ON clients USING GIN (({CLIENT_SEARCH_TEXT_SQL.format(alias="")}) gin_trgm_ops)
+                """,
+                # Superseded by the search-text indexes above.
+                "DROP INDEX CONCURRENTLY IF EXISTS invoices_client_trgm_idx",
+                "DROP INDEX CONCURRENTLY IF EXISTS clients_name_trgm_idx",
+            ]
+        else:
+            click.echo("pg_trgm is not installed; substring search stays unindexed.")
+
+        for statement in statements:
+            started = time.monotonic()
+            cur.execute(statement)
+            click.echo(f"{' '.join(statement.split())[:72]}... {time.monotonic() - started:.1f}s")
+    finally:
+        cur.close()
+        conn.close()
+
+    click.echo("Done. Restart the app so search picks up the search_vector columns.")
+
+
+def parse_invoice_list_filters(args):
+    q = (args.get("q") or "").strip()
+    status_filter = (args.get("status") or "").strip()
+    from_date_str = (args.get("from_date") or "").strip()
+    to_date_str = (args.get("to_date") or "").strip()
+
+    from_dt = None
+    to_dt = None
+
+    if from_date_str:
+        try:
+            from_dt = datetime.strptime(from_date_str, "%Y-%m-%d")
+        except ValueError:
+            from_dt = None
+
+    if to_date_str:
+        try:
+            to_dt = datetime.strptime(to_date_str, "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            to_dt = None
+
+    return {
+        "q": q,
+        "status_filter": status_filter,
+        "from_date_str": from_date_str,
+        "to_date_str": to_date_str,
+        "from_dt": from_dt,
+        "to_dt": to_dt,
+    }
+
+
+def has_invoice_list_filters(filters) -> bool:
+    return bool(filters["q"] or filters["status_filter"] or filters["from_date_str"] or filters["to_date_str"])
+
+
+def build_invoice_filter_sql(user_id: int, filters):
+    """WHERE clause (on alias i) and params for the /invoices search & filter form."""
+    conditions = ["i.user_id = %s"]
+    params = [user_id]
+
+    if filters["q"]:
+        match_sql, match_params, _rank_sql, _rank_params = build_invoice_search_sql(filters["q"])
+        conditions.append(match_sql)
+        params.extend(match_params)
+
+    if filters["status_filter"] in ALLOWED_STATUSES:
+        conditions.append("i.status = %s")
+        params.append(filters["status_filter"])
+
+    if filters["from_dt"]:
+        conditions.append("i.created_at >= %s")
+        params.append(filters["from_dt"])
+    if filters["to_dt"]:
+        conditions.append("i.created_at < %s")
+        params.append(filters["to_dt"])
+
+    return " AND ".join(conditions), params
+
+
+def parse_invoice_page_size(value) -> int:
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return INVOICE_LIST_DEFAULT_PAGE_SIZE
+    return max(1, min(size, INVOICE_LIST_MAX_PAGE_SIZE))
+
+
+def encode_invoice_cursor(created_at, invoice_id) -> str:
+    raw = f"{created_at.isoformat()}|{invoice_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_invoice_cursor(token: str):
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_raw, id_raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_raw), int(id_raw)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_invoice_list_page(user_id: int, filters, cursor_token: str = "", page_size: int = None):
+    """
+    One keyset page of the user's invoices, newest first, ordered by
+    (created_at, id) so it walks invoices_user_created_idx. Returns rows in
+    the list layout invoices.html expects plus the cursor for the next page.
+    """
+    page_size = page_size or INVOICE_LIST_DEFAULT_PAGE_SIZE
+    where_sql, params = build_invoice_filter_sql(user_id, filters)
+
+    after = decode_invoice_cursor(cursor_token)
+    if after:
+        where_sql += " AND (i.created_at, i.id) < (%s, %s)"
+        params.extend(after)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT
+                i.id,
+                i.client,
+                i.amount,
+                i.created_at,
+                i.status,
+                i.invoice_number,
+                i.due_date,
+                COALESCE(i.total_paid, 0) AS total_paid
+            FROM invoices i
+            WHERE {where_sql}
+            ORDER BY i.created_at DESC, i.id DESC
+            LIMIT %s
+            """,
+            tuple(params) + (page_size + 1,),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
 
-    for desc, amt in cleaned_items:
-        cursor.execute(
-            "INSERT INTO invoice_items (invoice_id, description, amount) VALUES (%s, %s, %s)",
-            (invoice_id, desc, amt),
-        )
+    invoices = []
+    for row in rows:
+        row_list = list(row)
+        row_list[2] = float(row_list[2] or 0)
+        row_list[7] = float(row_list[7] or 0)
+        invoices.append(row_list)
 
-    invoice_image_errors = []
+    next_cursor = None
+    if has_more and invoices and invoices[-1][3]:
+        next_cursor = encode_invoice_cursor(invoices[-1][3], invoices[-1][0])
 
-    for uploaded_file in uploaded_invoice_files:
-        image_url, image_error = save_uploaded_invoice_image(uploaded_file, user_id, invoice_id)
-        if image_error:
-            invoice_image_errors.append(image_error)
-            continue
+    return {
+        "invoices": invoices,
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+    }
 
-        cursor.execute(
-            """
-            INSERT INTO invoice_images (invoice_id, image_url)
-            VALUES (%s, %s)
+
+def count_invoices_capped(user_id: int, filters, cap: int = INVOICE_LIST_COUNT_CAP):
+    """
+    Count matching invoices, but stop at `cap` so the cost stays bounded for
+    heavy users. Returns (count, is_capped).
+    """
+    where_sql, params = build_invoice_filter_sql(user_id, filters)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT COUNT(*)
+            FROM (
+                SELECT 1
+                FROM invoices i
+                WHERE {where_sql}
+                LIMIT %s
+            ) capped
             """,
-            (invoice_id, image_url),
+            tuple(params) + (cap + 1,),
         )
+        count = int(cur.fetchone()[0] or 0)
+    finally:
+        cur.close()
+        conn.close()
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    if count > cap:
+        return cap, True
+    return count, False
 
-    log_invoice_event(
-        invoice_id=invoice_id,
-        event_type="invoice_created",
-        title="Invoice created",
-        details=f"Invoice {invoice_number} was created for {client_name_for_invoice}.",
-        visibility="both",
-    )
 
-    if service_request_id_raw:
-        try:
-            service_request_id = int(service_request_id_raw)
-            link_service_request_to_invoice(service_request_id, user_id, invoice_id)
-        except ValueError:
-            pass
+def serialize_invoice_list_row(row):
+    invoice_id, client, amount, created_at, status, invoice_number, due_date, total_paid = row
+    balance = max(float(amount or 0) - float(total_paid or 0), 0.0)
+    return {
+        "id": invoice_id,
+        "client": client or "",
+        "amount": float(amount or 0),
+        "created_at": created_at.isoformat() if created_at else None,
+        "status": status or "Sent",
+        "invoice_number": invoice_number or f"#{invoice_id}",
+        "due_date": due_date.isoformat() if due_date else None,
+        "total_paid": float(total_paid or 0),
+        "balance": balance,
+    }
 
-    return render_template(
-        "saved.html",
-        invoice_id=invoice_id,
-        inv_label=invoice_number,
-        client=client_name_for_invoice,
-        client_name=client_name_for_invoice,
-        amount=total,
-        lang=normalize_lang(request.args.get("lang", "en")),
-    )
+
+@app.route("/api/invoices", methods=["GET"])
+@login_required
+def api_invoices_list():
+    user_id = get_current_user()["id"]
+    filters = parse_invoice_list_filters(request.args)
+    cursor_token = (request.args.get("cursor") or "").strip()
+    page_size = parse_invoice_page_size(request.args.get("page_size"))
+
+    page = get_invoice_list_page(user_id, filters, cursor_token, page_size)
+
+    payload = {
+        "invoices": [serialize_invoice_list_row(row) for row in page["invoices"]],
+        "has_more": page["has_more"],
+        "next_cursor": page["next_cursor"],
+        "page_size": page_size,
+    }
+
+    # The count is only worth paying for once, on the first page.
+    if not cursor_token:
+        total, is_capped = count_invoices_capped(user_id, filters)
+        payload["total_estimate"] = total
+        payload["total_is_capped"] = is_capped
+
+    return jsonify(payload), 200
 
 
 # -------------------------
-# INVOICES DASHBOARD
+# BULK PDF EXPORT
 # -------------------------
-@app.route("/uploads/invoice_images/<path:filename>")
-def uploaded_invoice_image(filename):
-    return send_from_directory(INVOICE_IMAGE_UPLOAD_ROOT, filename)
+# PDFs are rendered a window at a time so memory stays bounded by the window,
+# not by how many invoices the filters select.
+INVOICE_EXPORT_WINDOW_SIZE = max(INVOICE_PDF_RENDER_WORKERS, 1) * 4
 
 
-@app.route("/invoices")
-@login_required
-def invoices_page():
-    update_overdue_statuses()
+class _ZipStreamBuffer:
+    """Write-only sink for zipfile; drain() hands back what was written so far."""
 
-    lang = normalize_lang(request.args.get("lang") or get_current_user().get("language") or "en")
+    def __init__(self):
+        self._chunks = []
 
-    q = (request.args.get("q") or "").strip()
-    status_filter = (request.args.get("status") or "").strip()
-    from_date_str = (request.args.get("from_date") or "").strip()
-    to_date_str = (request.args.get("to_date") or "").strip()
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
 
-    from_dt = None
-    to_dt = None
+    def flush(self):
+        pass
 
-    if from_date_str:
-        try:
-            from_dt = datetime.strptime(from_date_str, "%Y-%m-%d")
-        except ValueError:
-            from_dt = None
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
 
-    if to_date_str:
-        try:
-            to_dt = datetime.strptime(to_date_str, "%Y-%m-%d") + timedelta(days=1)
-        except ValueError:
-            to_dt = None
+
+def get_invoice_export_ids(user_id: int, filters):
+    where_sql, params = build_invoice_filter_sql(user_id, filters)
 
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT i.id
+            FROM invoices i
+            WHERE {where_sql}
+            ORDER BY i.created_at DESC, i.id DESC
+            """,
+            params,
+        )
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
 
-    current_user = get_current_user()
-    user_id = current_user["id"]
 
-    cursor.execute(
-        """
-        SELECT id, client, amount, created_at, status
-        FROM invoices
-        WHERE user_id = %s
-        ORDER BY created_at DESC
-        """,
-        (user_id,),
-    )
-    all_rows = cursor.fetchall()
+def iter_rendered_invoice_pdfs(sources):
+    """Yield (invoice_id, pdf_bytes) for each source, in completion order."""
+    pending = {}
 
-    all_invoices = []
-    for row in all_rows:
-        row_list = list(row)
-        row_list[2] = float(row_list[2])
-        all_invoices.append(row_list)
+    for source in sources:
+        invoice_id = source["invoice_id"]
+        digest = invoice_pdf_cache_key(source)
 
-    total_invoices = len(all_invoices)
-    total_revenue = sum(inv[2] for inv in all_invoices)
+        pdf_bytes = read_cached_invoice_pdf(invoice_id, digest)
+        if pdf_bytes is not None:
+            yield invoice_id, pdf_bytes
+            continue
 
-    now = now_local()
-    current_month = now.month
-    current_year = now.year
+        future = submit_invoice_pdf_render(source, digest)
+        if future is None:
+            yield invoice_id, get_invoice_pdf_from_source(source, digest)
+        else:
+            pending[future] = source
+
+    for future in concurrent.futures.as_completed(pending):
+        source = pending[future]
+        try:
+            pdf_bytes = future.result()
+        except Exception as e:
+            logger.warning("[PDF] Export render failed for invoice_id=%s, retrying inline: %s", source["invoice_id"], e)
+            pdf_bytes = render_invoice_pdf(source)
+        yield source["invoice_id"], pdf_bytes
+
+
+@app.route("/invoices/export.zip", methods=["GET"])
+@login_required
+def export_invoices_zip():
+    user_id = get_current_user()["id"]
+    filters = parse_invoice_list_filters(request.args)
+    invoice_ids = get_invoice_export_ids(user_id, filters)
+    business_name = get_invoice_pdf_business_name()
+
+    def generate():
+        sink = _ZipStreamBuffer()
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for start in range(0, len(invoice_ids), INVOICE_EXPORT_WINDOW_SIZE):
+                window = invoice_ids[start:start + INVOICE_EXPORT_WINDOW_SIZE]
+                sources = load_invoice_pdf_sources(window, business_name)
+
+                for invoice_id, pdf_bytes in iter_rendered_invoice_pdfs(sources.values()):
+                    archive.writestr(f"invoice_{invoice_id}.pdf", pdf_bytes)
+                    yield sink.drain()
+
+        yield sink.drain()
 
-    monthly_revenue = sum(
-        inv[2]
-        for inv in all_invoices
-        if inv[3].month == current_month and inv[3].year == current_year
+    filename = f"invoices_{now_local().strftime('%Y%m%d')}.zip"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
+
+@app.route("/invoices")
+@login_required
+def invoices_page():
+    lang = normalize_lang(request.args.get("lang") or get_current_user().get("language") or "en")
+
+    filters = parse_invoice_list_filters(request.args)
+    q = filters["q"]
+    status_filter = filters["status_filter"]
+    from_date_str = filters["from_date_str"]
+    to_date_str = filters["to_date_str"]
+
+    cursor_token = (request.args.get("cursor") or "").strip()
+    page_size = parse_invoice_page_size(request.args.get("page_size"))
+
+    current_user = get_current_user()
+    user_id = current_user["id"]
+
+    chart_data = get_dashboard_chart_data(user_id)
+
+    total_invoices = chart_data["total_invoices"]
+    total_revenue = chart_data["total_revenue"]
+    monthly_revenue = chart_data["monthly_revenue"]
+
     growth = round((monthly_revenue / total_revenue) * 100, 1) if total_revenue > 0 else 0
     avg_invoice = round(total_revenue / total_invoices, 2) if total_invoices > 0 else 0
 
-    paid_count = sum(1 for inv in all_invoices if inv[4] == "Paid")
-    overdue_count = sum(1 for inv in all_invoices if inv[4] == "Overdue")
+    paid_count = chart_data["status_counts"].get("Paid", 0)
+    overdue_count = chart_data["status_counts"].get("Overdue", 0)
 
     status_distribution = {
         "Paid": paid_count,
-        "Sent": sum(1 for inv in all_invoices if inv[4] == "Sent"),
+        "Sent": chart_data["status_counts"].get("Sent", 0),
         "Overdue": overdue_count,
     }
 
-    cursor.execute(
-        """
-        SELECT date_trunc('month', created_at) AS month, SUM(amount) AS total
-        FROM invoices
-        WHERE user_id = %s
-        GROUP BY month
-        ORDER BY month DESC
-        LIMIT 6
-        """,
-        (user_id,),
-    )
-    monthly_rows = cursor.fetchall()
-
-    monthly_chart_labels = []
-    monthly_chart_totals = []
-    for month_dt, total_amt in reversed(monthly_rows):
-        monthly_chart_labels.append(month_dt.strftime("%b %Y"))
-        monthly_chart_totals.append(float(total_amt))
-
-    cursor.execute(
-        """
-        SELECT DATE(created_at) AS day, SUM(amount) AS total
-        FROM invoices
-        WHERE user_id = %s
-        GROUP BY day
-        ORDER BY day DESC
-        LIMIT 30
-        """,
-        (user_id,),
-    )
-    daily_rows = cursor.fetchall()
-
-    daily_chart_labels = []
-    daily_chart_totals = []
-    for day_dt, total_amt in reversed(daily_rows):
-        daily_chart_labels.append(day_dt.strftime("%b %d"))
-        daily_chart_totals.append(float(total_amt))
+    monthly_chart_labels = chart_data["monthly_chart_labels"]
+    monthly_chart_totals = chart_data["monthly_chart_totals"]
+    daily_chart_labels = chart_data["daily_chart_labels"]
+    daily_chart_totals = chart_data["daily_chart_totals"]
 
     status_chart_labels = ["Paid", "Sent", "Overdue"]
     status_chart_values = [
@@ -8209,126 +11658,18 @@ def invoices_page():
         overdue_count,
     ]
 
-    cursor.execute(
-        """
-        SELECT
-            client,
-            SUM(amount) AS total_billed,
-            COUNT(*) AS invoice_count
-        FROM invoices
-        WHERE user_id = %s
-        GROUP BY client
-        HAVING SUM(amount) > 0
-        ORDER BY total_billed DESC
-        LIMIT 5
-        """,
-        (user_id,),
-    )
-    tc_rows = cursor.fetchall()
-    top_clients = []
-    if tc_rows:
-        top_total = float(tc_rows[0][1]) if tc_rows[0][1] is not None else 0.0
-        for name, total_amt, inv_count in tc_rows:
-            total_float = float(total_amt or 0)
-            pct = round((total_float / top_total) * 100, 1) if top_total > 0 else 0.0
-            top_clients.append([name, total_float, inv_count, pct])
-
-    cursor.execute(
-        """
-        SELECT
-            ii.description,
-            SUM(ii.amount) AS total_billed,
-            COUNT(*) AS line_count
-        FROM invoice_items ii
-        JOIN invoices i ON ii.invoice_id = i.id
-        WHERE i.user_id = %s
-        GROUP BY ii.description
-        HAVING SUM(ii.amount) > 0
-        ORDER BY total_billed DESC
-        LIMIT 7
-        """,
-        (user_id,),
-    )
-    item_rows = cursor.fetchall()
-
-    item_labels = []
-    item_totals = []
-    item_counts = []
-    for desc, total_amt, line_count in item_rows:
-        item_labels.append(desc or "Untitled item")
-        item_totals.append(float(total_amt or 0))
-        item_counts.append(line_count or 0)
-
-    base_sql = """
-        SELECT
-            i.id,
-            i.client,
-            i.amount,
-            i.created_at,
-            i.status,
-            i.invoice_number,
-            i.due_date,
-            COALESCE(SUM(p.amount), 0) AS total_paid
-        FROM invoices i
-        LEFT JOIN payments p ON p.invoice_id = i.id
-        WHERE i.user_id = %s
-    """
-    conditions = []
-    params = [user_id]
-
-    if q:
-        like = f"%{q.lower()}%"
-        conditions.append(
-            """
-            (
-                LOWER(i.client) LIKE %s
-                OR LOWER(COALESCE(i.invoice_number, '')) LIKE %s
-                OR LOWER(COALESCE(i.notes, '')) LIKE %s
-                OR LOWER(COALESCE(i.terms, '')) LIKE %s
-            )
-            """
-        )
-        params.extend([like, like, like, like])
-
-    if status_filter in ALLOWED_STATUSES:
-        conditions.append("i.status = %s")
-        params.append(status_filter)
-
-    if from_dt:
-        conditions.append("i.created_at >= %s")
-        params.append(from_dt)
-    if to_dt:
-        conditions.append("i.created_at < %s")
-        params.append(to_dt)
-
-    filtered_sql = base_sql
-    if conditions:
-        filtered_sql += " AND " + " AND ".join(conditions)
-    filtered_sql += """
-        GROUP BY
-            i.id,
-            i.client,
-            i.amount,
-            i.created_at,
-            i.status,
-            i.invoice_number,
-            i.due_date
-        ORDER BY i.created_at DESC
-    """
-
-    cursor.execute(filtered_sql, tuple(params))
-    filtered_rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    top_clients = chart_data["top_clients"]
+    item_labels = chart_data["item_labels"]
+    item_totals = chart_data["item_totals"]
+    item_counts = chart_data["item_counts"]
 
-    invoices = []
-    for row in filtered_rows:
-        row_list = list(row)
-        row_list[2] = float(row_list[2])
-        row_list[7] = float(row_list[7])
-        invoices.append(row_list)
+    page = get_invoice_list_page(user_id, filters, cursor_token, page_size)
+    invoices = page["invoices"]
 
-    filtered_count = len(invoices)
+    if has_invoice_list_filters(filters):
+        filtered_count, filtered_count_is_capped = count_invoices_capped(user_id, filters)
+    else:
+        filtered_count, filtered_count_is_capped = total_invoices, False
 
     dashboard_metrics = get_dashboard_receivables_metrics(user_id) if can_use_advanced_dashboard(current_user) else None
 
@@ -8348,6 +11689,11 @@ def invoices_page():
         from_date_str=from_date_str,
         to_date_str=to_date_str,
         filtered_count=filtered_count,
+        filtered_count_is_capped=filtered_count_is_capped,
+        page_size=page_size,
+        cursor=cursor_token,
+        next_cursor=page["next_cursor"],
+        has_more_invoices=page["has_more"],
         monthly_chart_labels=monthly_chart_labels,
         monthly_chart_totals=monthly_chart_totals,
         daily_chart_labels=daily_chart_labels,
@@ -8373,51 +11719,12 @@ def global_search():
     user = get_current_user()
     user_id = user["id"]
 
-    client_results = []
-    invoice_results = []
-
-    if q:
-        like = f"%{q.lower()}%"
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT id, name, email, company, created_at
-            FROM clients
-            WHERE user_id = %s
-              AND (
-                    LOWER(name) LIKE %s
-                 OR LOWER(COALESCE(email, '')) LIKE %s
-                 OR LOWER(COALESCE(company, '')) LIKE %s
-              )
-            ORDER BY created_at DESC
-            LIMIT 50
-            """,
-            (user_id, like, like, like),
-        )
-        client_results = cursor.fetchall()
-
-        cursor.execute(
-            """
-            SELECT id, client, amount, created_at, status, invoice_number
-            FROM invoices
-            WHERE user_id = %s
-              AND (
-                    LOWER(client) LIKE %s
-                 OR LOWER(COALESCE(invoice_number, '')) LIKE %s
-                 OR LOWER(COALESCE(notes, '')) LIKE %s
-                 OR LOWER(COALESCE(terms, '')) LIKE %s
-              )
-            ORDER BY created_at DESC
-            LIMIT 50
-            """,
-            (user_id, like, like, like, like),
-        )
-        invoice_results = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
+    client_results = []
+    invoice_results = []
+
+    if q:
+        client_results = search_clients_for_user(user_id, q)
+        invoice_results = search_invoices_for_user(user_id, q)
 
     return render_template(
         "search.html",
@@ -8632,6 +11939,8 @@ def settings():
             feedback_message = "Business profile updated successfully."
             feedback_type = "success"
 
+        invalidate_request_identity(user_id)
+
     # -------------------------
     # AFTER POST HANDLING
     # -------------------------
@@ -8797,67 +12106,44 @@ def add_payment(invoice_id):
             feedback_message = f"Payment exceeds the remaining balance of {format_currency(existing_balance)}."
             feedback_type = "error"
         else:
-            cursor.execute(
-                """
-                INSERT INTO payments (
-                    invoice_id,
-                    amount,
-                    method,
-                    note,
-                    payment_source,
-                    payment_status,
-                    occurred_at,
-                    recorded_by_user_id,
-                    is_deposit,
-                    is_final_payment
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    invoice_id_db,
-                    pay_amount,
-                    method or None,
-                    note or None,
-                    "manual",
-                    "succeeded",
-                    occurred_at,
-                    user_id,
-                    bool(is_deposit),
-                    False,
-                ),
-            )
-
-            cursor.execute(
-                """
-                UPDATE invoices
-                SET last_payment_recorded_at = %s,
-                    last_collection_action_at = %s
-                WHERE id = %s
-                """,
-                (occurred_at, now_local(), invoice_id_db),
-            )
-
-            conn.commit()
-
-            payment_summary = sync_invoice_status(invoice_id_db) or get_invoice_payment_summary(invoice_id_db) or {}
-            total_paid = float(payment_summary.get("total_paid") or 0)
-            balance = float(payment_summary.get("balance") or 0)
-
             method_label = normalize_method_label(method)
             details = f"Recorded payment of {format_currency(pay_amount)} via {method_label}."
             if note:
                 details += f" Note: {note}"
 
-            log_invoice_event(
-                invoice_id=invoice_id_db,
-                event_type="manual_payment_added",
-                title="Payment recorded",
-                details=details,
-                visibility="both",
+            payment_summary = record_invoice_payment(
+                cursor,
+                invoice_id_db,
+                pay_amount,
+                occurred_at=occurred_at,
+                source="manual",
+                method=method or None,
+                note=note or None,
+                recorded_by_user_id=user_id,
+                is_deposit=is_deposit,
             )
+            if payment_summary is None:
+                # Deleted between the lookup above and the payment's row lock.
+                conn.rollback()
+                cursor.close()
+                conn.close()
+                return "Invoice not found", 404
+
+            total_paid = payment_summary["total_paid"]
+            balance = payment_summary["balance"]
+
+            events = payment_summary["events"] + [
+                {
+                    "event_type": "manual_payment_added",
+                    "title": "Payment recorded",
+                    "details": details,
+                    "visibility": "both",
+                }
+            ]
 
             if balance > 0.0001:
-                create_notification_if_enabled(
+                insert_notification(
+                    cursor,
                     user_id=user_id,
                     category="payment_alerts",
                     notification_type="partial_payment_received",
@@ -8865,16 +12151,17 @@ def add_payment(invoice_id):
                     body=f"{format_currency(pay_amount)} was recorded. Remaining balance: {format_currency(balance)}.",
                     link_url=f"/invoices/{invoice_id_db}",
                 )
-
-                log_invoice_event(
-                    invoice_id=invoice_id_db,
-                    event_type="partial_payment_received",
-                    title="Partial payment received",
-                    details=f"Total paid is now {format_currency(total_paid)}. Remaining balance: {format_currency(balance)}.",
-                    visibility="both",
+                events.append(
+                    {
+                        "event_type": "partial_payment_received",
+                        "title": "Partial payment received",
+                        "details": f"Total paid is now {format_currency(total_paid)}. Remaining balance: {format_currency(balance)}.",
+                        "visibility": "both",
+                    }
                 )
             else:
-                create_notification_if_enabled(
+                insert_notification(
+                    cursor,
                     user_id=user_id,
                     category="payment_alerts",
                     notification_type="final_payment_received",
@@ -8882,15 +12169,20 @@ def add_payment(invoice_id):
                     body=f"Final payment recorded: {format_currency(pay_amount)}.",
                     link_url=f"/invoices/{invoice_id_db}",
                 )
-
-                log_invoice_event(
-                    invoice_id=invoice_id_db,
-                    event_type="final_payment_received",
-                    title="Final payment received",
-                    details=f"Invoice {inv_label} is now paid in full.",
-                    visibility="both",
+                events.append(
+                    {
+                        "event_type": "final_payment_received",
+                        "title": "Final payment received",
+                        "details": f"Invoice {inv_label} is now paid in full.",
+                        "visibility": "both",
+                    }
                 )
 
+            insert_invoice_events(cursor, invoice_id_db, events)
+            conn.commit()
+
+            invalidate_invoice_pdf_cache(invoice_id_db)
+
             cursor.execute(
                 """
                 SELECT c.email
@@ -9038,9 +12330,17 @@ def update(invoice_id):
 
     invoice_number = existing[0] or f"#{invoice_id}"
 
+    adjust_invoice_rollups(c, invoice_id, -1)
+
     c.execute(
-        "UPDATE invoices SET client = %s, amount = %s WHERE id = %s AND user_id = %s",
-        (client_name, total, invoice_id, user_id),
+        """
+        UPDATE invoices
+        SET client = %s,
+            amount = %s,
+            balance = GREATEST(%s - COALESCE(total_paid, 0), 0)
+        WHERE id = %s AND user_id = %s
+        """,
+        (client_name, total, total, invoice_id, user_id),
     )
 
     c.execute("DELETE FROM invoice_items WHERE invoice_id = %s", (invoice_id,))
@@ -9051,10 +12351,15 @@ def update(invoice_id):
             (invoice_id, desc, amt),
         )
 
+    adjust_invoice_rollups(c, invoice_id, 1)
+
     conn.commit()
     c.close()
     conn.close()
 
+    invalidate_invoice_pdf_cache(invoice_id)
+    prerender_invoice_pdf(invoice_id)
+
     log_invoice_event(
         invoice_id=invoice_id,
         event_type="invoice_updated",
@@ -9166,6 +12471,23 @@ def delete(invoice_id):
     amount_float = float(amount or 0)
     inv_label = invoice_number or f"#{invoice_id}"
 
+    adjust_invoice_rollups(c, invoice_id, -1)
+    c.execute(
+        """
+        UPDATE user_daily_revenue r
+        SET collected_total = r.collected_total - paid.amount
+        FROM (
+            SELECT DATE(COALESCE(occurred_at, created_at)) AS day, SUM(amount) AS amount
+            FROM payments
+            WHERE invoice_id = %s
+              AND COALESCE(payment_status, 'succeeded') != 'failed'
+              AND COALESCE(occurred_at, created_at) IS NOT NULL
+            GROUP BY 1
+        ) paid
+        WHERE r.user_id = %s AND r.day = paid.day
+        """,
+        (invoice_id, user_id),
+    )
     c.execute("DELETE FROM invoice_items WHERE invoice_id = %s", (invoice_id,))
     c.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
 
@@ -9173,6 +12495,8 @@ def delete(invoice_id):
     c.close()
     conn.close()
 
+    invalidate_invoice_pdf_cache(invoice_id)
+
     return render_template(
         "deleted.html",
         invoice_id=invoice_id,
@@ -9186,35 +12510,65 @@ def delete(invoice_id):
 # -------------------------
 # PDF GENERATION
 # -------------------------
-def generate_invoice_pdf_bytes(invoice_id: int):
+_INVOICE_PDF_MEMORY_CACHE = OrderedDict()
+_INVOICE_PDF_MEMORY_CACHE_STATE = {"bytes": 0}
+_INVOICE_PDF_MEMORY_CACHE_LOCK = threading.Lock()
+
+
+def load_invoice_pdf_sources(invoice_ids, business_name: str):
+    """
+    Everything each PDF is drawn from, keyed by invoice id. The cache key is
+    a hash of the source dict, so it must hold every input that changes the
+    rendered document.
+    """
+    invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+    if not invoice_ids:
+        return {}
+
     conn = get_db_connection()
     c = conn.cursor()
+    try:
+        c.execute(
+            """
+            SELECT
+                id,
+                client,
+                amount,
+                created_at,
+                due_date,
+                invoice_number,
+                template_style,
+                notes,
+                terms,
+                signature_data
+            FROM invoices
+            WHERE id = ANY(%s)
+            """,
+            (invoice_ids,),
+        )
+        rows = c.fetchall()
 
-    c.execute(
-        """
-        SELECT
-            client,
-            amount,
-            created_at,
-            due_date,
-            invoice_number,
-            template_style,
-            notes,
-            terms,
-            signature_data
-        FROM invoices
-        WHERE id = %s
-        """,
-        (invoice_id,),
-    )
-    row = c.fetchone()
-
-    if not row:
+        c.execute(
+            """
+            SELECT invoice_id, description, amount
+            FROM invoice_items
+            WHERE invoice_id = ANY(%s)
+            ORDER BY invoice_id ASC, id ASC
+            """,
+            (invoice_ids,),
+        )
+        item_rows = c.fetchall()
+    finally:
         c.close()
         conn.close()
-        return None, "Invoice not found"
 
-    (
+    items_by_invoice = {}
+    for invoice_id, desc, amt in item_rows:
+        items_by_invoice.setdefault(invoice_id, []).append((desc, amt))
+
+    sources = {}
+    for (
+        invoice_id,
         client_name,
         amount,
         created_at,
@@ -9224,224 +12578,337 @@ def generate_invoice_pdf_bytes(invoice_id: int):
         notes,
         terms,
         signature_data,
-    ) = row
+    ) in rows:
+        sources[invoice_id] = {
+            "render_version": INVOICE_PDF_RENDER_VERSION,
+            "invoice_id": invoice_id,
+            "client": client_name,
+            "amount": amount,
+            "created_at": created_at,
+            "due_date": due_date,
+            "invoice_number": invoice_number,
+            "template_style": (template_style or "modern").lower(),
+            "notes": notes,
+            "terms": terms,
+            "signature_data": signature_data,
+            "items": items_by_invoice.get(invoice_id, []),
+            "business_name": business_name,
+        }
 
-    amount_float = float(amount)
-    template_style = (template_style or "modern").lower()
+    return sources
 
-    profile = get_business_profile_safe()
-    business_name = profile.get("business_name") or DEFAULT_BUSINESS_NAME
 
-    c.execute(
-        "SELECT description, amount FROM invoice_items WHERE invoice_id = %s",
-        (invoice_id,),
-    )
-    items = c.fetchall()
-    c.close()
-    conn.close()
+def get_invoice_pdf_business_name(user_id: int = None) -> str:
+    # Outside a request (the email worker) the invoice owner's profile is used.
+    # With no owner there, fall back to the default rather than reading the
+    # session, which raises outside a request.
+    if user_id:
+        profile = get_business_profile_by_user_id(user_id)
+    elif has_request_context():
+        profile = get_business_profile_safe()
+    else:
+        return DEFAULT_BUSINESS_NAME
+    return (profile or {}).get("business_name") or DEFAULT_BUSINESS_NAME
 
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=LETTER)
-    page_width, page_height = LETTER
-
-    header_bar_color = (21 / 255, 27 / 255, 84 / 255)
-    accent_color = header_bar_color
-    title_text = business_name
-
-    if template_style == "minimal":
-        header_bar_color = (0.18, 0.20, 0.24)
-        accent_color = (0.6, 0.6, 0.65)
-    elif template_style == "bold":
-        header_bar_color = (0.97, 0.45, 0.09)
-        accent_color = (0.97, 0.45, 0.09)
-    elif template_style == "doodle":
-        header_bar_color = (0.33, 0.27, 0.96)
-        accent_color = (0.33, 0.27, 0.96)
-
-        pdf.setFillColorRGB(0.93, 0.95, 1.0)
-        pdf.circle(60, page_height - 120, 26, fill=1, stroke=0)
-        pdf.setFillColorRGB(0.96, 0.92, 1.0)
-        pdf.circle(page_width - 80, page_height - 200, 30, fill=1, stroke=0)
-        pdf.setFillColorRGB(0.90, 0.96, 0.98)
-        pdf.rect(page_width - 150, 40, 120, 60, fill=1, stroke=0)
-
-    pdf.setFillColorRGB(*header_bar_color)
-    pdf.rect(0, page_height - 60, page_width, 60, fill=1, stroke=0)
-
-    pdf.setFillColorRGB(1, 1, 1)
-    pdf.setFont("Helvetica-Bold", 22)
-    pdf.drawString(72, page_height - 40, title_text)
-
-    pdf.setFillColorRGB(0.1, 0.1, 0.15)
-    pdf.setFont("Helvetica", 11)
 
-    inv_label = invoice_number or f"#{invoice_id}"
-    y = page_height - 90
-
-    pdf.drawString(72, y, f"Invoice: {inv_label}")
-    y -= 16
-    pdf.drawString(72, y, f"Client: {client_name}")
-    y -= 16
-
-    if created_at:
-        pdf.drawString(72, y, f"Created: {created_at.strftime('%Y-%m-%d %I:%M %p')}")
-        y -= 16
-    if due_date:
-        pdf.drawString(72, y, f"Due: {due_date.strftime('%Y-%m-%d')}")
-        y -= 16
-
-    right_box_top = page_height - 90
-    right_box_left = page_width - 220
-    pdf.setFillColorRGB(1, 1, 1)
-    pdf.setStrokeColorRGB(*accent_color)
-    pdf.rect(right_box_left, right_box_top - 50, 180, 50, fill=1, stroke=1)
-
-    pdf.setFillColorRGB(0.1, 0.1, 0.15)
-    pdf.setFont("Helvetica-Bold", 11)
-    pdf.drawString(right_box_left + 10, right_box_top - 20, "Total")
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.setFillColorRGB(*accent_color)
-    pdf.drawRightString(right_box_left + 170, right_box_top - 30, f"${amount_float:,.2f}")
-
-    y = right_box_top - 80
-    pdf.setFillColorRGB(0.1, 0.1, 0.15)
-    pdf.setFont("Helvetica-Bold", 12)
-    pdf.drawString(72, y, "Line Items")
-    y -= 20
-
-    pdf.setFont("Helvetica", 11)
-    pdf.setFillColorRGB(0.3, 0.3, 0.35)
-    pdf.drawString(72, y, "Description")
-    pdf.drawRightString(page_width - 72, y, "Amount")
-    y -= 12
-
-    pdf.setStrokeColorRGB(0.85, 0.87, 0.9)
-    pdf.line(72, y, page_width - 72, y)
-    y -= 18
-
-    pdf.setFont("Helvetica", 10)
-    pdf.setFillColorRGB(0.1, 0.1, 0.15)
-
-    for desc, amt in items:
-        amt_float = float(amt)
-        pdf.drawString(72, y, f"{desc}")
-        pdf.drawRightString(page_width - 72, y, f"${amt_float:,.2f}")
-        y -= 16
-
-        if y < 120:
-            pdf.showPage()
-            page_width, page_height = LETTER
-            y = page_height - 100
-            pdf.setFont("Helvetica", 10)
-            pdf.setFillColorRGB(0.1, 0.1, 0.15)
-
-    if y < 120:
-        pdf.showPage()
-        page_width, page_height = LETTER
-        y = page_height - 100
-
-    if notes:
-        pdf.setFont("Helvetica-Bold", 11)
-        pdf.setFillColorRGB(0.1, 0.1, 0.15)
-        pdf.drawString(72, y, "Notes")
-        y -= 16
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(72, y, notes[:120])
-        y -= 20
-
-    if terms:
-        if y < 80:
-            pdf.showPage()
-            page_width, page_height = LETTER
-            y = page_height - 100
-
-        pdf.setFont("Helvetica-Bold", 11)
-        pdf.setFillColorRGB(0.1, 0.1, 0.15)
-        pdf.drawString(72, y, "Payment Terms")
-        y -= 16
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(72, y, terms[:160])
-        y -= 20
-
-    if signature_data:
+def load_invoice_pdf_source(invoice_id: int):
+    sources = load_invoice_pdf_sources([invoice_id], get_invoice_pdf_business_name())
+    return sources.get(int(invoice_id))
+
+
+def invoice_pdf_cache_key(source: dict) -> str:
+    payload = json.dumps(source, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _invoice_pdf_cache_path(invoice_id: int, digest: str) -> str:
+    return os.path.join(INVOICE_PDF_CACHE_ROOT, str(int(invoice_id)), f"{digest}.pdf")
+
+
+def _remember_invoice_pdf(cache_key, pdf_bytes: bytes):
+    size = len(pdf_bytes)
+    if size > INVOICE_PDF_CACHE_MEMORY_MAX_BYTES:
+        return
+
+    with _INVOICE_PDF_MEMORY_CACHE_LOCK:
+        previous = _INVOICE_PDF_MEMORY_CACHE.pop(cache_key, None)
+        if previous is not None:
+            _INVOICE_PDF_MEMORY_CACHE_STATE["bytes"] -= len(previous)
+
+        _INVOICE_PDF_MEMORY_CACHE[cache_key] = pdf_bytes
+        _INVOICE_PDF_MEMORY_CACHE_STATE["bytes"] += size
+
+        while _INVOICE_PDF_MEMORY_CACHE_STATE["bytes"] > INVOICE_PDF_CACHE_MEMORY_MAX_BYTES:
+            _, evicted = _INVOICE_PDF_MEMORY_CACHE.popitem(last=False)
+            _INVOICE_PDF_MEMORY_CACHE_STATE["bytes"] -= len(evicted)
+
+
+def read_cached_invoice_pdf(invoice_id: int, digest: str):
+    cache_key = (int(invoice_id), digest)
+
+    with _INVOICE_PDF_MEMORY_CACHE_LOCK:
+        pdf_bytes = _INVOICE_PDF_MEMORY_CACHE.get(cache_key)
+        if pdf_bytes is not None:
+            _INVOICE_PDF_MEMORY_CACHE.move_to_end(cache_key)
+            return pdf_bytes
+
+    try:
+        with open(_invoice_pdf_cache_path(invoice_id, digest), "rb") as f:
+            pdf_bytes = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning("Failed reading cached PDF for invoice_id=%s: %s", invoice_id, e)
+        return None
+
+    _remember_invoice_pdf(cache_key, pdf_bytes)
+    return pdf_bytes
+
+
+def store_cached_invoice_pdf(invoice_id: int, digest: str, pdf_bytes: bytes):
+    _remember_invoice_pdf((int(invoice_id), digest), pdf_bytes)
+
+    path = _invoice_pdf_cache_path(invoice_id, digest)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Failed writing cached PDF for invoice_id=%s: %s", invoice_id, e)
         try:
-            if signature_data.startswith("data:image"):
-                _, b64_data = signature_data.split(",", 1)
-            else:
-                b64_data = signature_data
-
-            sig_bytes = base64.b64decode(b64_data)
-            sig_buf = io.BytesIO(sig_bytes)
-            sig_img = ImageReader(sig_buf)
-
-            if y < 140:
-                pdf.showPage()
-                page_width, page_height = LETTER
-                y = page_height - 160
-
-            pdf.setFont("Helvetica-Bold", 11)
-            pdf.setFillColorRGB(0.1, 0.1, 0.15)
-            pdf.drawString(72, y, "Client Signature")
-            y -= 10
-
-            sig_box_height = 70
-            sig_box_width = 200
-
-            pdf.setStrokeColorRGB(0.8, 0.82, 0.86)
-            pdf.rect(72, y - sig_box_height, sig_box_width, sig_box_height, fill=0, stroke=1)
-
-            pdf.drawImage(
-                sig_img,
-                72 + 6,
-                y - sig_box_height + 6,
-                width=sig_box_width - 12,
-                height=sig_box_height - 12,
-                mask="auto",
-            )
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
-            y -= sig_box_height + 16
-        except Exception:
-            logger.warning("Failed to render signature for invoice_id=%s", invoice_id)
 
-    if y < 80:
-        pdf.showPage()
-        page_width, page_height = LETTER
-        y = page_height - 120
+def invalidate_invoice_pdf_cache(invoice_id: int):
+    """
+    Drop every cached rendering of an invoice. Content addressing already
+    keeps stale PDFs from being served; this reclaims their memory and disk.
+    """
+    invoice_id = int(invoice_id)
 
-    pdf.setStrokeColorRGB(0.85, 0.87, 0.9)
-    pdf.line(72, y, page_width - 72, y)
-    y -= 24
+    with _INVOICE_PDF_MEMORY_CACHE_LOCK:
+        for cache_key in [k for k in _INVOICE_PDF_MEMORY_CACHE if k[0] == invoice_id]:
+            evicted = _INVOICE_PDF_MEMORY_CACHE.pop(cache_key)
+            _INVOICE_PDF_MEMORY_CACHE_STATE["bytes"] -= len(evicted)
 
-    pdf.setFont("Helvetica-Bold", 12)
-    pdf.setFillColorRGB(*accent_color)
-    pdf.drawRightString(page_width - 72, y, f"Total Due: ${amount_float:,.2f}")
+    shutil.rmtree(os.path.join(INVOICE_PDF_CACHE_ROOT, str(invoice_id)), ignore_errors=True)
 
-    pdf.setFont("Helvetica", 8)
-    pdf.setFillColorRGB(0.45, 0.45, 0.45)
-    pdf.drawCentredString(
-        page_width / 2,
-        20,
-        "Created with BillBeam • Modern invoicing made simple • billbeam.app"
-    )
 
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-    return buffer.getvalue(), None
+# -------------------------
+# PDF RENDER POOL
+# -------------------------
+# Rendering is pure ReportLab work on a picklable source dict, so it runs in
+# a process pool. Pools start lazily per web worker process; in-flight jobs
+# are shared so a download waits on the pre-render instead of redoing it.
+#
+# By the time the pool starts, the web worker is multi-threaded (DB pool,
+# APNs clients, invoice-event flusher, message-stream listener), and a plain
+# fork() could copy a held lock into a render process. Render processes are
+# therefore forked from a forkserver: a fresh single-threaded process that
+# preloads invoice_pdf (not app, whose import runs init_db()), so each render
+# process starts warm without touching the database.
+_PDF_RENDER_LOCK = threading.Lock()
+_PDF_RENDER_POOL = {"executor": None, "pid": None}
+_PDF_RENDER_JOBS = {}
+_PDF_RENDER_STATS = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "inline_renders": 0,
+    "cache_hits": 0,
+    "waits": 0,
+    "wait_timeouts": 0,
+    "render_ms_total": 0.0,
+}
+
+
+def _get_pdf_render_mp_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([render_invoice_pdf.__module__])
+    return context
+
+
+def _get_pdf_render_executor():
+    if INVOICE_PDF_RENDER_WORKERS <= 0:
+        return None
+
+    pid = os.getpid()
+    if _PDF_RENDER_POOL["executor"] is None or _PDF_RENDER_POOL["pid"] != pid:
+        # A pool inherited across fork belongs to the parent; start our own.
+        _PDF_RENDER_JOBS.clear()
+        _PDF_RENDER_POOL["executor"] = concurrent.futures.ProcessPoolExecutor(
+            max_workers=INVOICE_PDF_RENDER_WORKERS,
+            mp_context=_get_pdf_render_mp_context(),
+        )
+        _PDF_RENDER_POOL["pid"] = pid
+
+    return _PDF_RENDER_POOL["executor"]
+
+
+def _reset_pdf_render_executor():
+    with _PDF_RENDER_LOCK:
+        executor = _PDF_RENDER_POOL["executor"]
+        _PDF_RENDER_POOL["executor"] = None
+        _PDF_RENDER_POOL["pid"] = None
+        _PDF_RENDER_JOBS.clear()
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _finish_pdf_render_job(job_key, submitted_at, future):
+    invoice_id, digest = job_key
+
+    with _PDF_RENDER_LOCK:
+        if _PDF_RENDER_JOBS.get(job_key) is future:
+            del _PDF_RENDER_JOBS[job_key]
+        _PDF_RENDER_STATS["render_ms_total"] += (time.monotonic() - submitted_at) * 1000.0
+        if future.cancelled() or future.exception() is not None:
+            _PDF_RENDER_STATS["failed"] += 1
+        else:
+            _PDF_RENDER_STATS["completed"] += 1
+
+    if future.cancelled():
+        return
+
+    error = future.exception()
+    if error is not None:
+        logger.warning("[PDF] Background render failed for invoice_id=%s: %s", invoice_id, error)
+        return
+
+    store_cached_invoice_pdf(invoice_id, digest, future.result())
+
+
+def submit_invoice_pdf_render(source: dict, digest: str):
+    """
+    Queue a render of `source` unless one is already in flight. Returns the
+    job's Future, or None when rendering is inline (pool disabled/broken).
+    """
+    job_key = (int(source["invoice_id"]), digest)
+
+    with _PDF_RENDER_LOCK:
+        future = _PDF_RENDER_JOBS.get(job_key)
+        if future is not None:
+            return future
+
+        executor = _get_pdf_render_executor()
+        if executor is None:
+            return None
+
+        try:
+            future = executor.submit(render_invoice_pdf, source)
+        except (concurrent.futures.BrokenExecutor, RuntimeError) as e:
+            logger.warning("[PDF] Render pool unavailable, rendering inline: %s", e)
+            future = None
+        else:
+            _PDF_RENDER_JOBS[job_key] = future
+            _PDF_RENDER_STATS["submitted"] += 1
+
+    if future is None:
+        _reset_pdf_render_executor()
+        return None
+
+    future.add_done_callback(partial(_finish_pdf_render_job, job_key, time.monotonic()))
+    return future
+
+
+def prerender_invoice_pdf(invoice_id: int):
+    """Warm the PDF cache after an invoice write. Never raises."""
+    try:
+        source = load_invoice_pdf_source(invoice_id)
+        if not source:
+            return
+
+        digest = invoice_pdf_cache_key(source)
+        if read_cached_invoice_pdf(invoice_id, digest) is None:
+            submit_invoice_pdf_render(source, digest)
+    except Exception as e:
+        logger.warning("[PDF] Pre-render failed for invoice_id=%s: %s", invoice_id, e)
+
+
+def get_pdf_render_stats():
+    with _PDF_RENDER_LOCK:
+        stats = dict(_PDF_RENDER_STATS)
+        stats["queue_depth"] = len(_PDF_RENDER_JOBS)
+
+    render_ms_total = stats.pop("render_ms_total")
+    finished = stats["completed"] + stats["failed"]
+    stats["render_ms_avg"] = round(render_ms_total / finished, 1) if finished else None
+    stats["workers"] = max(INVOICE_PDF_RENDER_WORKERS, 0)
+    return stats
+
+
+def get_invoice_pdf_from_source(source: dict, digest: str = None) -> bytes:
+    digest = digest or invoice_pdf_cache_key(source)
+    invoice_id = source["invoice_id"]
+
+    pdf_bytes = read_cached_invoice_pdf(invoice_id, digest)
+    if pdf_bytes is not None:
+        with _PDF_RENDER_LOCK:
+            _PDF_RENDER_STATS["cache_hits"] += 1
+        return pdf_bytes
+
+    future = submit_invoice_pdf_render(source, digest)
+    if future is not None:
+        with _PDF_RENDER_LOCK:
+            _PDF_RENDER_STATS["waits"] += 1
+        try:
+            return future.result(timeout=INVOICE_PDF_RENDER_WAIT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            with _PDF_RENDER_LOCK:
+                _PDF_RENDER_STATS["wait_timeouts"] += 1
+            logger.warning("[PDF] Render queue wait timed out for invoice_id=%s", invoice_id)
+        except concurrent.futures.BrokenExecutor as e:
+            logger.warning("[PDF] Render pool broke, rendering inline: %s", e)
+            _reset_pdf_render_executor()
+        except Exception as e:
+            logger.warning("[PDF] Background render failed for invoice_id=%s: %s", invoice_id, e)
+
+    with _PDF_RENDER_LOCK:
+        _PDF_RENDER_STATS["inline_renders"] += 1
+
+    pdf_bytes = render_invoice_pdf(source)
+    store_cached_invoice_pdf(invoice_id, digest, pdf_bytes)
+    return pdf_bytes
+
+
+def generate_invoice_pdf_bytes(invoice_id: int):
+    source = load_invoice_pdf_source(invoice_id)
+    if not source:
+        return None, "Invoice not found"
+
+    return get_invoice_pdf_from_source(source), None
 
 
 @app.route("/history-pdf/<int:invoice_id>")
 def history_pdf(invoice_id):
-    pdf_bytes, err = generate_invoice_pdf_bytes(invoice_id)
-    if err:
-        return err, 404
+    source = load_invoice_pdf_source(invoice_id)
+    if not source:
+        return "Invoice not found", 404
 
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        as_attachment=True,
-        download_name=f"invoice_{invoice_id}.pdf",
-        mimetype="application/pdf",
-    )
+    digest = invoice_pdf_cache_key(source)
+
+    if request.if_none_match.contains(digest):
+        response = app.response_class(status=304)
+    else:
+        response = send_file(
+            io.BytesIO(get_invoice_pdf_from_source(source, digest)),
+            as_attachment=True,
+            download_name=f"invoice_{invoice_id}.pdf",
+            mimetype="application/pdf",
+            conditional=False,
+        )
+
+    response.set_etag(digest)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 # -------------------------
@@ -9854,97 +13321,64 @@ def mark_invoice_last_emailed(invoice_id: int, to_email: str, is_reminder: bool
         cur.close()
         conn.close()
 
-def send_email_via_resend(to_email: str, subject: str, body_text: str, pdf_bytes: bytes, filename: str):
+def get_resend_config():
+    """(api_key, resend_from, error) for Resend, validated up front."""
     api_key = os.environ.get("RESEND_API_KEY")
     resend_from = os.environ.get("RESEND_FROM")
 
     if not api_key:
-        return False, "Resend configuration missing: RESEND_API_KEY is not set."
+        return None, None, "Resend configuration missing: RESEND_API_KEY is not set."
 
     if not resend_from:
-        return False, (
+        return None, None, (
             "Resend configuration missing: RESEND_FROM is not set. "
             "Set RESEND_FROM to something like 'BillBeam <billing@billbeam.com>'."
         )
 
     if "gmail.com" in resend_from.lower():
-        return False, (
+        return None, None, (
             "Resend cannot send from a gmail.com address. "
             f"Current RESEND_FROM value is: '{resend_from}'. "
             "Use your verified domain, for example 'BillBeam <billing@yourdomain.com>'."
         )
 
-    encoded_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
-
-    try:
-        resp = requests.post(
-            "https://api.resend.com/emails",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "from": resend_from,
-                "to": [to_email],
-                "subject": subject,
-                "text": body_text,
-                "attachments": [
-                    {
-                        "filename": filename,
-                        "content": encoded_pdf,
-                        "contentType": "application/pdf",
-                    }
-                ],
-            },
-            timeout=10,
-        )
+    return api_key, resend_from, None
 
-        if resp.status_code >= 400:
-            try:
-                data = resp.json()
-                msg = data.get("message", "")
-            except Exception:
-                msg = resp.text
 
-            return False, f"Resend API error {resp.status_code}: {msg or resp.text}"
+def record_invoice_email_sent(invoice_id: int, to_email: str, email_type: str):
+    is_reminder = email_type == "reminder"
+    mark_invoice_last_emailed(invoice_id, to_email, is_reminder=is_reminder)
 
-        return True, None
+    event_type = "reminder_sent" if is_reminder else "invoice_emailed"
+    event_title = "Reminder sent" if is_reminder else "Invoice emailed"
 
-    except Exception as e:
-        return False, f"Error sending via Resend: {e}"
+    log_invoice_event(
+        invoice_id=invoice_id,
+        event_type=event_type,
+        title=event_title,
+        details=f"{event_title} to {to_email}.",
+        visibility="private",
+    )
 
 
 def send_invoice_email(invoice_id: int, to_email: str, subject: str, body_text: str, email_type: str = "invoice"):
-    pdf_bytes, err = generate_invoice_pdf_bytes(invoice_id)
-    if err:
-        return False, err
-
-    filename = f"invoice_{invoice_id}.pdf"
-
+    # With Resend configured the email goes through the outbox; the worker
+    # renders the PDF and records the send once Resend accepts it.
     if os.environ.get("RESEND_API_KEY"):
-        success, api_err = send_email_via_resend(
+        return enqueue_email(
             to_email=to_email,
             subject=subject,
             body_text=body_text,
-            pdf_bytes=pdf_bytes,
-            filename=filename,
-        )
-        if success:
-            is_reminder = email_type == "reminder"
-            mark_invoice_last_emailed(invoice_id, to_email, is_reminder=is_reminder)
-
-            event_type = "reminder_sent" if is_reminder else "invoice_emailed"
-            event_title = "Reminder sent" if is_reminder else "Invoice emailed"
-
-            log_invoice_event(
-                invoice_id=invoice_id,
-                event_type=event_type,
-                title=event_title,
-                details=f"{event_title} to {to_email}.",
-                visibility="private",
-            )
-            return True, None
-        return False, api_err
+            email_type=email_type,
+            invoice_id=invoice_id,
+            attach_invoice_pdf=True,
+        )
+
+    pdf_bytes, err = generate_invoice_pdf_bytes(invoice_id)
+    if err:
+        return False, err
+
+    filename = f"invoice_{invoice_id}.pdf"
 
     smtp_host = os.environ.get("SMTP_HOST")
     smtp_port = int(os.environ.get("SMTP_PORT", "587"))
@@ -9998,72 +13432,18 @@ def send_invoice_email(invoice_id: int, to_email: str, subject: str, body_text:
     except Exception as e:
         return False, f"Error sending email (connection or SMTP error): {e}"
 
-    is_reminder = email_type == "reminder"
-    mark_invoice_last_emailed(invoice_id, to_email, is_reminder=is_reminder)
-
-    event_type = "reminder_sent" if is_reminder else "invoice_emailed"
-    event_title = "Reminder sent" if is_reminder else "Invoice emailed"
-
-    log_invoice_event(
-        invoice_id=invoice_id,
-        event_type=event_type,
-        title=event_title,
-        details=f"{event_title} to {to_email}.",
-        visibility="private",
-    )
+    record_invoice_email_sent(invoice_id, to_email, email_type)
 
     return True, None
 
 
-def send_basic_email_via_resend(to_email: str, subject: str, body_text: str):
-    api_key = os.environ.get("RESEND_API_KEY")
-    resend_from = os.environ.get("RESEND_FROM")
-
-    if not api_key:
-        return False, "Resend configuration missing: RESEND_API_KEY is not set."
-
-    if not resend_from:
-        return False, (
-            "Resend configuration missing: RESEND_FROM is not set. "
-            "Set RESEND_FROM to something like 'BillBeam <billing@billbeam.com>'."
-        )
-
-    if "gmail.com" in resend_from.lower():
-        return False, (
-            "Resend cannot send from a gmail.com address. "
-            f"Current RESEND_FROM value is: '{resend_from}'. "
-            "Use your verified domain, for example 'BillBeam <billing@yourdomain.com>'."
-        )
-
-    try:
-        resp = requests.post(
-            "https://api.resend.com/emails",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "from": resend_from,
-                "to": [to_email],
-                "subject": subject,
-                "text": body_text,
-            },
-            timeout=10,
-        )
-
-        if resp.status_code >= 400:
-            try:
-                data = resp.json()
-                msg = data.get("message", "")
-            except Exception:
-                msg = resp.text
-
-            return False, f"Resend API error {resp.status_code}: {msg or resp.text}"
-
-        return True, None
-
-    except Exception as e:
-        return False, f"Error sending via Resend: {e}"
+def send_basic_email_via_resend(to_email: str, subject: str, body_text: str, email_type: str = "basic"):
+    return enqueue_email(
+        to_email=to_email,
+        subject=subject,
+        body_text=body_text,
+        email_type=email_type,
+    )
 
 
 def send_client_service_request_status_email(
@@ -10129,53 +13509,484 @@ def send_client_service_request_status_email(
             "This is just a quick update to keep you in the loop."
         )
 
-    footer_lines = ["", "—", business_name]
+    footer_lines = ["", "—", business_name]
+
+    if business_email:
+        footer_lines.append(business_email)
+
+    if business_website:
+        footer_lines.append(business_website)
+
+    footer_lines.append("Powered by BillBeam")
+
+    body_text = "\n".join(body_lines + footer_lines)
+
+    if os.environ.get("RESEND_API_KEY"):
+        return send_basic_email_via_resend(
+            to_email=client_email,
+            subject=subject,
+            body_text=body_text,
+            email_type="service_request_status",
+        )
+
+    smtp_host = os.environ.get("SMTP_HOST")
+    smtp_port = int(os.environ.get("SMTP_PORT", "587"))
+    smtp_user = os.environ.get("SMTP_USER")
+    smtp_password = os.environ.get("SMTP_PASSWORD")
+    smtp_from = os.environ.get("SMTP_FROM") or smtp_user
+
+    if not smtp_host or not smtp_from:
+        return False, (
+            "No email provider available. Configure Resend (RESEND_API_KEY & RESEND_FROM) "
+            "or SMTP (SMTP_HOST & SMTP_FROM)."
+        )
+
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = f"{business_name} <{smtp_from}>"
+    msg["To"] = client_email
+    msg.set_content(body_text)
+
+    try:
+        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
+            server.starttls()
+            if smtp_user and smtp_password:
+                server.login(smtp_user, smtp_password)
+            server.send_message(msg)
+    except Exception as e:
+        return False, f"Error sending email (connection or SMTP error): {e}"
+
+    return True, None
+
+
+# -------------------------
+# EMAIL OUTBOX
+# -------------------------
+# Outbound Resend email is written to email_outbox and delivered by
+# `flask email-outbox-worker`, so no web request or webhook waits on Resend.
+RESEND_BATCH_MAX_EMAILS = 100
+
+_RESEND_SESSION = {"session": None, "pid": None}
+
+
+def enqueue_email(
+    to_email: str,
+    subject: str,
+    body_text: str,
+    email_type: str = "basic",
+    invoice_id: int = None,
+    attach_invoice_pdf: bool = False,
+):
+    _api_key, _resend_from, config_err = get_resend_config()
+    if config_err:
+        return False, config_err
+
+    now_dt = now_local()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if invoice_id is not None:
+            cur.execute(
+                """
+                INSERT INTO email_outbox (
+                    email_type, to_email, subject, body_text, invoice_id, user_id,
+                    attach_invoice_pdf, next_attempt_at, created_at
+                )
+                SELECT %s, %s, %s, %s, i.id, i.user_id, %s, %s, %s
+                FROM invoices i
+                WHERE i.id = %s
+                RETURNING id
+                """,
+                (email_type, to_email, subject, body_text, attach_invoice_pdf, now_dt, now_dt, invoice_id),
+            )
+        else:
+            cur.execute(
+                """
+                INSERT INTO email_outbox (email_type, to_email, subject, body_text, next_attempt_at, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+                """,
+                (email_type, to_email, subject, body_text, now_dt, now_dt),
+            )
+
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            return False, "Invoice not found"
+
+        conn.commit()
+        return True, None
+    except Exception as e:
+        conn.rollback()
+        logger.exception("Failed to queue %s email to %s: %s", email_type, to_email, e)
+        return False, "Failed to queue email."
+    finally:
+        cur.close()
+        conn.close()
+
+
+def get_resend_session():
+    """One keep-alive requests.Session per process for the outbox worker."""
+    pid = os.getpid()
+    if _RESEND_SESSION["session"] is None or _RESEND_SESSION["pid"] != pid:
+        session_obj = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session_obj.mount("https://", adapter)
+        session_obj.mount("http://", adapter)
+        _RESEND_SESSION["session"] = session_obj
+        _RESEND_SESSION["pid"] = pid
+    return _RESEND_SESSION["session"]
+
+
+def post_to_resend(path: str, payload, api_key: str, idempotency_key: str):
+    """
+    POST to the Resend API. Returns (data, error, retryable): data is the
+    decoded response on success; rate limits, 5xx and network errors are
+    retryable, other 4xx responses are not.
+    """
+    try:
+        resp = get_resend_session().post(
+            f"{RESEND_API_BASE_URL}{path}",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                "Idempotency-Key": idempotency_key,
+            },
+            json=payload,
+            timeout=10,
+        )
+    except requests.RequestException as e:
+        return None, f"Error sending via Resend: {e}", True
+
+    if resp.status_code >= 400:
+        try:
+            msg = resp.json().get("message", "")
+        except Exception:
+            msg = resp.text
+
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        return None, f"Resend API error {resp.status_code}: {msg or resp.text}", retryable
+
+    try:
+        return resp.json(), None, False
+    except ValueError:
+        return {}, None, False
+
+
+def claim_email_outbox_batch(limit: int):
+    """
+    Lock up to `limit` due rows for this worker. Rows left in 'sending' by a
+    worker that died are picked up again after EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS.
+    """
+    now_dt = now_local()
+    stale_before = now_dt - timedelta(seconds=EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE email_outbox o
+            SET status = 'sending',
+                locked_at = %s,
+                attempts = o.attempts + 1
+            WHERE o.id IN (
+                SELECT id
+                FROM email_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= %s)
+                   OR (status = 'sending' AND locked_at < %s)
+                ORDER BY next_attempt_at ASC, id ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.email_type, o.to_email, o.subject, o.body_text,
+                      o.invoice_id, o.user_id, o.attach_invoice_pdf, o.attempts
+            """,
+            (now_dt, now_dt, stale_before, limit),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    columns = (
+        "id", "email_type", "to_email", "subject", "body_text",
+        "invoice_id", "user_id", "attach_invoice_pdf", "attempts",
+    )
+    return sorted((dict(zip(columns, row)) for row in rows), key=lambda r: r["id"])
+
+
+def build_outbox_email_payload(row: dict, resend_from: str):
+    payload = {
+        "from": resend_from,
+        "to": [row["to_email"]],
+        "subject": row["subject"],
+        "text": row["body_text"],
+    }
+
+    if row["attach_invoice_pdf"]:
+        invoice_id = row["invoice_id"]
+        business_name = get_invoice_pdf_business_name(row["user_id"])
+        source = load_invoice_pdf_sources([invoice_id], business_name).get(invoice_id)
+        if not source:
+            return None
+
+        payload["attachments"] = [
+            {
+                "filename": f"invoice_{invoice_id}.pdf",
+                "content": base64.b64encode(get_invoice_pdf_from_source(source)).decode("utf-8"),
+                "contentType": "application/pdf",
+            }
+        ]
+
+    return payload
+
+
+def mark_outbox_email_sent(row: dict, provider_message_id: str = None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sent',
+                sent_at = %s,
+                locked_at = NULL,
+                last_error = NULL,
+                provider_message_id = %s
+            WHERE id = %s
+            """,
+            (now_local(), provider_message_id, row["id"]),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    if row["invoice_id"] and row["attach_invoice_pdf"]:
+        record_invoice_email_sent(row["invoice_id"], row["to_email"], row["email_type"])
+
+
+def mark_outbox_email_failed(row: dict, error: str, retryable: bool):
+    dead = not retryable or row["attempts"] >= EMAIL_OUTBOX_MAX_ATTEMPTS
+    delay = min(
+        EMAIL_OUTBOX_RETRY_BASE_SECONDS * (2 ** max(row["attempts"] - 1, 0)),
+        EMAIL_OUTBOX_RETRY_MAX_SECONDS,
+    )
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = %s,
+                next_attempt_at = %s,
+                locked_at = NULL,
+                last_error = %s
+            WHERE id = %s
+            """,
+            ("dead" if dead else "pending", now_local() + timedelta(seconds=delay), error, row["id"]),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    if dead:
+        logger.error("[EmailOutbox] Dead-lettered email id=%s to=%s after %s attempt(s): %s", row["id"], row["to_email"], row["attempts"], error)
+    else:
+        logger.warning("[EmailOutbox] Email id=%s failed (attempt %s), retrying in %ss: %s", row["id"], row["attempts"], delay, error)
+
+    return dead
+
+
+def deliver_outbox_email(row: dict, payload: dict, api_key: str):
+    data, error, retryable = post_to_resend("/emails", payload, api_key, f"email-outbox-{row['id']}")
+    if error:
+        return "dead" if mark_outbox_email_failed(row, error, retryable) else "retry"
+
+    mark_outbox_email_sent(row, (data or {}).get("id"))
+    return "sent"
+
+
+def deliver_outbox_email_batch(rows, payloads, api_key: str):
+    """
+    Send attachment-free emails through Resend's batch endpoint. If Resend
+    rejects the batch as a whole (one bad address fails it), fall back to
+    sending each email on its own so only the bad one is dead-lettered.
+    """
+    idempotency_key = "email-outbox-batch-" + hashlib.sha256(
+        ",".join(str(row["id"]) for row in rows).encode("utf-8")
+    ).hexdigest()[:32]
+
+    data, error, retryable = post_to_resend("/emails/batch", payloads, api_key, idempotency_key)
+
+    results = []
+    if error and not retryable:
+        for row, payload in zip(rows, payloads):
+            results.append(deliver_outbox_email(row, payload, api_key))
+        return results
+
+    if error:
+        for row in rows:
+            results.append("dead" if mark_outbox_email_failed(row, error, True) else "retry")
+        return results
+
+    sent_ids = [(item or {}).get("id") for item in (data or {}).get("data") or []]
+    for index, row in enumerate(rows):
+        mark_outbox_email_sent(row, sent_ids[index] if index < len(sent_ids) else None)
+        results.append("sent")
+    return results
+
+
+def process_email_outbox_batch(limit: int = None):
+    """Claim and deliver one batch of due emails. Returns outcome counts."""
+    counts = {"sent": 0, "retry": 0, "dead": 0}
+
+    api_key, resend_from, config_err = get_resend_config()
+    if config_err:
+        logger.error("[EmailOutbox] %s", config_err)
+        return counts
+
+    rows = claim_email_outbox_batch(limit or EMAIL_OUTBOX_BATCH_SIZE)
+
+    plain_rows, plain_payloads = [], []
+    for row in rows:
+        try:
+            payload = build_outbox_email_payload(row, resend_from)
+        except Exception as e:
+            logger.exception("[EmailOutbox] Failed to build email id=%s: %s", row["id"], e)
+            outcome = "dead" if mark_outbox_email_failed(row, f"Failed to build email: {e}", True) else "retry"
+            counts[outcome] += 1
+            continue
+
+        if payload is None:
+            mark_outbox_email_failed(row, "Invoice not found", False)
+            counts["dead"] += 1
+        elif "attachments" in payload:
+            counts[deliver_outbox_email(row, payload, api_key)] += 1
+        else:
+            plain_rows.append(row)
+            plain_payloads.append(payload)
 
-    if business_email:
-        footer_lines.append(business_email)
+    for start in range(0, len(plain_rows), RESEND_BATCH_MAX_EMAILS):
+        chunk_rows = plain_rows[start:start + RESEND_BATCH_MAX_EMAILS]
+        chunk_payloads = plain_payloads[start:start + RESEND_BATCH_MAX_EMAILS]
 
-    if business_website:
-        footer_lines.append(business_website)
+        if len(chunk_rows) == 1:
+            outcomes = [deliver_outbox_email(chunk_rows[0], chunk_payloads[0], api_key)]
+        else:
+            outcomes = deliver_outbox_email_batch(chunk_rows, chunk_payloads, api_key)
 
-    footer_lines.append("Powered by BillBeam")
+        for outcome in outcomes:
+            counts[outcome] += 1
 
-    body_text = "\n".join(body_lines + footer_lines)
+    return counts
 
-    if os.environ.get("RESEND_API_KEY"):
-        return send_basic_email_via_resend(
-            to_email=client_email,
-            subject=subject,
-            body_text=body_text,
-        )
 
-    smtp_host = os.environ.get("SMTP_HOST")
-    smtp_port = int(os.environ.get("SMTP_PORT", "587"))
-    smtp_user = os.environ.get("SMTP_USER")
-    smtp_password = os.environ.get("SMTP_PASSWORD")
-    smtp_from = os.environ.get("SMTP_FROM") or smtp_user
+@app.cli.command("email-outbox-worker")
+@click.option("--once", is_flag=True, help="Drain what is due now, then exit.")
+@click.option("--batch-size", default=EMAIL_OUTBOX_BATCH_SIZE, show_default=True, type=int)
+@click.option("--poll-interval", default=EMAIL_OUTBOX_POLL_SECONDS, show_default=True, type=float)
+def email_outbox_worker_command(once, batch_size, poll_interval):
+    """Deliver queued email_outbox rows through Resend."""
+    while True:
+        try:
+            counts = process_email_outbox_batch(batch_size)
+        except Exception:
+            logger.exception("[EmailOutbox] Batch failed")
+            counts = {"sent": 0, "retry": 0, "dead": 0}
 
-    if not smtp_host or not smtp_from:
-        return False, (
-            "No email provider available. Configure Resend (RESEND_API_KEY & RESEND_FROM) "
-            "or SMTP (SMTP_HOST & SMTP_FROM)."
-        )
+        processed = sum(counts.values())
+        if processed:
+            logger.info("[EmailOutbox] sent=%s retry=%s dead=%s", counts["sent"], counts["retry"], counts["dead"])
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = f"{business_name} <{smtp_from}>"
-    msg["To"] = client_email
-    msg.set_content(body_text)
+        if once and not processed:
+            break
+        if not processed:
+            time.sleep(max(poll_interval, 0.1))
 
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
-            server.starttls()
-            if smtp_user and smtp_password:
-                server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-    except Exception as e:
-        return False, f"Error sending email (connection or SMTP error): {e}"
 
-    return True, None
+class FakeResendHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts POST /emails and /emails/batch like Resend and logs each email."""
+
+    fail_every = 0
+    request_count = 0
+    count_lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            return self._reply(422, {"name": "validation_error", "message": "Invalid JSON body."})
+
+        with FakeResendHandler.count_lock:
+            FakeResendHandler.request_count += 1
+            request_number = FakeResendHandler.request_count
+
+        if self.fail_every and request_number % self.fail_every == 0:
+            return self._reply(500, {"name": "internal_server_error", "message": "Injected failure."})
+
+        if self.path == "/emails" and isinstance(payload, dict):
+            emails = [payload]
+        elif self.path == "/emails/batch" and isinstance(payload, list):
+            emails = payload
+        else:
+            return self._reply(404, {"name": "not_found", "message": f"No route for {self.path}."})
+
+        for email in emails:
+            if not email.get("to") or "invalid" in ",".join(email.get("to") or []):
+                return self._reply(422, {"name": "validation_error", "message": "Invalid `to` field."})
+
+        ids = []
+        for email in emails:
+            ids.append(str(uuid.uuid4()))
+            attachments = len(email.get("attachments") or [])
+            click.echo(f"[fake-resend] {ids[-1]} to={email.get('to')} subject={email.get('subject')!r} attachments={attachments}")
+
+        if self.path == "/emails":
+            return self._reply(200, {"id": ids[0]})
+        return self._reply(200, {"data": [{"id": email_id} for email_id in ids]})
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@app.cli.command("fake-resend-server")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8025, show_default=True, type=int)
+@click.option("--fail-every", default=0, show_default=True, type=int, help="Answer every Nth request with a 500.")
+def fake_resend_server_command(host, port, fail_every):
+    """Local stand-in for the Resend API; set RESEND_API_BASE_URL=http://HOST:PORT."""
+    FakeResendHandler.fail_every = max(fail_every, 0)
+    server = http.server.ThreadingHTTPServer((host, port), FakeResendHandler)
+    click.echo(f"Fake Resend listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 def build_invoice_email_defaults(invoice_id: int, email_type: str = "invoice"):
@@ -10420,7 +14231,7 @@ def send_email_view(invoice_id):
         else:
             success, err = send_invoice_email(invoice_id_db, to_email, subject, message_body)
             if success:
-                feedback_message = f"Invoice {inv_label} was emailed to {to_email}."
+                feedback_message = f"Invoice {inv_label} is on its way to {to_email}."
                 feedback_type = "success"
                 default_to_email = to_email
             else:
@@ -10500,7 +14311,7 @@ def send_reminder_view(invoice_id):
                 email_type="reminder",
             )
             if success:
-                feedback_message = f"Reminder sent for invoice {defaults['inv_label']}."
+                feedback_message = f"Reminder for invoice {defaults['inv_label']} is on its way."
                 feedback_type = "success"
                 defaults["default_to_email"] = to_email
             else:
@@ -10818,6 +14629,7 @@ def _record_invoice_payment_from_checkout_session(session_obj):
 
     conn = get_db_connection()
     cur = conn.cursor()
+    occurred_at = now_local()
 
     try:
         if checkout_session_id:
@@ -10842,189 +14654,542 @@ def _record_invoice_payment_from_checkout_session(session_obj):
                 conn.commit()
                 return
 
+        result = record_invoice_payment(
+            cur,
+            invoice_id,
+            amount_paid,
+            occurred_at=occurred_at,
+            source="stripe",
+            method="Stripe",
+            note="Stripe Checkout",
+            stripe_payment_intent_id=payment_intent_id,
+            stripe_checkout_session_id=checkout_session_id,
+        )
+
+        if not result:
+            conn.commit()
+            return
+
+        owner_user_id = result["user_id"]
+        invoice_number = result["invoice_number"]
+        balance = result["balance"]
+        total_paid_now = result["total_paid"]
+
+        events = result["events"] + [
+            {
+                "event_type": "stripe_payment",
+                "title": "Online payment received",
+                "details": f"Stripe payment received for invoice {invoice_number}: {format_currency(amount_paid)}.",
+                "visibility": "both",
+            }
+        ]
+
+        if balance > 0.0001:
+            insert_notification(
+                cur,
+                user_id=owner_user_id,
+                category="payment_alerts",
+                notification_type="partial_payment_received",
+                title=f"Partial payment received for {invoice_number}",
+                body=f"Total paid is now {format_currency(total_paid_now)}. Remaining balance: {format_currency(balance)}.",
+                link_url=f"/invoices/{invoice_id}",
+            )
+            events.append(
+                {
+                    "event_type": "partial_payment_received",
+                    "title": "Partial payment received",
+                    "details": f"Total paid is now {format_currency(total_paid_now)}. Remaining balance: {format_currency(balance)}.",
+                    "visibility": "both",
+                }
+            )
+        else:
+            insert_notification(
+                cur,
+                user_id=owner_user_id,
+                category="payment_alerts",
+                notification_type="final_payment_received",
+                title=f"Invoice {invoice_number} paid in full",
+                body="Stripe payment received and this invoice is now fully paid.",
+                link_url=f"/invoices/{invoice_id}",
+            )
+            events.append(
+                {
+                    "event_type": "final_payment_received",
+                    "title": "Final payment received",
+                    "details": f"Invoice {invoice_number} is now paid in full.",
+                    "visibility": "both",
+                }
+            )
+
+        insert_invoice_events(cur, invoice_id, events)
+
         cur.execute(
             """
-            INSERT INTO payments (
-                invoice_id,
-                amount,
-                method,
-                note,
-                stripe_payment_intent_id,
-                stripe_checkout_session_id,
-                payment_source,
-                payment_status,
-                occurred_at
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            SELECT c.email
+            FROM invoices i
+            LEFT JOIN clients c ON i.client_id = c.id
+            WHERE i.id = %s
             """,
-            (
-                invoice_id,
-                amount_paid,
-                "Stripe",
-                "Stripe Checkout",
-                payment_intent_id,
-                checkout_session_id,
-                "stripe",
-                "succeeded",
-                now_local(),
-            ),
+            (invoice_id,),
         )
+        email_row = cur.fetchone()
+        client_email = email_row[0] if email_row else None
 
-        if payment_intent_id:
-            cur.execute(
-                "UPDATE invoices SET stripe_last_payment_intent_id = %s WHERE id = %s",
-                (payment_intent_id, invoice_id),
-            )
+        conn.commit()
+
+    except psycopg2.errors.UniqueViolation:
+        # A concurrent delivery of the same session recorded it first.
+        conn.rollback()
+        logger.info("[Stripe] Payment already recorded for checkout session %s", checkout_session_id)
+        return
+    except Exception:
+        conn.rollback()
+        logger.exception("[Stripe] Error recording invoice payment")
+        raise
+    finally:
+        cur.close()
+        conn.close()
 
-        cur.execute("SELECT user_id, amount, invoice_number FROM invoices WHERE id = %s", (invoice_id,))
-        inv = cur.fetchone()
+    # The payment is committed from here on. A failure must not reach the
+    # worker: its retry would stop at the dedup check and the email would
+    # never go out.
+    try:
+        invalidate_invoice_pdf_cache(invoice_id)
 
-        if inv:
-            owner_user_id = inv[0]
-            inv_total = float(inv[1] or 0)
-            invoice_number = inv[2] or f"#{invoice_id}"
+        if client_email:
+            if balance > 0.0001:
+                send_invoice_notification_email(invoice_id, client_email, "partial_payment_confirmation")
+            else:
+                send_invoice_notification_email(invoice_id, client_email, "paid_in_full_confirmation")
+    except Exception:
+        logger.exception("[Stripe] Post-payment follow-up failed for invoice_id=%s", invoice_id)
 
-            cur.execute(
-                "SELECT COALESCE(SUM(amount), 0) FROM payments WHERE invoice_id = %s",
-                (invoice_id,),
-            )
-            total_paid = float(cur.fetchone()[0] or 0)
 
-            cur.execute(
-                """
-                UPDATE invoices
-                SET last_payment_recorded_at = %s,
-                    last_collection_action_at = %s
-                WHERE id = %s
-                """,
-                (now_local(), now_local(), invoice_id),
-            )
+def _handle_subscription_checkout_completed(session_obj):
+    metadata = session_obj.get("metadata") or {}
+    user_id_str = metadata.get("user_id") or session_obj.get("client_reference_id")
+    plan_key = normalize_plan_key(metadata.get("plan_key") or "pro")
 
-            conn.commit()
-            summary = sync_invoice_status(invoice_id) or get_invoice_payment_summary(invoice_id) or {}
-            balance = float(summary.get("balance") or 0)
-            total_paid_now = float(summary.get("total_paid") or 0)
-
-            log_invoice_event(
-                invoice_id=invoice_id,
-                event_type="stripe_payment",
-                title="Online payment received",
-                details=f"Stripe payment received for invoice {invoice_number}: {format_currency(amount_paid)}.",
-                visibility="both",
+    stripe_customer_id = session_obj.get("customer")
+    stripe_subscription_id = session_obj.get("subscription")
+
+    logger.info(
+        "[Stripe] subscription checkout.session.completed user_id_str=%s customer=%s sub=%s plan_key=%s",
+        user_id_str,
+        stripe_customer_id,
+        stripe_subscription_id,
+        plan_key,
+    )
+
+    if not user_id_str:
+        logger.warning("[Stripe] Missing user_id for subscription checkout")
+        return
+
+    try:
+        user_id = int(user_id_str)
+    except ValueError:
+        logger.warning("[Stripe] Bad user_id in metadata: %s", user_id_str)
+        return
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(
+            """
+            UPDATE users
+            SET plan = %s,
+                stripe_customer_id = COALESCE(%s, stripe_customer_id),
+                stripe_subscription_id = COALESCE(%s, stripe_subscription_id)
+            WHERE id = %s
+            """,
+            (plan_key, stripe_customer_id, stripe_subscription_id, user_id),
+        )
+        conn.commit()
+        invalidate_request_identity(user_id)
+        logger.info("[Stripe] Upgraded user %s to %s (rows_updated=%s)", user_id, plan_key, cur.rowcount)
+    except Exception:
+        conn.rollback()
+        logger.exception("[Stripe] DB error upgrading user %s", user_id)
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _sync_subscription_plan(sub):
+    customer_id = sub["customer"] if "customer" in sub else None
+    status = (sub["status"] if "status" in sub else "").lower()
+    sub_metadata = sub["metadata"] if "metadata" in sub else {}
+
+    paid_plan = normalize_plan_key((sub_metadata or {}).get("plan_key") or "pro")
+    new_plan = paid_plan if status in ("active", "trialing") else "free"
+
+    logger.info(
+        "[Stripe] Subscription sync customer=%s sub=%s status=%s => plan=%s",
+        customer_id,
+        sub["id"],
+        status,
+        new_plan,
+    )
+
+    if not customer_id:
+        return
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE users
+            SET plan = %s,
+                stripe_subscription_id = %s
+            WHERE stripe_customer_id = %s
+            """,
+            (new_plan, sub["id"], customer_id),
+        )
+
+        conn.commit()
+        invalidate_request_identity()
+        logger.info("[Stripe] Subscription sync rows_updated=%s", cursor.rowcount)
+    except Exception:
+        conn.rollback()
+        logger.exception("[Stripe] subscription sync error")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def process_stripe_event(event):
+    """Apply one verified Stripe event. Raises so the queue can retry it."""
+    event_type = event["type"]
+    logger.info("[Stripe] Processing event: %s id=%s", event_type, event.get("id"))
+
+    # =========================
+    # CHECKOUT COMPLETED
+    # =========================
+    if event_type == "checkout.session.completed":
+        session_obj = event["data"]["object"]
+        mode = (session_obj["mode"] if "mode" in session_obj else "").lower()
+
+        if mode == "payment":
+            _record_invoice_payment_from_checkout_session(session_obj)
+        elif mode == "subscription":
+            _handle_subscription_checkout_completed(session_obj)
+        else:
+            logger.info("[Stripe] Unsupported checkout mode=%s", mode)
+        return
+
+    # =========================
+    # SUBSCRIPTION EVENTS
+    # =========================
+    if event_type in ("customer.subscription.updated", "customer.subscription.deleted"):
+        _sync_subscription_plan(event["data"]["object"])
+
+
+# -------------------------
+# STRIPE EVENT QUEUE
+# -------------------------
+# The webhook only verifies and stores the event (the Stripe event id is the
+# primary key, so redeliveries are no-ops) and returns 200. Events that touch
+# the same invoice or customer share an ordering_key and are applied one at
+# a time in Stripe's order; different keys run in parallel.
+
+
+def stripe_event_ordering_key(event) -> str:
+    obj = ((event.get("data") or {}).get("object")) or {}
+    metadata = obj.get("metadata") or {}
+
+    if event.get("type") == "checkout.session.completed" and (obj.get("mode") or "").lower() == "payment":
+        if metadata.get("invoice_id"):
+            return f"invoice:{metadata['invoice_id']}"
+
+    if obj.get("customer"):
+        return f"customer:{obj['customer']}"
+
+    user_id = metadata.get("user_id") or obj.get("client_reference_id")
+    if user_id:
+        return f"user:{user_id}"
+
+    return f"event:{event.get('id')}"
+
+
+def store_stripe_event(event) -> bool:
+    """Persist a verified event. Returns False if it was already stored."""
+    created = event.get("created")
+    stripe_created_at = (
+        datetime.fromtimestamp(int(created), APP_TIMEZONE).replace(tzinfo=None) if created else None
+    )
+    now_dt = now_local()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO stripe_events (
+                event_id, event_type, ordering_key, payload,
+                stripe_created_at, next_attempt_at, received_at
             )
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (event_id) DO NOTHING
+            """,
+            (
+                event["id"],
+                event["type"],
+                stripe_event_ordering_key(event),
+                json.dumps(event),
+                stripe_created_at or now_dt,
+                now_dt,
+                now_dt,
+            ),
+        )
+        inserted = cur.rowcount == 1
+        if inserted:
+            cur.execute("SELECT pg_notify(%s, %s)", (STRIPE_EVENTS_CHANNEL, event["id"]))
+        conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
 
-            if balance > 0.0001:
-                create_notification_if_enabled(
-                    user_id=owner_user_id,
-                    category="payment_alerts",
-                    notification_type="partial_payment_received",
-                    title=f"Partial payment received for {invoice_number}",
-                    body=f"Total paid is now {format_currency(total_paid_now)}. Remaining balance: {format_currency(balance)}.",
-                    link_url=f"/invoices/{invoice_id}",
-                )
 
-                log_invoice_event(
-                    invoice_id=invoice_id,
-                    event_type="partial_payment_received",
-                    title="Partial payment received",
-                    details=f"Total paid is now {format_currency(total_paid_now)}. Remaining balance: {format_currency(balance)}.",
-                    visibility="both",
-                )
-            else:
-                create_notification_if_enabled(
-                    user_id=owner_user_id,
-                    category="payment_alerts",
-                    notification_type="final_payment_received",
-                    title=f"Invoice {invoice_number} paid in full",
-                    body="Stripe payment received and this invoice is now fully paid.",
-                    link_url=f"/invoices/{invoice_id}",
-                )
+def claim_stripe_events(limit: int):
+    """
+    Lock up to `limit` due events, at most one per ordering_key and only the
+    oldest open event for that key, so per-invoice/customer order holds even
+    with several workers. Events left 'processing' by a dead worker are
+    reclaimed after STRIPE_EVENTS_LOCK_TIMEOUT_SECONDS.
+    """
+    now_dt = now_local()
+    stale_before = now_dt - timedelta(seconds=STRIPE_EVENTS_LOCK_TIMEOUT_SECONDS)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE stripe_events e
+            SET status = 'processing',
+                locked_at = %s,
+                attempts = e.attempts + 1
+            WHERE e.event_id IN (
+                SELECT s.event_id
+                FROM stripe_events s
+                WHERE ((s.status = 'pending' AND s.next_attempt_at <= %s)
+                       OR (s.status = 'processing' AND s.locked_at < %s))
+                  AND NOT EXISTS (
+                      SELECT 1
+                      FROM stripe_events p
+                      WHERE p.ordering_key = s.ordering_key
+                        AND p.status IN ('pending', 'processing')
+                        AND (p.stripe_created_at, p.received_at, p.event_id)
+                            < (s.stripe_created_at, s.received_at, s.event_id)
+                  )
+                ORDER BY s.stripe_created_at ASC, s.received_at ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING e.event_id, e.event_type, e.payload, e.attempts
+            """,
+            (now_dt, now_dt, stale_before, limit),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    return [dict(zip(("event_id", "event_type", "payload", "attempts"), row)) for row in rows]
 
-                log_invoice_event(
-                    invoice_id=invoice_id,
-                    event_type="final_payment_received",
-                    title="Final payment received",
-                    details=f"Invoice {invoice_number} is now paid in full.",
-                    visibility="both",
-                )
 
-            cur.execute(
-                """
-                SELECT c.email
-                FROM invoices i
-                LEFT JOIN clients c ON i.client_id = c.id
-                WHERE i.id = %s
-                """,
-                (invoice_id,),
-            )
-            email_row = cur.fetchone()
-            client_email = email_row[0] if email_row else None
+def finish_stripe_event(row: dict, error: str = None) -> str:
+    """Record the outcome of one attempt. Returns 'processed', 'retry' or 'dead'."""
+    now_dt = now_local()
 
-            if client_email:
-                if balance > 0.0001:
-                    send_invoice_notification_email(invoice_id, client_email, "partial_payment_confirmation")
-                else:
-                    send_invoice_notification_email(invoice_id, client_email, "paid_in_full_confirmation")
-        else:
-            conn.commit()
+    if error is None:
+        outcome = "processed"
+        sql = """
+            UPDATE stripe_events
+            SET status = 'processed', processed_at = %s, locked_at = NULL, last_error = NULL
+            WHERE event_id = %s
+        """
+        params = (now_dt, row["event_id"])
+    else:
+        outcome = "dead" if row["attempts"] >= STRIPE_EVENTS_MAX_ATTEMPTS else "retry"
+        delay = min(
+            STRIPE_EVENTS_RETRY_BASE_SECONDS * (2 ** max(row["attempts"] - 1, 0)),
+            STRIPE_EVENTS_RETRY_MAX_SECONDS,
+        )
+        sql = """
+            UPDATE stripe_events
+            SET status = %s, next_attempt_at = %s, locked_at = NULL, last_error = %s
+            WHERE event_id = %s
+        """
+        params = (
+            "dead" if outcome == "dead" else "pending",
+            now_dt + timedelta(seconds=delay),
+            error[:2000],
+            row["event_id"],
+        )
 
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        conn.commit()
     except Exception:
         conn.rollback()
-        logger.exception("[Stripe] Error recording invoice payment")
+        raise
     finally:
         cur.close()
         conn.close()
 
+    if outcome != "processed":
+        logger.warning(
+            "[StripeEvents] %s attempt=%s -> %s: %s",
+            row["event_id"],
+            row["attempts"],
+            outcome,
+            error,
+        )
+    return outcome
 
-def _handle_subscription_checkout_completed(session_obj):
-    metadata = session_obj.get("metadata") or {}
-    user_id_str = metadata.get("user_id") or session_obj.get("client_reference_id")
-    plan_key = normalize_plan_key(metadata.get("plan_key") or "pro")
 
-    stripe_customer_id = session_obj.get("customer")
-    stripe_subscription_id = session_obj.get("subscription")
+def run_stripe_event(row: dict) -> str:
+    try:
+        process_stripe_event(row["payload"])
+    except Exception as e:
+        return finish_stripe_event(row, f"{type(e).__name__}: {e}")
+    return finish_stripe_event(row)
 
-    logger.info(
-        "[Stripe] subscription checkout.session.completed user_id_str=%s customer=%s sub=%s plan_key=%s",
-        user_id_str,
-        stripe_customer_id,
-        stripe_subscription_id,
-        plan_key,
-    )
 
-    if not user_id_str:
-        logger.warning("[Stripe] Missing user_id for subscription checkout")
-        return
+def process_stripe_event_batch(executor, limit: int = None):
+    """Claim one batch and apply it on the executor. Returns outcome counts."""
+    counts = {"processed": 0, "retry": 0, "dead": 0}
+    rows = claim_stripe_events(limit or STRIPE_EVENTS_BATCH_SIZE)
+    for outcome in executor.map(run_stripe_event, rows):
+        counts[outcome] += 1
+    return counts
 
-    try:
-        user_id = int(user_id_str)
-    except ValueError:
-        logger.warning("[Stripe] Bad user_id in metadata: %s", user_id_str)
+
+@app.cli.command("stripe-events-worker")
+@click.option("--once", is_flag=True, help="Apply what is due now, then exit.")
+@click.option("--workers", default=STRIPE_EVENTS_WORKERS, show_default=True, type=int)
+@click.option("--batch-size", default=STRIPE_EVENTS_BATCH_SIZE, show_default=True, type=int)
+@click.option("--poll-interval", default=STRIPE_EVENTS_POLL_SECONDS, show_default=True, type=float)
+def stripe_events_worker_command(once, workers, batch_size, poll_interval):
+    """Apply stored Stripe webhook events, in order per invoice/customer."""
+    listener = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="stripe-events") as executor:
+        while True:
+            try:
+                counts = process_stripe_event_batch(executor, batch_size)
+            except Exception:
+                logger.exception("[StripeEvents] Batch failed")
+                counts = {"processed": 0, "retry": 0, "dead": 0}
+
+            processed = sum(counts.values())
+            if processed:
+                logger.info(
+                    "[StripeEvents] processed=%s retry=%s dead=%s",
+                    counts["processed"],
+                    counts["retry"],
+                    counts["dead"],
+                )
+                continue
+
+            if once:
+                break
+
+            # Retries that come due are picked up by the poll.
+            try:
+                if listener is None or listener.closed:
+                    listener = open_notification_listener(STRIPE_EVENTS_CHANNEL)
+                wait_for_notify(listener, poll_interval)
+            except Exception:
+                logger.exception("[StripeEvents] Listener failed")
+                listener = None
+                time.sleep(max(poll_interval, 0.1))
+
+
+@app.cli.command("stripe-events-replay")
+@click.option("--event-id", "event_ids", multiple=True, help="Replay these events (repeatable).")
+@click.option("--status", "statuses", multiple=True, type=click.Choice(["dead", "processed"]), help="Replay every event in this status.")
+@click.option("--since-hours", default=None, type=float, help="Only events Stripe created in the last N hours.")
+@click.option("--fetch", is_flag=True, help="First pull events from the Stripe API (needs --since-hours) and store any the webhook missed.")
+@click.option("--dry-run", is_flag=True)
+def stripe_events_replay_command(event_ids, statuses, since_hours, fetch, dry_run):
+    """Re-queue stored Stripe events, optionally backfilling missed ones from Stripe."""
+    since = now_local() - timedelta(hours=since_hours) if since_hours is not None else None
+
+    if fetch:
+        if since is None:
+            raise click.UsageError("--fetch needs --since-hours.")
+        if not STRIPE_SECRET_KEY:
+            raise click.UsageError("STRIPE_SECRET_KEY is not set.")
+
+        created_gte = int(since.replace(tzinfo=APP_TIMEZONE).timestamp())
+        fetched = stored = 0
+        for event in stripe.Event.list(created={"gte": created_gte}, limit=100).auto_paging_iter():
+            fetched += 1
+            if not dry_run and store_stripe_event(event.to_dict()):
+                stored += 1
+        click.echo(f"Fetched {fetched} events from Stripe, stored {stored} new.")
+
+    if not event_ids and not statuses:
         return
 
+    conditions, params = [], []
+    if event_ids:
+        conditions.append("event_id = ANY(%s)")
+        params.append(list(event_ids))
+    if statuses:
+        conditions.append("status = ANY(%s)")
+        params.append(list(statuses))
+    where = "(" + " OR ".join(conditions) + ") AND status <> 'processing'"
+    if since is not None:
+        where += " AND stripe_created_at >= %s"
+        params.append(since)
+
     conn = get_db_connection()
     cur = conn.cursor()
-
     try:
+        if dry_run:
+            cur.execute(f"SELECT event_id, event_type, status FROM stripe_events WHERE {where} ORDER BY stripe_created_at", params)
+            for event_id, event_type, status in cur.fetchall():
+                click.echo(f"{event_id} {event_type} {status}")
+            conn.rollback()
+            return
+
         cur.execute(
-            """
-            UPDATE users
-            SET plan = %s,
-                stripe_customer_id = COALESCE(%s, stripe_customer_id),
-                stripe_subscription_id = COALESCE(%s, stripe_subscription_id)
-            WHERE id = %s
+            f"""
+            UPDATE stripe_events
+            SET status = 'pending', attempts = 0, next_attempt_at = %s,
+                locked_at = NULL, last_error = NULL
+            WHERE {where}
             """,
-            (plan_key, stripe_customer_id, stripe_subscription_id, user_id),
+            [now_local(), *params],
         )
+        requeued = cur.rowcount
+        cur.execute("SELECT pg_notify(%s, %s)", (STRIPE_EVENTS_CHANNEL, "replay"))
         conn.commit()
-        logger.info("[Stripe] Upgraded user %s to %s (rows_updated=%s)", user_id, plan_key, cur.rowcount)
     except Exception:
         conn.rollback()
-        logger.exception("[Stripe] DB error upgrading user %s", user_id)
+        raise
     finally:
         cur.close()
         conn.close()
 
+    click.echo(f"Re-queued {requeued} Stripe events.")
+
 
 @app.route("/stripe/webhook", methods=["POST"])
 def stripe_webhook():
@@ -11036,11 +15201,12 @@ def stripe_webhook():
         return "", 200  # ⚠️ DO NOT RETURN 500
 
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload=payload,
             sig_header=sig_header,
             secret=STRIPE_WEBHOOK_SECRET,
         )
+        event = json.loads(payload)
     except ValueError:
         logger.warning("[Stripe] Invalid payload")
         return "", 400
@@ -11049,77 +15215,14 @@ def stripe_webhook():
         return "", 400
 
     try:
-        event_type = event["type"]
-        logger.info("[Stripe] Received event: %s", event_type)
-
-        # =========================
-        # CHECKOUT COMPLETED
-        # =========================
-        if event_type == "checkout.session.completed":
-            session_obj = event["data"]["object"]
-            mode = (session_obj["mode"] if "mode" in session_obj else "").lower()
-
-            if mode == "payment":
-                _record_invoice_payment_from_checkout_session(session_obj)
-                return "", 200
-
-            if mode == "subscription":
-                _handle_subscription_checkout_completed(session_obj)
-                return "", 200
-
-            logger.info("[Stripe] Unsupported checkout mode=%s", mode)
-            return "", 200
-
-        # =========================
-        # SUBSCRIPTION EVENTS
-        # =========================
-        if event_type in ("customer.subscription.updated", "customer.subscription.deleted"):
-            sub = event["data"]["object"]
-
-            customer_id = sub["customer"] if "customer" in sub else None
-            status = (sub["status"] if "status" in sub else "").lower()
-            sub_metadata = sub["metadata"] if "metadata" in sub else {}
-
-            paid_plan = normalize_plan_key(sub_metadata.get("plan_key") or "pro")
-            new_plan = paid_plan if status in ("active", "trialing") else "free"
-
-            logger.info(
-                "[Stripe] Subscription sync customer=%s sub=%s status=%s => plan=%s",
-                customer_id,
-                sub["id"],
-                status,
-                new_plan,
-            )
-
-            if customer_id:
-                try:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-
-                    cursor.execute(
-                        """
-                        UPDATE users
-                        SET plan = %s,
-                            stripe_subscription_id = %s
-                        WHERE stripe_customer_id = %s
-                        """,
-                        (new_plan, sub["id"], customer_id),
-                    )
-
-                    conn.commit()
-                    logger.info("[Stripe] Subscription sync rows_updated=%s", cursor.rowcount)
-
-                    cursor.close()
-                    conn.close()
-                except Exception:
-                    logger.exception("[Stripe] subscription sync error")
-
-        return "", 200
+        stored = store_stripe_event(event)
+    except Exception:
+        # Nothing has been applied yet, so let Stripe redeliver.
+        logger.exception("[Stripe] Failed to store event %s", event.get("id"))
+        return "", 500
 
-    except Exception as e:
-        # 🚨 THIS IS WHAT STOPS STRIPE RETRIES
-        logger.exception("[Stripe] CRITICAL WEBHOOK ERROR: %s", str(e))
-        return "", 200
+    logger.info("[Stripe] Received event: %s id=%s queued=%s", event.get("type"), event.get("id"), stored)
+    return "", 200
 
 
 # -------------------------
@@ -11134,6 +15237,9 @@ def health():
             "timezone": str(APP_TIMEZONE),
             "stripe_configured": bool(STRIPE_SECRET_KEY),
             "ai_configured": bool(OPENAI_API_KEY),
+            "db_pool": get_db_pool_stats(),
+            "pdf_render": get_pdf_render_stats(),
+            "message_stream": get_message_stream_stats(),
         }
     ), 200
 
@@ -11181,28 +15287,8 @@ def ensure_messages_is_read_column():
 
 
 # Run once on startup
-ensure_messages_is_read_column()
-
-
-def increment_unread_count(conversation_id, user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            UPDATE conversations
-            SET unread_count = COALESCE(unread_count, 0) + 1
-            WHERE id = %s
-            """,
-            (conversation_id,),
-        )
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.warning("Unread increment failed: %s", e)
-    finally:
-        cur.close()
-        conn.close()
+if __name__ != "__mp_main__":
+    ensure_messages_is_read_column()
 
 
 def send_message_in_conversation(
@@ -11226,6 +15312,8 @@ def send_message_in_conversation(
             return None
 
         # 2. Insert message
+        message_text = (message_text or "").strip()
+        created_at = now_local()
         cur.execute(
             """
             INSERT INTO messages (
@@ -11241,21 +15329,24 @@ def send_message_in_conversation(
             (
                 conversation_id,
                 sender_user_id,
-                (message_text or "").strip(),
-                now_local(),
+                message_text,
+                created_at,
             ),
         )
 
         message_id = cur.fetchone()[0]
+        record_conversation_last_message(cur, conversation_id, message_id, created_at, message_text)
+        publish_conversation_message(cur, conversation_id, message_id, sender_user_id)
 
-        # 3. Increment unread count for the OTHER user
+        # 3. Increment unread count for the OTHER user (same transaction)
         recipient_user_id = (
             client_user_id
             if sender_user_id == business_user_id
             else business_user_id
         )
 
-        increment_unread_count(conversation_id, recipient_user_id)
+        if recipient_user_id and recipient_user_id != sender_user_id:
+            increment_unread_count(cur, conversation_id, recipient_user_id)
 
         conn.commit()
         return {
@@ -11274,23 +15365,7 @@ def send_message_in_conversation(
 
 
 def get_total_unread_messages(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            SELECT COALESCE(SUM(unread_count), 0)
-            FROM conversations
-            WHERE business_user_id = %s
-               OR client_user_id = %s
-            """,
-            (user_id, user_id),
-        )
-        result = cur.fetchone()
-        return result[0] if result else 0
-    finally:
-        cur.close()
-        conn.close()
+    return get_unread_message_count(user_id)
 
 
 @app.route("/ios/activate-subscription", methods=["POST"])
@@ -11357,6 +15432,8 @@ def ios_activate_subscription():
         cursor.close()
         conn.close()
 
+        invalidate_request_identity(user_id)
+
         logger.info(
             "[iOS Activate Subscription] user_id=%s upgraded to %s via product_id=%s transaction_id=%s original_transaction_id=%s",
             user_id,
@@ -11396,6 +15473,254 @@ def api_account_plan():
     ), 200
 
 
+# -------------------------
+# BENCHMARKS
+# -------------------------
+# Developer commands that seed a throwaway user, time a code path at several
+# data sizes and clean up afterwards. Point DATABASE_URL at a scratch
+# database before running them.
+def parse_benchmark_sizes(raw: str):
+    sizes = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            sizes.append(int(part))
+    return sizes
+
+
+def time_call_ms(fn, repeat: int = 5):
+    fn()  # warm the pool and Postgres caches
+    samples = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def create_benchmark_user():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO users (email, password_hash, plan, is_active)
+            VALUES (%s, NULL, 'pro', TRUE)
+            RETURNING id
+            """,
+            (f"bench-{uuid.uuid4().hex[:12]}@example.invalid",),
+        )
+        user_id = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return user_id
+
+
+def seed_benchmark_invoices(user_id: int, count: int):
+    """
+    Add `count` invoices for user_id: roughly half paid in full, a quarter
+    partially paid and the rest open, spread over the last two years.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO invoices (
+                client, amount, created_at, status, invoice_number, due_date, notes, user_id, view_count
+            )
+            SELECT
+                'Client ' || (g %% 250),
+                ((g * 37) %% 900) + 100,
+                %(now)s - ((g %% 730) || ' days')::interval,
+                'Sent',
+                'BENCH-' || lpad(g::text, 7, '0'),
+                %(now)s - ((g %% 730) || ' days')::interval + interval '30 days',
+                'Benchmark invoice ' || g || ' for consulting work',
+                %(user_id)s,
+                g %% 3
+            FROM generate_series(1, %(count)s) AS g
+            """,
+            {"user_id": user_id, "count": count, "now": now_local()},
+        )
+        cur.execute(
+            """
+            INSERT INTO invoice_items (invoice_id, description, amount)
+            SELECT i.id, 'Line item ' || (i.id %% 40), i.amount
+            FROM invoices i
+            WHERE i.user_id = %s
+            """,
+            (user_id,),
+        )
+        cur.execute(
+            """
+            INSERT INTO payments (invoice_id, amount, method, payment_source, payment_status, occurred_at)
+            SELECT
+                i.id,
+                CASE WHEN i.id %% 4 = 0 THEN i.amount / 2 ELSE i.amount END,
+                'manual',
+                'manual',
+                'succeeded',
+                i.created_at + ((i.id %% 45) || ' days')::interval
+            FROM invoices i
+            WHERE i.user_id = %s
+              AND i.id %% 4 IN (0, 1, 2)
+            """,
+            (user_id,),
+        )
+        conn.commit()
+
+        # Fresh statistics, or the planner still thinks the tables are tiny and
+        # nests the rollup repair below into a quadratic loop.
+        cur.execute("ANALYZE invoices")
+        cur.execute("ANALYZE payments")
+        cur.execute(
+            f"""
+            {INVOICE_PAYMENT_ROLLUP_REPAIR_SQL}
+              AND i.user_id = %s
+            """,
+            (user_id,),
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    update_overdue_statuses(user_id)
+    rebuild_dashboard_rollups(user_id)
+
+
+def delete_benchmark_user(user_id: int):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM user_daily_revenue WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM user_client_totals WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM user_item_totals WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM invoices WHERE user_id = %s", (user_id,))
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@app.cli.command("benchmark-receivables")
+@click.option("--sizes", default="100,1000,5000,20000", show_default=True, help="Comma-separated invoice counts.")
+@click.option("--repeat", default=5, show_default=True, type=int)
+def benchmark_receivables_command(sizes, repeat):
+    """Time get_dashboard_receivables_metrics() as a user's invoice count grows.
+
+    The per-invoice column shows the scaling: a flat value means the cost
+    grows linearly with the invoice count.
+    """
+    click.echo(f"{'invoices':>10}  {'median ms':>10}  {'us/invoice':>10}")
+    for size in parse_benchmark_sizes(sizes):
+        user_id = create_benchmark_user()
+        try:
+            seed_benchmark_invoices(user_id, size)
+            elapsed = time_call_ms(lambda: get_dashboard_receivables_metrics(user_id), repeat)
+            click.echo(f"{size:>10}  {elapsed:>10.2f}  {elapsed * 1000.0 / max(size, 1):>10.2f}")
+        finally:
+            delete_benchmark_user(user_id)
+
+
+@app.cli.command("benchmark-search")
+@click.option("--invoices", "invoice_count", default=100000, show_default=True, type=int)
+@click.option("--repeat", default=5, show_default=True, type=int)
+def benchmark_search_command(invoice_count, repeat):
+    """Compare indexed invoice search with the old LOWER(col) LIKE '%q%' scan."""
+
+    def legacy_search(user_id, q):
+        like = f"%{q.lower()}%"
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT id, client, amount, created_at, status, invoice_number
+                FROM invoices
+                WHERE user_id = %s
+                  AND (
+                        LOWER(client) LIKE %s
+                     OR LOWER(COALESCE(invoice_number, '')) LIKE %s
+                     OR LOWER(COALESCE(notes, '')) LIKE %s
+                     OR LOWER(COALESCE(terms, '')) LIKE %s
+                  )
+                ORDER BY created_at DESC
+                LIMIT 50
+                """,
+                (user_id, like, like, like, like),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+            conn.close()
+
+    queries = ["Client 42", "BENCH-00077", "consulting", "zzz-no-match"]
+    click.echo(f"pg_trgm enabled: {_SEARCH_FEATURES['trigram']}, search_vector: {_SEARCH_FEATURES['fulltext']}")
+
+    user_id = create_benchmark_user()
+    try:
+        seed_benchmark_invoices(user_id, invoice_count)
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("ANALYZE invoices")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        click.echo(f"{'query':<16}  {'indexed ms':>10}  {'legacy ms':>10}  {'hits':>5}")
+        for q in queries:
+            indexed_ms = time_call_ms(lambda: search_invoices_for_user(user_id, q), repeat)
+            legacy_ms = time_call_ms(lambda: legacy_search(user_id, q), repeat)
+            hits = len(search_invoices_for_user(user_id, q))
+            click.echo(f"{q:<16}  {indexed_ms:>10.2f}  {legacy_ms:>10.2f}  {hits:>5}")
+    finally:
+        delete_benchmark_user(user_id)
+
+
+def build_benchmark_pdf_source(item_count: int, template_style: str = "modern"):
+    now = now_local()
+    return {
+        "render_version": INVOICE_PDF_RENDER_VERSION,
+        "invoice_id": 0,
+        "client": "Benchmark Client LLC",
+        "amount": 125.0 * item_count,
+        "created_at": now,
+        "due_date": now + timedelta(days=30),
+        "invoice_number": "BENCH-0000001",
+        "template_style": template_style,
+        "notes": "Benchmark invoice for consulting work. " * 4,
+        "terms": "Payment due within 30 days.",
+        "signature_data": None,
+        "items": [
+            (f"Line item {n}: on-site consulting, travel and follow-up documentation", 125.0)
+            for n in range(1, item_count + 1)
+        ],
+        "business_name": DEFAULT_BUSINESS_NAME,
+    }
+
+
+@app.cli.command("benchmark-pdf-render")
+@click.option("--items", "item_counts", default="1,20,500", show_default=True, help="Comma-separated line item counts.")
+@click.option("--style", "template_style", default="doodle", show_default=True, type=click.Choice(sorted(INVOICE_PDF_STYLES)))
+@click.option("--repeat", default=20, show_default=True, type=int)
+def benchmark_pdf_render_command(item_counts, template_style, repeat):
+    """Renders/sec with the precompiled chrome form vs redrawing chrome per page."""
+    click.echo(f"{'items':>6}  {'pages':>5}  {'form r/s':>9}  {'inline r/s':>10}")
+    for item_count in parse_benchmark_sizes(item_counts):
+        source = build_benchmark_pdf_source(item_count, template_style)
+        form_ms = time_call_ms(lambda: render_invoice_pdf(source), repeat)
+        inline_ms = time_call_ms(lambda: render_invoice_pdf(source, precompiled_chrome=False), repeat)
+        pages = len(re.findall(rb"/Type /Page\b", render_invoice_pdf(source)))
+        click.echo(f"{item_count:>6}  {pages:>5}  {1000.0 / form_ms:>9.1f}  {1000.0 / inline_ms:>10.1f}")
+
+
 # -------------------------
 # MAIN
 # -------------------------
@@ -0,0 +1,343 @@
+"""
+Invoice PDF rendering, ReportLab only.
+
+This lives outside app.py so that PDF render-pool processes import only this
+module. Importing app runs init_db() and opens database connections.
+"""
+import base64
+import io
+import logging
+
+from reportlab.lib.pagesizes import LETTER
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+logger = logging.getLogger("billbeam")
+
+# Each style's static chrome (decorations, header bar, footer) is described
+# once per process here. Invoices that run past one page compile it into a
+# form XObject, so continuation pages reuse it instead of redrawing it.
+INVOICE_PDF_MARGIN = 72
+INVOICE_PDF_BOTTOM_Y = 120
+INVOICE_PDF_AMOUNT_COLUMN_WIDTH = 110
+INVOICE_PDF_FOOTER_TEXT = "Created with BillBeam • Modern invoicing made simple • billbeam.app"
+
+
+def _draw_doodle_decorations(pdf, page_width, page_height):
+    pdf.setFillColorRGB(0.93, 0.95, 1.0)
+    pdf.circle(60, page_height - 120, 26, fill=1, stroke=0)
+    pdf.setFillColorRGB(0.96, 0.92, 1.0)
+    pdf.circle(page_width - 80, page_height - 200, 30, fill=1, stroke=0)
+    pdf.setFillColorRGB(0.90, 0.96, 0.98)
+    pdf.rect(page_width - 150, 40, 120, 60, fill=1, stroke=0)
+
+
+INVOICE_PDF_STYLES = {
+    "modern": {
+        "header_bar_color": (21 / 255, 27 / 255, 84 / 255),
+        "accent_color": (21 / 255, 27 / 255, 84 / 255),
+        "decorate": None,
+    },
+    "minimal": {
+        "header_bar_color": (0.18, 0.20, 0.24),
+        "accent_color": (0.6, 0.6, 0.65),
+        "decorate": None,
+    },
+    "bold": {
+        "header_bar_color": (0.97, 0.45, 0.09),
+        "accent_color": (0.97, 0.45, 0.09),
+        "decorate": None,
+    },
+    "doodle": {
+        "header_bar_color": (0.33, 0.27, 0.96),
+        "accent_color": (0.33, 0.27, 0.96),
+        "decorate": _draw_doodle_decorations,
+    },
+}
+
+
+def get_invoice_pdf_style(template_style: str):
+    style_name = (template_style or "modern").lower()
+    if style_name not in INVOICE_PDF_STYLES:
+        style_name = "modern"
+    return style_name, INVOICE_PDF_STYLES[style_name]
+
+
+def draw_invoice_pdf_chrome(pdf, style: dict):
+    page_width, page_height = LETTER
+
+    if style["decorate"]:
+        style["decorate"](pdf, page_width, page_height)
+
+    pdf.setFillColorRGB(*style["header_bar_color"])
+    pdf.rect(0, page_height - 60, page_width, 60, fill=1, stroke=0)
+
+    pdf.setFont("Helvetica", 8)
+    pdf.setFillColorRGB(0.45, 0.45, 0.45)
+    pdf.drawCentredString(page_width / 2, 20, INVOICE_PDF_FOOTER_TEXT)
+
+
+def _split_wide_pdf_token(token: str, font_name: str, font_size: float, width: float):
+    """Hard-break a token (URL, SKU) that is wider than `width` on its own."""
+    pieces = []
+    start = 0
+    piece_width = 0.0
+    for index, char in enumerate(token):
+        char_width = stringWidth(char, font_name, font_size)
+        if index > start and piece_width + char_width > width:
+            pieces.append(token[start:index])
+            start = index
+            piece_width = 0.0
+        piece_width += char_width
+    pieces.append(token[start:])
+    return pieces
+
+
+def wrap_pdf_text(text, font_name: str, font_size: float, width: float):
+    """Wrap text to `width` points, keeping the writer's own line breaks."""
+    lines = []
+    for paragraph in str(text or "").splitlines() or [""]:
+        # Most descriptions fit on one line. No base-14 glyph is wider than
+        # 1.015em, so short strings skip measuring and all skip the split.
+        if len(paragraph) * font_size * 1.015 <= width or stringWidth(paragraph, font_name, font_size) <= width:
+            lines.append(paragraph)
+            continue
+
+        # Base-14 fonts have no kerning, so a line's width is the sum of its
+        # words and spaces: each word is measured once.
+        space_width = stringWidth(" ", font_name, font_size)
+        line = ""
+        line_width = 0.0
+        for word in paragraph.split():
+            word_width = stringWidth(word, font_name, font_size)
+            if line and line_width + space_width + word_width <= width:
+                line = f"{line} {word}"
+                line_width += space_width + word_width
+                continue
+
+            if line:
+                lines.append(line)
+            if word_width > width:
+                *full_pieces, word = _split_wide_pdf_token(word, font_name, font_size, width)
+                lines.extend(full_pieces)
+                word_width = stringWidth(word, font_name, font_size)
+            line = word
+            line_width = word_width
+        lines.append(line)
+    return lines
+
+
+def render_invoice_pdf(source: dict, precompiled_chrome: bool = True) -> bytes:
+    invoice_id = source["invoice_id"]
+    client_name = source["client"]
+    created_at = source["created_at"]
+    due_date = source["due_date"]
+    invoice_number = source["invoice_number"]
+    notes = source["notes"]
+    terms = source["terms"]
+    signature_data = source["signature_data"]
+    items = source["items"]
+    business_name = source["business_name"]
+
+    amount_float = float(source["amount"])
+    style_name, style = get_invoice_pdf_style(source["template_style"])
+    accent_color = style["accent_color"]
+    inv_label = invoice_number or f"#{invoice_id}"
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=LETTER)
+    page_width, page_height = LETTER
+    left = INVOICE_PDF_MARGIN
+    right = page_width - INVOICE_PDF_MARGIN
+
+    # The chrome form is compiled on the first page break. Compiling it for
+    # page 1 as well made one-page invoices about 10% slower in
+    # benchmark-pdf-render, since the XObject is never reused there.
+    chrome_form = f"chrome_{style_name}"
+    chrome_state = {"compiled": False}
+
+    def start_page(subtitle=None):
+        if precompiled_chrome and pdf.getPageNumber() > 1:
+            if not chrome_state["compiled"]:
+                pdf.beginForm(chrome_form)
+                draw_invoice_pdf_chrome(pdf, style)
+                pdf.endForm()
+                chrome_state["compiled"] = True
+            pdf.doForm(chrome_form)
+        else:
+            draw_invoice_pdf_chrome(pdf, style)
+
+        pdf.setFillColorRGB(1, 1, 1)
+        pdf.setFont("Helvetica-Bold", 22)
+        pdf.drawString(left, page_height - 40, business_name)
+        if subtitle:
+            pdf.setFont("Helvetica", 10)
+            pdf.drawRightString(right, page_height - 38, subtitle)
+
+        pdf.setFillColorRGB(0.1, 0.1, 0.15)
+        return page_height - 90
+
+    def next_page():
+        pdf.showPage()
+        return start_page(f"{inv_label} (continued)")
+
+    def draw_item_header(y):
+        pdf.setFont("Helvetica", 11)
+        pdf.setFillColorRGB(0.3, 0.3, 0.35)
+        pdf.drawString(left, y, "Description")
+        pdf.drawRightString(right, y, "Amount")
+        y -= 12
+
+        pdf.setStrokeColorRGB(0.85, 0.87, 0.9)
+        pdf.line(left, y, right, y)
+        y -= 18
+
+        pdf.setFont("Helvetica", 10)
+        pdf.setFillColorRGB(0.1, 0.1, 0.15)
+        return y
+
+    def draw_section(title, text, y):
+        lines = wrap_pdf_text(text, "Helvetica", 10, right - left)
+        if y - 16 < INVOICE_PDF_BOTTOM_Y:
+            y = next_page()
+
+        pdf.setFont("Helvetica-Bold", 11)
+        pdf.setFillColorRGB(0.1, 0.1, 0.15)
+        pdf.drawString(left, y, title)
+        y -= 16
+
+        pdf.setFont("Helvetica", 10)
+        for line in lines:
+            if y < INVOICE_PDF_BOTTOM_Y:
+                y = next_page()
+                pdf.setFont("Helvetica", 10)
+            pdf.drawString(left, y, line)
+            y -= 12
+        return y - 8
+
+    y = start_page()
+
+    pdf.setFont("Helvetica", 11)
+    pdf.drawString(left, y, f"Invoice: {inv_label}")
+    y -= 16
+    pdf.drawString(left, y, f"Client: {client_name}")
+    y -= 16
+
+    if created_at:
+        pdf.drawString(left, y, f"Created: {created_at.strftime('%Y-%m-%d %I:%M %p')}")
+        y -= 16
+    if due_date:
+        pdf.drawString(left, y, f"Due: {due_date.strftime('%Y-%m-%d')}")
+        y -= 16
+
+    right_box_top = page_height - 90
+    right_box_left = page_width - 220
+    pdf.setFillColorRGB(1, 1, 1)
+    pdf.setStrokeColorRGB(*accent_color)
+    pdf.rect(right_box_left, right_box_top - 50, 180, 50, fill=1, stroke=1)
+
+    pdf.setFillColorRGB(0.1, 0.1, 0.15)
+    pdf.setFont("Helvetica-Bold", 11)
+    pdf.drawString(right_box_left + 10, right_box_top - 20, "Total")
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.setFillColorRGB(*accent_color)
+    pdf.drawRightString(right_box_left + 170, right_box_top - 30, f"${amount_float:,.2f}")
+
+    y = min(y - 16, right_box_top - 80)
+    pdf.setFillColorRGB(0.1, 0.1, 0.15)
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.drawString(left, y, "Line Items")
+    y -= 20
+    y = draw_item_header(y)
+
+    def begin_item_rows():
+        rows = pdf.beginText()
+        rows.setFont("Helvetica", 10)
+        rows.setFillColorRGB(0.1, 0.1, 0.15)
+        return rows
+
+    # One text object per page instead of one per drawString call.
+    description_width = right - left - INVOICE_PDF_AMOUNT_COLUMN_WIDTH
+    rows = begin_item_rows()
+    for desc, amt in items:
+        lines = wrap_pdf_text(desc, "Helvetica", 10, description_width)
+        for line_index, line in enumerate(lines):
+            if y < INVOICE_PDF_BOTTOM_Y:
+                pdf.drawText(rows)
+                y = draw_item_header(next_page())
+                rows = begin_item_rows()
+
+            # textLine, unlike textOut, does not measure the string to
+            # advance the cursor; every row sets its own origin anyway.
+            rows.setTextOrigin(left, y)
+            rows.textLine(line)
+            if line_index == 0:
+                amount_text = f"${float(amt):,.2f}"
+                rows.setTextOrigin(right - stringWidth(amount_text, "Helvetica", 10), y)
+                rows.textLine(amount_text)
+            y -= 12
+        y -= 4
+    pdf.drawText(rows)
+
+    y -= 8
+
+    if notes:
+        y = draw_section("Notes", notes, y)
+
+    if terms:
+        y = draw_section("Payment Terms", terms, y)
+
+    if signature_data:
+        try:
+            if signature_data.startswith("data:image"):
+                _, b64_data = signature_data.split(",", 1)
+            else:
+                b64_data = signature_data
+
+            sig_bytes = base64.b64decode(b64_data)
+            sig_buf = io.BytesIO(sig_bytes)
+            sig_img = ImageReader(sig_buf)
+
+            sig_box_height = 70
+            sig_box_width = 200
+
+            if y - sig_box_height - 10 < INVOICE_PDF_BOTTOM_Y - 40:
+                y = next_page()
+
+            pdf.setFont("Helvetica-Bold", 11)
+            pdf.setFillColorRGB(0.1, 0.1, 0.15)
+            pdf.drawString(left, y, "Client Signature")
+            y -= 10
+
+            pdf.setStrokeColorRGB(0.8, 0.82, 0.86)
+            pdf.rect(left, y - sig_box_height, sig_box_width, sig_box_height, fill=0, stroke=1)
+
+            pdf.drawImage(
+                sig_img,
+                left + 6,
+                y - sig_box_height + 6,
+                width=sig_box_width - 12,
+                height=sig_box_height - 12,
+                mask="auto",
+            )
+
+            y -= sig_box_height + 16
+        except Exception:
+            logger.warning("Failed to render signature for invoice_id=%s", invoice_id)
+
+    if y < INVOICE_PDF_BOTTOM_Y - 40:
+        y = next_page()
+
+    pdf.setStrokeColorRGB(0.85, 0.87, 0.9)
+    pdf.line(left, y, right, y)
+    y -= 24
+
+    pdf.setFont("Helvetica-Bold", 12)
+    pdf.setFillColorRGB(*accent_color)
+    pdf.drawRightString(right, y, f"Total Due: ${amount_float:,.2f}")
+
+    pdf.showPage()
+    pdf.save()
+    buffer.seek(0)
+    return buffer.getvalue()